@@ -1,24 +1,63 @@
 import os
-import json
 import uuid
+import json
+import hashlib
+import shutil
+import mimetypes
+import threading
 import subprocess
-import requests
+import time
+import openai
 import logging
-from io import BytesIO
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, g, request, send_file, jsonify
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from dotenv import load_dotenv
 from openai import AzureOpenAI
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import ClosingIterator
 from flask_cors import CORS
-
-# setup logging - detailed & verbose logs
-logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
+from cache import RedisResultCache, ResultCache, hash_file
+from uploads import UploadRequest, move_upload
+from chunking import extract_audio, transcribe_chunked
+from detection import PHRASES_SCHEMA, detect_windowed, parse_phrases
+from matching import Transcript, find_phrases, find_phrases_fuzzy, merge_intervals
+from probe import probe_keyframes, probe_media, media_duration, video_stream
+from metrics import (
+    AD_SECONDS_REMOVED,
+    AUDIO_SECONDS_PROCESSED,
+    BYTES_PROCESSED,
+    REQUESTS,
+    TRANSCRIBE_REALTIME_FACTOR,
+    latest_metrics,
+    new_request_id,
+    observe_stage,
+    request_id_var,
+    stage_timer,
+)
+from logconfig import configure_logging
+from prometheus_client import CONTENT_TYPE_LATEST
+from trimming import generate_stream_copy_trim_command, generate_video_stream_copy_trim_command, run_ffmpeg, video_encoder_args
+from boundaries import refine_cuts
+from transcribers import AzureSpeechTranscriber, FireworksTranscriber, LocalWhisperTranscriber, WordTimeline
+from upstream import Upstream, create_session
+from jobs import JobQueue, QueueFullError, create_job_store, public_job_fields
+from batches import BatchError, check_url, create_download_session, download, fetch_feed, item_filename, parse_manifest, resolve_local_path, run_items, write_archive
+# importing storage registers the sqlite:// rate limit storage scheme with flask-limiter
+from storage import redis_client
 
 load_dotenv()
 
+# setup logging - LOG_LEVEL=DEBUG gives detailed & verbose logs, LOG_FORMAT=json one json object per line.
+# per-word transcript logging is off unless LOG_WORD_TRACE_EVERY is set (1 logs every word, n one word in n)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+LOG_WORD_TRACE_EVERY = int(os.environ.get("LOG_WORD_TRACE_EVERY", "0"))
+configure_logging(LOG_LEVEL, LOG_FORMAT)
+
 app = Flask(__name__)
+# uploads stream straight to disk in chunks, so memory use doesn't grow with the file size
+app.request_class = UploadRequest
 CORS(app)
 
 # azure keys from .env
@@ -28,8 +67,8 @@ AZURE_API_ENDPOINT = os.environ.get("AZURE_API_ENDPOINT")
 AZURE_OPENAI_KEY = os.environ.get("AZURE_OPENAI_KEY")
 AZURE_OPENAI_DEPLOYMENT = os.environ.get("AZURE_OPENAI_DEPLOYMENT")
 AZURE_API_VERSION = os.environ.get("AZURE_API_VERSION")
+FIREWORKS_API_KEY = os.environ.get("FIREWORKS_API_KEY")
 logging.debug("ai_speech_resource_endpoint from .env: %s", AI_SPEECH_RESOURCE_ENDPOINT)
-logging.debug("ai_speech_primary_key from .env: %s", AI_SPEECH_PRIMARY_KEY)
 
 # getting rate limiting from .env
 RATE_LIMITING_ENABLED = os.environ.get("RATE_LIMITING_ENABLED")
@@ -42,129 +81,272 @@ else:
     RATE_LIMIT = None
     logging.debug("rate limiting is disabled")
 
+# where rate limit counters are kept. the default sqlite file is shared by every worker process on the node; use
+# redis://host:6379 when several replicas sit behind one load balancer, memory:// for a single process
+RATE_LIMIT_STORAGE_URI = os.environ.get("RATE_LIMIT_STORAGE_URI", "sqlite:///limits.db")
+logging.debug("rate_limit_storage_uri from .env: %s", RATE_LIMIT_STORAGE_URI)
+
+# redis connection from .env, used by the redis job store and result cache backends
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+# maximum upload size in bytes from .env, larger uploads are rejected with a 413
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(2 * 1024 ** 3)))
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
+logging.debug("max_upload_bytes from .env: %d", MAX_UPLOAD_BYTES)
+
+# result cache settings from .env
+CACHE_ENABLED = os.environ.get("CACHE_ENABLED", "true") == "true"
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "file")
+CACHE_DIR = os.environ.get("CACHE_DIR", "cache")
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+CACHE_MAX_AGE_SECONDS = int(os.environ.get("CACHE_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+CACHE_STORE_OUTPUT = os.environ.get("CACHE_STORE_OUTPUT", "true") == "true"
+logging.debug("cache_enabled from .env: %s, backend: %s", CACHE_ENABLED, CACHE_BACKEND)
+
+if CACHE_ENABLED and CACHE_BACKEND == "redis":
+    cache = RedisResultCache(redis_client(REDIS_URL), CACHE_DIR, CACHE_MAX_BYTES, CACHE_MAX_AGE_SECONDS, store_output=CACHE_STORE_OUTPUT)
+elif CACHE_ENABLED:
+    cache = ResultCache(CACHE_DIR, CACHE_MAX_BYTES, CACHE_MAX_AGE_SECONDS, store_output=CACHE_STORE_OUTPUT)
+else:
+    cache = None
+
+# chunked transcription settings from .env (TRANSCRIBE_CHUNK_MODE is "silence" or "fixed")
+TRANSCRIBE_CHUNKING = os.environ.get("TRANSCRIBE_CHUNKING", "false") == "true"
+TRANSCRIBE_CHUNK_MODE = os.environ.get("TRANSCRIBE_CHUNK_MODE", "silence")
+TRANSCRIBE_CHUNK_SECONDS = float(os.environ.get("TRANSCRIBE_CHUNK_SECONDS", "600"))
+TRANSCRIBE_CHUNK_OVERLAP_SECONDS = float(os.environ.get("TRANSCRIBE_CHUNK_OVERLAP_SECONDS", "4"))
+TRANSCRIBE_MAX_WORKERS = int(os.environ.get("TRANSCRIBE_MAX_WORKERS", "4"))
+logging.debug("transcribe_chunking from .env: %s, mode: %s", TRANSCRIBE_CHUNKING, TRANSCRIBE_CHUNK_MODE)
+
+# ad detection settings from .env (window sizes are in estimated llm tokens)
+DETECT_WINDOW_TOKENS = int(os.environ.get("DETECT_WINDOW_TOKENS", "12000"))
+DETECT_OVERLAP_TOKENS = int(os.environ.get("DETECT_OVERLAP_TOKENS", "1000"))
+DETECT_MAX_WORKERS = int(os.environ.get("DETECT_MAX_WORKERS", "4"))
+DETECT_MAX_OUTPUT_TOKENS = int(os.environ.get("DETECT_MAX_OUTPUT_TOKENS", "2000"))
+DETECT_STRUCTURED_OUTPUT = os.environ.get("DETECT_STRUCTURED_OUTPUT", "true") == "true"
+logging.debug("detect_window_tokens from .env: %d, overlap: %d", DETECT_WINDOW_TOKENS, DETECT_OVERLAP_TOKENS)
+
+# phrase matching settings from .env (MATCH_MODE is "exact" or "fuzzy")
+MATCH_MODE = os.environ.get("MATCH_MODE", "exact")
+MATCH_MAX_EDIT_RATIO = float(os.environ.get("MATCH_MAX_EDIT_RATIO", "0.2"))
+MATCH_TOKEN_SIMILARITY = float(os.environ.get("MATCH_TOKEN_SIMILARITY", "0.8"))
+logging.debug("match_mode from .env: %s", MATCH_MODE)
+
+# cut boundary snapping from .env: each cut edge moves to the nearest pause within SNAP_TOLERANCE_SECONDS,
+# and cuts closer together than SNAP_MERGE_GAP_SECONDS are joined
+SNAP_BOUNDARIES = os.environ.get("SNAP_BOUNDARIES", "true") == "true"
+SNAP_TOLERANCE_SECONDS = float(os.environ.get("SNAP_TOLERANCE_SECONDS", "0.5"))
+SNAP_SILENCE_DB = float(os.environ.get("SNAP_SILENCE_DB", "-45"))
+SNAP_MERGE_GAP_SECONDS = float(os.environ.get("SNAP_MERGE_GAP_SECONDS", "0.5"))
+logging.debug("snap_boundaries from .env: %s, tolerance: %s", SNAP_BOUNDARIES, SNAP_TOLERANCE_SECONDS)
+
+# trim engine from .env ("copy" stream-copies kept ranges where possible, "reencode" always re-encodes)
+TRIM_ENGINE = os.environ.get("TRIM_ENGINE", "copy")
+logging.debug("trim_engine from .env: %s", TRIM_ENGINE)
+
+# video trimming settings from .env: how far a kept range's start may move to reach a keyframe for stream copy,
+# and the x264 preset / crf used when video has to be re-encoded
+VIDEO_KEYFRAME_TOLERANCE_SECONDS = float(os.environ.get("VIDEO_KEYFRAME_TOLERANCE_SECONDS", "1.0"))
+VIDEO_ENCODE_PRESET = os.environ.get("VIDEO_ENCODE_PRESET", "veryfast")
+VIDEO_ENCODE_CRF = int(os.environ.get("VIDEO_ENCODE_CRF", "20"))
+logging.debug("video_keyframe_tolerance_seconds from .env: %s, encode preset: %s", VIDEO_KEYFRAME_TOLERANCE_SECONDS, VIDEO_ENCODE_PRESET)
+
+def settings_hash(*values):
+    return hashlib.sha256(json.dumps(values).encode()).hexdigest()[:12]
+
+# cached results are reused only under the settings they were made with: cached phrases carry a hash of the detection
+# settings, and each cached output is stored under a variant that includes a hash of every setting from detection on
+DETECT_SETTINGS_HASH = settings_hash(AZURE_OPENAI_DEPLOYMENT, DETECT_WINDOW_TOKENS, DETECT_OVERLAP_TOKENS, DETECT_MAX_OUTPUT_TOKENS, DETECT_STRUCTURED_OUTPUT)
+OUTPUT_SETTINGS_HASH = settings_hash(
+    DETECT_SETTINGS_HASH,
+    MATCH_MODE, MATCH_MAX_EDIT_RATIO, MATCH_TOKEN_SIMILARITY,
+    SNAP_BOUNDARIES, SNAP_TOLERANCE_SECONDS, SNAP_SILENCE_DB, SNAP_MERGE_GAP_SECONDS,
+    TRIM_ENGINE, VIDEO_KEYFRAME_TOLERANCE_SECONDS, VIDEO_ENCODE_PRESET, VIDEO_ENCODE_CRF,
+)
+
+# job queue settings from .env. JOBS_CONCURRENCY is for the whole server: under gunicorn the job threads are split
+# between the workers (init_worker)
+JOBS_BACKEND = os.environ.get("JOBS_BACKEND", "memory")
+JOBS_DB_PATH = os.environ.get("JOBS_DB_PATH", "jobs.db")
+JOBS_CONCURRENCY = int(os.environ.get("JOBS_CONCURRENCY", "2"))
+JOBS_MAX_QUEUE_DEPTH = int(os.environ.get("JOBS_MAX_QUEUE_DEPTH", "20"))
+JOBS_RESULT_TTL_SECONDS = int(os.environ.get("JOBS_RESULT_TTL_SECONDS", "3600"))
+# a running job whose worker hasn't refreshed its lease for this long is queued again, up to JOBS_MAX_ATTEMPTS runs
+JOBS_LEASE_SECONDS = int(os.environ.get("JOBS_LEASE_SECONDS", "300"))
+JOBS_MAX_ATTEMPTS = int(os.environ.get("JOBS_MAX_ATTEMPTS", "2"))
+logging.debug("jobs_backend from .env: %s, concurrency: %d, max queue depth: %d", JOBS_BACKEND, JOBS_CONCURRENCY, JOBS_MAX_QUEUE_DEPTH)
+
+# batch settings from .env: items per batch, items of one batch processed at once, the directory manifest paths
+# may point into (unset disables local paths) and the read timeout for downloading urls and feeds
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "500"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+BATCH_LOCAL_DIR = os.environ.get("BATCH_LOCAL_DIR") or None
+BATCH_DOWNLOAD_READ_TIMEOUT = float(os.environ.get("BATCH_DOWNLOAD_READ_TIMEOUT", "300"))
+# hosts manifest urls and feeds may be fetched from (comma-separated). unset, any host resolving only to public
+# addresses is allowed; set, only these hosts are, whatever they resolve to
+BATCH_ALLOWED_HOSTS = {host.strip().lower() for host in os.environ.get("BATCH_ALLOWED_HOSTS", "").split(",") if host.strip()}
+logging.debug("batch_max_items from .env: %d, concurrency: %d, local dir: %s", BATCH_MAX_ITEMS, BATCH_CONCURRENCY, BATCH_LOCAL_DIR)
+
+# how many files may be in each pipeline stage at once across /process, jobs and batches, so a batch can keep every
+# stage busy without, say, running more ffmpeg processes than there are cpus. under gunicorn each worker gets an
+# equal part (at least one), since a semaphore can't be shared between processes
+STAGE_TRANSCRIBE_CONCURRENCY = int(os.environ.get("STAGE_TRANSCRIBE_CONCURRENCY", "4"))
+STAGE_DETECT_CONCURRENCY = int(os.environ.get("STAGE_DETECT_CONCURRENCY", "4"))
+# left empty in .env.example, which means the default
+STAGE_FFMPEG_CONCURRENCY = int(os.environ.get("STAGE_FFMPEG_CONCURRENCY") or os.cpu_count() or 2)
+stage_slots = {
+    "transcribe": threading.BoundedSemaphore(STAGE_TRANSCRIBE_CONCURRENCY),
+    "detect": threading.BoundedSemaphore(STAGE_DETECT_CONCURRENCY),
+    "ffmpeg": threading.BoundedSemaphore(STAGE_FFMPEG_CONCURRENCY),
+}
+logging.debug("stage concurrency: transcribe %d, detect %d, ffmpeg %d", STAGE_TRANSCRIBE_CONCURRENCY, STAGE_DETECT_CONCURRENCY, STAGE_FFMPEG_CONCURRENCY)
+
 limiter = Limiter(
     get_remote_address,
     app=app,
     default_limits=["5 per day"],
-    storage_uri="memory://",
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    enabled=RATE_LIMITING_ENABLED == "true",
 )
 
-# create Azure openai client
-client = AzureOpenAI(
-    api_key=AZURE_OPENAI_KEY,
-    azure_endpoint=AZURE_API_ENDPOINT,
-    api_version=AZURE_API_VERSION,
+# upstream http settings from .env
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "10"))
+UPSTREAM_MAX_ATTEMPTS = int(os.environ.get("UPSTREAM_MAX_ATTEMPTS", "5"))
+UPSTREAM_BACKOFF_BASE = float(os.environ.get("UPSTREAM_BACKOFF_BASE", "1"))
+UPSTREAM_BACKOFF_MAX = float(os.environ.get("UPSTREAM_BACKOFF_MAX", "30"))
+SPEECH_READ_TIMEOUT = float(os.environ.get("SPEECH_READ_TIMEOUT", "900"))
+SPEECH_MAX_CONCURRENCY = int(os.environ.get("SPEECH_MAX_CONCURRENCY", "4"))
+OPENAI_READ_TIMEOUT = float(os.environ.get("OPENAI_READ_TIMEOUT", "120"))
+OPENAI_MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY", "4"))
+logging.debug("upstream max attempts: %d, speech concurrency: %d, openai concurrency: %d", UPSTREAM_MAX_ATTEMPTS, SPEECH_MAX_CONCURRENCY, OPENAI_MAX_CONCURRENCY)
+
+# retry policies for the speech and openai endpoints
+speech_upstream = Upstream(
+    "azure speech",
+    max_concurrency=SPEECH_MAX_CONCURRENCY,
+    max_attempts=UPSTREAM_MAX_ATTEMPTS,
+    backoff_base=UPSTREAM_BACKOFF_BASE,
+    backoff_max=UPSTREAM_BACKOFF_MAX,
+)
+openai_upstream = Upstream(
+    "azure openai",
+    max_concurrency=OPENAI_MAX_CONCURRENCY,
+    max_attempts=UPSTREAM_MAX_ATTEMPTS,
+    backoff_base=UPSTREAM_BACKOFF_BASE,
+    backoff_max=UPSTREAM_BACKOFF_MAX,
+    retry_exceptions=(openai.APIConnectionError,),
 )
-logging.debug("initialized Azure OpenAI client")
+fireworks_upstream = Upstream(
+    "fireworks",
+    max_concurrency=SPEECH_MAX_CONCURRENCY,
+    max_attempts=UPSTREAM_MAX_ATTEMPTS,
+    backoff_base=UPSTREAM_BACKOFF_BASE,
+    backoff_max=UPSTREAM_BACKOFF_MAX,
+)
+
+# transcription providers: TRANSCRIBE_PROVIDER is the default, and a request can pick another one by name
+TRANSCRIBE_PROVIDER = os.environ.get("TRANSCRIBE_PROVIDER", "azure")
+LOCAL_WHISPER_MODEL = os.environ.get("LOCAL_WHISPER_MODEL", "small.en")
+LOCAL_WHISPER_COMPUTE_TYPE = os.environ.get("LOCAL_WHISPER_COMPUTE_TYPE", "int8")
+LOCAL_WHISPER_CPU_THREADS = int(os.environ.get("LOCAL_WHISPER_CPU_THREADS", "0"))
+LOCAL_WHISPER_WORKERS = int(os.environ.get("LOCAL_WHISPER_WORKERS", "1"))
+LOCAL_WHISPER_BEAM_SIZE = int(os.environ.get("LOCAL_WHISPER_BEAM_SIZE", "1"))
+
+TRANSCRIBE_PROVIDERS = ["azure"]
+if FIREWORKS_API_KEY:
+    TRANSCRIBE_PROVIDERS.append("fireworks")
+if TRANSCRIBE_PROVIDER == "local" or LocalWhisperTranscriber.available():
+    TRANSCRIBE_PROVIDERS.append("local")
+if TRANSCRIBE_PROVIDER not in TRANSCRIBE_PROVIDERS:
+    logging.error("transcribe_provider %s is not available, falling back to azure", TRANSCRIBE_PROVIDER)
+    TRANSCRIBE_PROVIDER = "azure"
+logging.debug("transcription providers: %s (default %s)", ", ".join(TRANSCRIBE_PROVIDERS), TRANSCRIBE_PROVIDER)
+
+# http clients, created per process by init_clients()
+speech_session = None
+download_session = None
+client = None
+transcribers = {}
+
+def init_clients():
     """
-    calls the fireworks transcription api and returns a tuple (transcription_text, segments, word-level transcript)
+    creates the upstream clients: the speech connection pool, the azure openai client and the transcription providers.
+    connection pools must not be shared across a fork, so this runs once in each server process (see init_worker)
+    rather than at import time.
     """
-    logging.debug("starting fireworks transcription on file: %s", filePath)
-    try:
-        with open(filePath, "rb") as file:
-            logging.debug("opened file for fireworks transcription: %s", filePath)
-            response = requests.post(
-                "https://audio-prod.us-virginia-1.direct.fireworks.ai/v1/audio/transcriptions",
-                headers={"Authorization": f"Bearer {FIREWORKS_API_KEY}"},
-                files={"file": file},
-                data={
-                    "vad_model": "silero",
-                    "alignment_model": "tdnn_ffn",
-                    "preprocessing": "none",
-                    "temperature": "0",
-                    "timestamp_granularities": "word,segment",
-                    "audio_window_seconds": "5",
-                    "speculation_window_words": "4",
-                    "response_format": "verbose_json"
-                },
-            )
-        logging.debug("fireworks transcription response received with status code: %s", response.status_code)
-    except Exception as e:
-        logging.error("exception occurred while sending fireworks transcription request: %s", str(e))
-        raise
+    global speech_session, download_session, client
+    speech_session = create_session(SPEECH_MAX_CONCURRENCY)
+    download_session = create_download_session(BATCH_CONCURRENCY)
+    # the azure openai client keeps its own connection pool; retries are handled by openai_upstream, so the sdk's own are turned off
+    client = AzureOpenAI(
+        api_key=AZURE_OPENAI_KEY,
+        azure_endpoint=AZURE_API_ENDPOINT,
+        api_version=AZURE_API_VERSION,
+        max_retries=0,
+        timeout=openai.Timeout(OPENAI_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+    )
+    logging.debug("initialized Azure OpenAI client")
 
-    if response.status_code == 200:
-        dict_response = response.json()
-        logging.debug("fireworks transcription response json parsed")
-        text = dict_response["text"]
-        segments = dict_response["segments"]
-        words = dict_response["words"]
-        logging.debug("transcription text length: %d, segments count: %d, words count: %d", len(text), len(segments), len(words))
-        # clean each word, keeping only "word", "start", and "end"
-        cleaned_words = []
-        for idx, word in enumerate(words):
-            cleaned_word = {
-                "word": word["word"],
-                "start": word["start"],
-                "end": word["end"]
-            }
-            cleaned_words.append(cleaned_word)
-            logging.debug("cleaned word %d: %s", idx, cleaned_word)
-        return text, segments, cleaned_words
-    else:
-        error_msg = f"transcription api error: {response.status_code}, {response.text}"
-        logging.error(error_msg)
-        raise Exception(error_msg)
+    speech_timeout = (UPSTREAM_CONNECT_TIMEOUT, SPEECH_READ_TIMEOUT)
+    transcribers["azure"] = AzureSpeechTranscriber(AI_SPEECH_RESOURCE_ENDPOINT, AI_SPEECH_PRIMARY_KEY, speech_session, speech_upstream, speech_timeout, trace_every=LOG_WORD_TRACE_EVERY)
+    if "fireworks" in TRANSCRIBE_PROVIDERS:
+        transcribers["fireworks"] = FireworksTranscriber(FIREWORKS_API_KEY, speech_session, fireworks_upstream, speech_timeout, trace_every=LOG_WORD_TRACE_EVERY)
+    if "local" in TRANSCRIBE_PROVIDERS:
+        transcribers["local"] = LocalWhisperTranscriber(
+            model=LOCAL_WHISPER_MODEL,
+            compute_type=LOCAL_WHISPER_COMPUTE_TYPE,
+            cpu_threads=LOCAL_WHISPER_CPU_THREADS,
+            num_workers=LOCAL_WHISPER_WORKERS,
+            beam_size=LOCAL_WHISPER_BEAM_SIZE,
+            trace_every=LOG_WORD_TRACE_EVERY,
+        )
 
-def transcribe_azure(filePath):
+def transcribe(filePath, provider, video=False):
     """
-    calls the azure transcription api and returns a tuple (transcription_text, segments, word-level transcript)
+    transcribes with the named provider into a WordTimeline, splitting long files into concurrently transcribed chunks
+    when TRANSCRIBE_CHUNKING is enabled. for video files (video=True) only the audio is sent.
     """
-    logging.debug("starting azure transcription on file: %s", filePath)
-    try:
-        with open(filePath, "rb") as file:
-            logging.debug("opened file for azure transcription: %s", filePath)
-            azure_response = requests.post(
-                AI_SPEECH_RESOURCE_ENDPOINT,
-                headers={
-                    "Ocp-Apim-Subscription-Key": AI_SPEECH_PRIMARY_KEY,
-                    # remove content-type header - requests will set it correctly with boundary
-                },
-                files={"audio": file},
-                data={"definition": json.dumps({"locales": ["en-US"]})}
-            )
-        logging.debug("azure transcription response received with status code: %s", azure_response.status_code)
-    except Exception as e:
-        logging.error("exception occurred while sending azure transcription request: %s", str(e))
-        raise
-
-    if azure_response.status_code == 200:
-        dict_response = azure_response.json()
-        logging.debug("azure transcription response json parsed")
-        # extract full transcript from combinedPhrases
-        full_text = " ".join([phrase["text"] for phrase in dict_response["combinedPhrases"]])
-        logging.debug("full transcription text extracted with length: %d", len(full_text))
-        # use phrases as segments
-        segments = dict_response["phrases"]
-        logging.debug("transcription segments count: %d", len(segments))
-        # extract and format word-level transcript
-        cleaned_words = []
-        for p_index, phrase in enumerate(dict_response["phrases"]):
-            for w_index, word in enumerate(phrase["words"]):
-                # convert milliseconds to seconds for consistency with fireworks api
-                start_time = word["offsetMilliseconds"] / 1000
-                end_time = start_time + (word["durationMilliseconds"] / 1000)
-                word_entry = {
-                    "word": word["text"],
-                    "start": start_time,
-                    "end": end_time
-                }
-                cleaned_words.append(word_entry)
-                logging.debug("phrase %d, word %d: %s", p_index, w_index, word_entry)
-        return full_text, segments, cleaned_words
-    else:
-        error_msg = f"azure transcription api error: {azure_response.status_code}, {azure_response.text}"
-        logging.error(error_msg)
-        raise Exception(error_msg)
+    transcriber = transcribers[provider]
+    if video:
+        # with or without chunking, only the audio track is sent (and split into chunks)
+        audio_file = os.path.join("uploads", uuid.uuid4().hex + "_audio.wav")
+        try:
+            extract_audio(filePath, audio_file)
+            return transcribe(audio_file, provider)
+        finally:
+            remove_files(audio_file)
+    if not TRANSCRIBE_CHUNKING:
+        return transcriber.transcribe(filePath)
+    return transcribe_chunked(
+        filePath,
+        transcriber.transcribe,
+        chunk_seconds=TRANSCRIBE_CHUNK_SECONDS,
+        overlap_seconds=TRANSCRIBE_CHUNK_OVERLAP_SECONDS,
+        max_workers=TRANSCRIBE_MAX_WORKERS,
+        mode=TRANSCRIBE_CHUNK_MODE,
+        work_dir="uploads",
+    )
 
 def GetSegments(transcriptionText):
     """
     uses the azure openai api to extract advertisement segments from the transcript.
-    the response is expected to be an array of segments in json text.
+    the response is json text: {"phrases": [...]} with structured output enabled, otherwise an array of segments.
     """
     logging.debug("calling azure openai api with transcription text of length: %d", len(transcriptionText))
+    if DETECT_STRUCTURED_OUTPUT:
+        answer_format = 'Respond with a JSON object of the form {"phrases": [...]}, where each string'
+        extra_args = {"response_format": PHRASES_SCHEMA}
+    else:
+        answer_format = "Respond only with a JSON array of strings, where each string"
+        extra_args = {}
+    message = (
+        "Below is the transcript of a podcast episode. Find every advertisement or sponsor segment in it. "
+        + answer_format + " is an exact, word-for-word excerpt of the transcript covering one whole advertisement segment. "
+        "If there are no advertisements, the list is empty.\n\n"
+        + transcriptionText
+    )
     try:
-        result = client.chat.completions.create(
+        result = openai_upstream.call(lambda: client.chat.completions.create(
         model=AZURE_OPENAI_DEPLOYMENT,
         messages=[
             {
@@ -186,23 +368,53 @@ def GetSegments(transcriptionText):
                 ]
             }
         ],
-        max_tokens=800,
+        max_tokens=DETECT_MAX_OUTPUT_TOKENS,
         temperature=0.7,
         top_p=0.95,
         frequency_penalty=0,
         presence_penalty=0,
-        stop=None
-        )
+        stop=None,
+        **extra_args
+        ))
 
+        if result.choices[0].finish_reason == "length":
+            logging.error("azure openai response was cut off at max_tokens (%d)", DETECT_MAX_OUTPUT_TOKENS)
         return result.choices[0].message.content or ""
     except Exception as e:
         logging.error("error calling azure openai api: %s", str(e))
         raise
 
-def generate_ffmpeg_trim_command(input_file, output_file, segments_to_remove):
+def detect_window(text):
+    """
+    finds the ad phrases in one window of the transcript. a response that can't be parsed is logged and
+    counts as no ads for that window, so one bad window doesn't fail the whole job.
+    """
+    try:
+        phrases = parse_phrases(GetSegments(text))
+    except ValueError as e:
+        logging.error("could not parse azure openai response: %s", str(e))
+        return []
+    logging.debug("window of %d chars: %d phrases", len(text), len(phrases))
+    return phrases
+
+def detect_ad_phrases(timeline):
+    """
+    finds the ad phrases in a WordTimeline, querying the llm over overlapping windows that fit its context
+    and merging the phrases found in each
+    """
+    return detect_windowed(
+        timeline.words,
+        detect_window,
+        window_tokens=DETECT_WINDOW_TOKENS,
+        overlap_tokens=DETECT_OVERLAP_TOKENS,
+        max_workers=DETECT_MAX_WORKERS,
+    )
+
+def generate_ffmpeg_trim_command(input_file, output_file, segments_to_remove, video=False):
     """
     generate an ffmpeg command to remove segments from an audio file.
     segments_to_remove should be a list of (start_time, end_time) tuples (in seconds).
+    with video=True the first video stream is cut along with the audio and re-encoded (see VIDEO_ENCODE_PRESET).
     """
     logging.debug("generating ffmpeg trim command for input_file: %s, output_file: %s", input_file, output_file)
     if not input_file or not output_file:
@@ -230,88 +442,349 @@ def generate_ffmpeg_trim_command(input_file, output_file, segments_to_remove):
             logging.error(error_msg)
             raise ValueError(error_msg)
 
-    # build ffmpeg filter_complex string
-    filter_parts = []
-    segment_labels = []
-    # extract audio from beginning to start of the first segment
-    filter_parts.append(f"[0:a]atrim=0:{segments_to_remove[0][0]}[s0]")
-    segment_labels.append("[s0]")
+    # the ranges to keep, as atrim/trim arguments
+    kept = [f"0:{segments_to_remove[0][0]}"]
     logging.debug("added trim from 0 to %s", segments_to_remove[0][0])
     # extract audio between segments
     for i in range(len(segments_to_remove) - 1):
         current_end = segments_to_remove[i][1]
         next_start = segments_to_remove[i+1][0]
         if current_end < next_start:
-            filter_parts.append(f"[0:a]atrim={current_end}:{next_start}[s{i+1}]")
-            segment_labels.append(f"[s{i+1}]")
+            kept.append(f"{current_end}:{next_start}")
             logging.debug("added trim from %s to %s", current_end, next_start)
     # extract audio from the end of the last segment to the end of the file
-    filter_parts.append(f"[0:a]atrim=start={segments_to_remove[-1][1]}[s{len(segments_to_remove)}]")
-    segment_labels.append(f"[s{len(segments_to_remove)}]")
+    kept.append(f"start={segments_to_remove[-1][1]}")
     logging.debug("added trim from %s to end of file", segments_to_remove[-1][1])
-    concat_filter = f"{''.join(segment_labels)}concat=n={len(segment_labels)}:v=0:a=1[out]"
+
+    # build ffmpeg filter_complex string
+    filter_parts = []
+    segment_labels = []
+    for i, trim_args in enumerate(kept):
+        if video:
+            # video and audio are trimmed alike and restarted from zero so the concatenated streams stay in sync
+            filter_parts.append(f"[0:v]trim={trim_args},setpts=PTS-STARTPTS[v{i}]")
+            filter_parts.append(f"[0:a]atrim={trim_args},asetpts=PTS-STARTPTS[a{i}]")
+            segment_labels.append(f"[v{i}][a{i}]")
+        else:
+            filter_parts.append(f"[0:a]atrim={trim_args}[s{i}]")
+            segment_labels.append(f"[s{i}]")
+    if video:
+        concat_filter = f"{''.join(segment_labels)}concat=n={len(segment_labels)}:v=1:a=1[outv][outa]"
+        output_args = '-map "[outv]" -map "[outa]" ' + " ".join(video_encoder_args(output_file, VIDEO_ENCODE_PRESET, VIDEO_ENCODE_CRF))
+    else:
+        concat_filter = f"{''.join(segment_labels)}concat=n={len(segment_labels)}:v=0:a=1[out]"
+        output_args = '-map "[out]"'
 
     filter_complex = ";".join(filter_parts) + ";" + concat_filter
-    command = f'ffmpeg -i "{input_file}" -filter_complex "{filter_complex}" -map "[out]" "{output_file}"'
+    command = f'ffmpeg -y -nostdin -i "{input_file}" -filter_complex "{filter_complex}" {output_args} "{output_file}"'
     logging.debug("generated ffmpeg command: %s", command)
     return command
 
 def find_phrases_timestamps(transcript_data, phrases):
     """
     for each phrase from the azure openai response (either a string or list of strings),
-    find its occurrences in the transcript data (a list of words with timestamps)
+    find its occurrences in the transcript data (a WordTimeline)
     and return a list of (start_time, end_time) tuples.
+    the transcript is indexed once and all phrases are matched together in a single pass.
+    with MATCH_MODE=fuzzy, phrases without an exact occurrence are aligned allowing misheard or paraphrased words.
     """
     logging.debug("starting phrase matching; transcript_data length: %d, phrases type: %s", len(transcript_data) if transcript_data else 0, type(phrases))
     if not transcript_data or not phrases:
         logging.debug("no transcript data or phrases provided, returning empty list")
         return []
-    
+
     if isinstance(phrases, str):
         phrases = [phrases]
-    
-    # normalise transcript words
-    transcript_words = []
-    for idx, item in enumerate(transcript_data):
-        cleaned_word = item['word'].strip().lower().rstrip('.,:;!?')
-        transcript_words.append({
-            'word': cleaned_word,
-            'start': item['start'],
-            'end': item['end']
-        })
-    logging.debug("normalized %d transcript words", len(transcript_words))
-    
-    results = []
-    total_words = len(transcript_words)
-    
-    # look for each phrase as a sequence of words
-    for phrase in phrases:
-        if not phrase:
-            continue
-        target_words = [w.strip().lower().rstrip('.,:;!?') for w in phrase.split()]
-        target_length = len(target_words)
-        logging.debug("searching for phrase: '%s' (normalized: %s) with %d words", phrase, target_words, target_length)
-        for i in range(total_words - target_length + 1):
-            match = True
-            for j in range(target_length):
-                if transcript_words[i+j]['word'] != target_words[j]:
-                    match = False
-                    break
-            if match:
-                start_time = transcript_words[i]['start']
-                end_time = transcript_words[i+target_length-1]['end']
-                results.append((start_time, end_time))
-                logging.debug("found phrase '%s' at time interval (%s, %s)", phrase, start_time, end_time)
+
+    transcript = Transcript.from_timeline(transcript_data)
+    logging.debug("indexed %d transcript words (%d distinct)", len(transcript), len(transcript.vocabulary))
+    if MATCH_MODE == "fuzzy":
+        results = find_phrases_fuzzy(transcript, phrases, max_edit_ratio=MATCH_MAX_EDIT_RATIO, token_similarity=MATCH_TOKEN_SIMILARITY)
+    else:
+        results = find_phrases(transcript, phrases)
     logging.debug("total matches found: %d", len(results))
     return results
 
+def snap_boundaries(input_file, matches, media_info=None):
+    """
+    moves the matched cuts off the raw word edges onto nearby pauses and joins cuts separated by tiny gaps
+    (see boundaries.refine_cuts). if the audio can't be read, the cuts are returned as matched.
+    """
+    duration = media_duration(media_info) if media_info is not None else None
+    try:
+        return refine_cuts(
+            input_file,
+            matches,
+            tolerance=SNAP_TOLERANCE_SECONDS,
+            silence_db=SNAP_SILENCE_DB,
+            merge_gap=SNAP_MERGE_GAP_SECONDS,
+            duration=duration,
+        )
+    except Exception as e:
+        logging.error("error snapping cut boundaries, cutting at word edges: %s", str(e))
+        return matches
+
+class PipelineError(Exception):
+    """
+    raised by run_pipeline when a stage fails; the message is safe to return to the client
+    """
+
+def trim_file(input_file, output_file, matches, sample_accurate=False, media_info=None):
+    """
+    removes the matched segments from input_file into output_file and returns the name of the engine that ran:
+    "none" (nothing to remove, file copied), "copy" (frame-accurate stream copy) or "reencode" (sample-accurate atrim/concat).
+    stream copy is used unless TRIM_ENGINE is "reencode", sample_accurate is set, or the input can't be cut cleanly.
+    the video of video files is kept: stream-copied from keyframe to keyframe, or re-encoded along with the audio.
+    media_info is the input's probe_media output, if the caller already has it.
+    """
+    # if no matches found, simply copy the file (i.e. nothing to remove)
+    if not matches:
+        logging.debug("no matches found; copying file without trimming")
+        shutil.copyfile(input_file, output_file)
+        return "none"
+
+    if media_info is None:
+        try:
+            media_info = probe_media(input_file)
+        except Exception as e:
+            logging.error("error probing input file before trimming: %s", str(e))
+    video = media_info is not None and video_stream(media_info) is not None
+
+    if TRIM_ENGINE == "copy" and not sample_accurate and media_info is not None:
+        list_file = output_file + ".ffconcat"
+        try:
+            if video:
+                copy_command = generate_video_stream_copy_trim_command(
+                    input_file, output_file, matches, media_info, probe_keyframes(input_file), list_file,
+                    keyframe_tolerance=VIDEO_KEYFRAME_TOLERANCE_SECONDS,
+                )
+            else:
+                copy_command = generate_stream_copy_trim_command(input_file, output_file, matches, media_info, list_file)
+            if copy_command is not None:
+                logging.debug("executing stream copy command: %s", copy_command)
+                run_ffmpeg(copy_command)
+                logging.debug("stream copy trim executed successfully")
+                return "copy"
+        except Exception as e:
+            logging.error("stream copy trim failed, falling back to re-encoding: %s", str(e))
+            # don't leave a partial output from the failed copy behind
+            remove_files(output_file)
+        finally:
+            if os.path.exists(list_file):
+                os.remove(list_file)
+
+    try:
+        cmd = generate_ffmpeg_trim_command(input_file, output_file, matches, video=video)
+        logging.debug("ffmpeg command generated: %s", cmd)
+    except Exception as e:
+        logging.error("error generating ffmpeg command: %s", str(e))
+        raise PipelineError(f"Error generating FFmpeg command: {str(e)}")
+
+    try:
+        # execute the ffmpeg command to trim the segments
+        logging.debug("executing ffmpeg command: %s", cmd)
+        result = subprocess.run(cmd, shell=True, capture_output=True)
+    except Exception as e:
+        logging.error("exception executing ffmpeg command: %s", str(e))
+        raise PipelineError(f"Error executing FFmpeg command: {str(e)}")
+    if result.returncode != 0:
+        error_str = result.stderr.decode()
+        logging.error("ffmpeg command failed with error: %s", error_str)
+        raise PipelineError(f"FFmpeg command failed: {error_str}")
+    logging.debug("ffmpeg command executed successfully")
+    return "reencode"
+
+def run_pipeline(input_file, output_file, on_stage=None, sample_accurate=False, cache_key=None, provider=None):
+    """
+    runs the full pipeline on input_file (transcribe -> extract ad segments -> find those segments' timestamps -> snap them to pauses -> remove those segments via ffmpeg),
+    writing the cleaned file to output_file. on_stage, if given, is called with the name of each stage as it starts.
+    sample_accurate forces the re-encoding trim engine instead of frame-accurate stream copy.
+    cache_key is the sha256 of the input's bytes if the caller already has it (e.g. hashed while uploading).
+    provider names the transcription provider (TRANSCRIBE_PROVIDER by default).
+    returns a dict with the matched segments, the trim engine that ran, the cache status ("HIT", "PARTIAL" or "MISS"),
+    the provider and its real-time factor (transcription seconds per audio second, None if nothing was transcribed).
+    the caller owns both input_file and output_file and is responsible for deleting them.
+    """
+    def stage(name):
+        logging.debug("pipeline stage: %s", name)
+        if on_stage is not None:
+            on_stage(name)
+
+    provider = provider or TRANSCRIBE_PROVIDER
+    _, ext = os.path.splitext(input_file)
+    # outputs of the two trim engines differ slightly, so they are cached separately, as are outputs made under
+    # other matching/snapping/trimming settings
+    cache_variant = f"{'sample' if sample_accurate else 'default'}-{OUTPUT_SETTINGS_HASH}"
+    BYTES_PROCESSED.inc(os.path.getsize(input_file))
+
+    # probe the input once; its duration feeds the metrics and its codec info the trim engine
+    try:
+        media_info = probe_media(input_file)
+    except Exception as e:
+        logging.error("error probing input file: %s", str(e))
+        media_info = None
+
+    # look the upload up in the result cache by the hash of its bytes; providers transcribe differently,
+    # so each one gets its own entry
+    cached = None
+    if cache is not None:
+        try:
+            if cache_key is None:
+                cache_key = hash_file(input_file)
+                logging.debug("computed cache key: %s", cache_key)
+            cache_key = f"{cache_key}-{provider}"
+            cached = cache.get(cache_key)
+        except Exception as e:
+            logging.error("error reading result cache: %s", str(e))
+            cache_key = None
+
+    if cached is not None:
+        cached_output = cache.get_output(cache_key, cached, variant=cache_variant)
+        if cached_output is not None:
+            logging.debug("using cached output for key: %s", cache_key)
+            try:
+                shutil.copyfile(cached_output, output_file)
+                timeline = WordTimeline.from_json(cached["transcript"])
+                matches = [tuple(match) for match in cached["outputs"][cache_variant]]
+                record_processed(audio_duration(media_info, timeline), matches)
+                return {"matches": matches, "trim_engine": "cached", "cache": "HIT", "provider": provider, "transcribe_rtf": None}
+            except Exception as e:
+                logging.error("error reading cached output, falling back to processing: %s", str(e))
+
+    transcribe_seconds = 0.0
+    transcribe_rtf = None
+    if cached is not None:
+        logging.debug("using cached transcript for key: %s", cache_key)
+        timeline = WordTimeline.from_json(cached["transcript"])
+    else:
+        stage("transcribing")
+        try:
+            # first, transcribe the audio file
+            logging.debug("starting %s transcription process", provider)
+            with stage_slots["transcribe"]:
+                transcribe_started = time.monotonic()
+                with stage_timer("transcribe"):
+                    timeline = transcribe(input_file, provider, video=media_info is not None and video_stream(media_info) is not None)
+                transcribe_seconds = time.monotonic() - transcribe_started
+            logging.debug("%s transcription succeeded; transcript word count: %d", provider, len(timeline))
+        except Exception as e:
+            logging.error("error during %s transcription: %s", provider, str(e))
+            raise PipelineError(str(e))
+        duration = audio_duration(media_info, timeline)
+        if duration > 0:
+            transcribe_rtf = transcribe_seconds / duration
+            TRANSCRIBE_REALTIME_FACTOR.labels(provider=provider).observe(transcribe_rtf)
+            logging.info("transcribed %.1fs of audio with %s in %.1fs (real-time factor %.3f)", duration, provider, transcribe_seconds, transcribe_rtf)
+
+    if cached is not None and cached.get("phrases_version") == DETECT_SETTINGS_HASH:
+        logging.debug("using cached phrases for key: %s", cache_key)
+        phrases = cached["phrases"]
+    else:
+        stage("detecting")
+        try:
+            # using azure openai to extract advertisement segments
+            logging.debug("calling azure openai to extract advertisement segments")
+            with stage_slots["detect"], stage_timer("detect"):
+                phrases = detect_ad_phrases(timeline)
+            logging.debug("gpt-4o found phrases: %s", phrases)
+        except Exception as e:
+            logging.error("error calling azure openai service: %s", str(e))
+            raise PipelineError(f"Error from Azure OpenAI: {str(e)}")
+
+    # find the timestamps of the phrases in the transcript
+    stage("matching")
+    with stage_timer("match"):
+        # phrases from overlapping windows (or repeated by the llm) can match overlapping spans, so merge them
+        matches = merge_intervals(find_phrases_timestamps(timeline, phrases))
+    logging.debug("matches found: %s", matches)
+
+    if SNAP_BOUNDARIES and matches:
+        with stage_slots["ffmpeg"], stage_timer("snap"):
+            matches = snap_boundaries(input_file, matches, media_info)
+        logging.debug("matches snapped to pauses: %s", matches)
+
+    stage("trimming")
+    with stage_slots["ffmpeg"], stage_timer("trim"):
+        trim_engine = trim_file(input_file, output_file, matches, sample_accurate=sample_accurate, media_info=media_info)
+
+    if cache is not None and cache_key is not None:
+        try:
+            cache.put(cache_key, ext, timeline.to_json(), phrases, matches, transcribe_seconds=transcribe_seconds, output_file=output_file,
+                      variant=cache_variant, phrases_version=DETECT_SETTINGS_HASH)
+        except Exception as e:
+            logging.error("error writing result cache: %s", str(e))
+
+    record_processed(audio_duration(media_info, timeline), matches)
+    return {
+        "matches": matches,
+        "trim_engine": trim_engine,
+        "cache": "PARTIAL" if cached is not None else "MISS",
+        "provider": provider,
+        "transcribe_rtf": transcribe_rtf,
+    }
+
+def audio_duration(media_info, timeline):
+    """
+    returns the input's duration from its probe info, or the end of the last transcribed word if that
+    has no duration
+    """
+    duration = media_duration(media_info) if media_info is not None else None
+    return duration if duration is not None else timeline.end_time()
+
+def record_processed(duration, matches):
+    """
+    adds a finished file to the audio seconds / ad seconds counters
+    """
+    AUDIO_SECONDS_PROCESSED.inc(duration)
+    AD_SECONDS_REMOVED.inc(sum(end - start for start, end in matches))
+
+def save_upload(file):
+    """
+    saves an uploaded werkzeug file into the uploads dir under a uuid-prefixed name to prevent conflicts/overwrites.
+    returns (input_file, output_file, download_filename, content_hash).
+    """
+    uploads_dir = "uploads"
+    os.makedirs(uploads_dir, exist_ok=True)
+    logging.debug("ensured uploads dir exists: %s", uploads_dir)
+    filename = secure_filename(file.filename)
+    unique_id = uuid.uuid4().hex
+    logging.debug("generated uuid: %s for file: %s", unique_id, filename)
+    input_file = os.path.join(uploads_dir, unique_id + "_" + filename)
+    content_hash = move_upload(file, input_file)
+    logging.debug("saved uploaded file as: %s", input_file)
+
+    # define the output file name (appending _edited before the extension)
+    base, ext = os.path.splitext(input_file)
+    output_file = base + "_edited" + ext
+    logging.debug("output_file defined as: %s", output_file)
+
+    # extract the original filename to then create a new filename from it (without uuid); the output keeps
+    # the upload's container, so it keeps its extension too
+    original_base, original_ext = os.path.splitext(filename)
+    download_filename = original_base + "_edited" + original_ext
+    logging.debug("final download filename set as: %s", download_filename)
+    return input_file, output_file, download_filename, content_hash
+
+def output_mimetype(download_filename):
+    """
+    returns the mimetype of a trimmed file, which is in the same container as its upload
+    """
+    mimetype, _ = mimetypes.guess_type(download_filename)
+    return mimetype or "application/octet-stream"
+
+def remove_files(*paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+            logging.debug("removed file: %s", path)
+
 @app.route("/process", methods=["POST"])
 @limiter.limit(RATE_LIMIT)
 def process_audio():
     """
     expects a multipart/form-data post with an audio file attached under the key "file".
     it will process the file (transcribe -> extract ad segments -> find those segments' timestamps -> remove those segments via ffmpeg)
-    and send back the cleaned audio file. both input and output files are deleted afterward.
+    and send back the cleaned file, in the upload's container (video files keep their video). both input and output files are deleted afterward.
     """
     logging.debug("received request at /process")
     if "file" not in request.files:
@@ -322,133 +795,439 @@ def process_audio():
         logging.error("empty filename provided in request")
         return jsonify({"error": "No selected file"}), 400
 
+    provider = request.form.get("provider") or TRANSCRIBE_PROVIDER
+    if provider not in TRANSCRIBE_PROVIDERS:
+        logging.error("unknown transcription provider requested: %s", provider)
+        return jsonify({"error": f"Unknown transcription provider: {provider}", "providers": TRANSCRIBE_PROVIDERS}), 400
+
     logging.debug("processing file: %s", file.filename)
-    # save the incoming file with a uuid to prevent conflics/overwrites
-    uploads_dir = "uploads"
-    os.makedirs(uploads_dir, exist_ok=True)
-    logging.debug("ensured uploads dir exists: %s", uploads_dir)
-    filename = secure_filename(file.filename)
-    unique_id = uuid.uuid4().hex
-    logging.debug("generated uuid: %s for file: %s", unique_id, filename)
-    input_file = os.path.join(uploads_dir, unique_id + "_" + filename)
     try:
-        file.save(input_file)
-        logging.debug("saved uploaded file as: %s", input_file)
+        input_file, output_file, download_filename, content_hash = save_upload(file)
     except Exception as e:
         logging.error("error saving uploaded file: %s", str(e))
         return jsonify({"error": f"Error saving file: {str(e)}"}), 500
-
-    # define the output file name (appending _edited before the extension)
-    base, ext = os.path.splitext(input_file)
-    output_file = base + "_edited" + ext
-    logging.debug("output_file defined as: %s", output_file)
+    # the upload streams to disk while the request body is parsed, so time it from the start of the request
+    observe_stage("save", time.perf_counter() - g.request_started)
 
     try:
-        # first, transcribe the audio file using azure
-        logging.debug("starting azure transcription process")
-        transcription_text, _, transcript_words = transcribe_azure(input_file)
-        logging.debug("azure transcription succeeded; transcript text length: %d, transcript_words count: %d", len(transcription_text), len(transcript_words))
-    except Exception as e:
-        logging.error("error during azure transcription: %s", str(e))
-        if os.path.exists(input_file):
-            os.remove(input_file)
-            logging.debug("removed input file due to error: %s", input_file)
+        result = run_pipeline(input_file, output_file, sample_accurate=request.form.get("sample_accurate") == "true", cache_key=content_hash, provider=provider)
+    except PipelineError as e:
+        remove_files(input_file, output_file)
         return jsonify({"error": str(e)}), 500
+    finally:
+        remove_files(input_file)
 
+    # stream the cleaned audio file from disk in chunks, deleting it once the response has been sent
+    logging.debug("returning the processed audio file")
     try:
-        # using azure openai to extract advertisement segments
-        logging.debug("calling azure openai to extract advertisement segments")
-        phrases_str = GetSegments(transcription_text)
-        try:
-            phrases = json.loads(phrases_str)
-            logging.debug("gpt-4o found phrases: %s", phrases)
-        except json.JSONDecodeError as je:
-            logging.error("json decode error for azure openai response: %s", str(je))
-            phrases = []
+        response = send_file(
+            os.path.abspath(output_file),
+            download_name=download_filename,
+            as_attachment=True,
+            mimetype=output_mimetype(download_filename)
+        )
     except Exception as e:
-        logging.error("error calling azure openai service: %s", str(e))
-        if os.path.exists(input_file):
-            os.remove(input_file)
-            logging.debug("removed input file due to azure openai error: %s", input_file)
-        return jsonify({"error": f"Error from Azure OpenAI: {str(e)}"}), 500
+        logging.error("error opening output file: %s", str(e))
+        remove_files(output_file)
+        return jsonify({"error": f"Error reading output file: {str(e)}"}), 500
+    # send_file responses pass straight through to the server and skip call_on_close, so hook the body iterator instead
+    respond_started = time.perf_counter()
+    response.response = ClosingIterator(response.response, [
+        lambda: remove_files(output_file),
+        lambda: observe_stage("respond", time.perf_counter() - respond_started),
+    ])
+    response.headers["X-Cache"] = result["cache"]
+    response.headers["X-Trim-Engine"] = result["trim_engine"]
+    response.headers["X-Transcribe-Provider"] = result["provider"]
+    return response
 
-    # find the timestamps of the phrases in the transcript
-    matches = find_phrases_timestamps(transcript_words, phrases)
-    logging.debug("matches found: %s", matches)
-    
-    # if no matches found, simply copy the file (i.e. nothing to remove)
-    if not matches:
-        logging.debug("no matches found; copying file without trimming")
-        cmd = f'cp "{input_file}" "{output_file}"'
-    else:
+def summarize_result(result):
+    """
+    returns the client-facing summary of a run_pipeline result
+    """
+    return {
+        "cache": result["cache"],
+        "trim_engine": result["trim_engine"],
+        "segments_removed": len(result["matches"]),
+        "ad_seconds_removed": round(sum(end - start for start, end in result["matches"]), 3),
+        "provider": result["provider"],
+        "transcribe_rtf": result["transcribe_rtf"],
+    }
+
+def fetch_batch_item(item):
+    """
+    returns (input_file, cache_key, remove_input) for a batch item: uploads were saved with the request, local paths
+    are copied into the uploads dir (so trimming never touches the original) and urls are downloaded there
+    """
+    if item["source"] == "upload":
+        return item["input_file"], item.get("cache_key"), True
+    os.makedirs("uploads", exist_ok=True)
+    if item["source"] == "path":
+        input_file = os.path.join("uploads", uuid.uuid4().hex + "_" + item_filename(item["name"], os.path.splitext(item["path"])[1]))
+        shutil.copyfile(resolve_local_path(item["path"], BATCH_LOCAL_DIR), input_file)
+        return input_file, None, True
+    input_file, content_hash = download(
+        download_session, item["url"], "uploads", item["name"],
+        timeout=(UPSTREAM_CONNECT_TIMEOUT, BATCH_DOWNLOAD_READ_TIMEOUT), max_bytes=MAX_UPLOAD_BYTES, allowed_hosts=BATCH_ALLOWED_HOSTS,
+    )
+    return input_file, content_hash, True
+
+def run_batch(job, on_stage):
+    """
+    runs the pipeline on every item of a batch job, BATCH_CONCURRENCY items at a time, then zips the cleaned files
+    with a status.json into the job's output file. items fail independently; per-item progress is published as the
+    job's result while it runs. the stage caps (stage_slots) keep items from flooding any one stage.
+    """
+    options = job["options"]
+    items = options["batch"]
+    outputs = {}
+
+    def process(index, item, set_stage):
+        request_id_var.set(options.get("request_id") or job["id"])
+        set_stage("fetching")
+        input_file, cache_key, remove_input = fetch_batch_item(item)
+        base, ext = os.path.splitext(item_filename(item["name"], os.path.splitext(input_file)[1]))
+        archive_name = f"{index + 1:03d}_{base}_edited{ext}"
+        output_file = os.path.join("uploads", uuid.uuid4().hex + "_" + archive_name)
         try:
-            cmd = generate_ffmpeg_trim_command(input_file, output_file, matches)
-            logging.debug("ffmpeg command generated: %s", cmd)
-        except Exception as e:
-            logging.error("error generating ffmpeg command: %s", str(e))
-            if os.path.exists(input_file):
-                os.remove(input_file)
-                logging.debug("removed input file due to command generation error: %s", input_file)
-            return jsonify({"error": f"Error generating FFmpeg command: {str(e)}"}), 500
+            result = run_pipeline(input_file, output_file, on_stage=set_stage, sample_accurate=options.get("sample_accurate", False), cache_key=cache_key, provider=options.get("provider"))
+        except Exception:
+            remove_files(output_file)
+            raise
+        finally:
+            if remove_input:
+                remove_files(input_file)
+        outputs[index] = (output_file, archive_name)
+        return {"file": archive_name, **summarize_result(result)}
+
+    def publish(statuses):
+        job_queue.store.update(job["id"], result={"items": statuses})
 
     try:
-        # execute the ffmpeg command to trim the segments
-        logging.debug("executing ffmpeg command: %s", cmd)
-        result = subprocess.run(cmd, shell=True, capture_output=True)
-        if result.returncode != 0:
-            error_str = result.stderr.decode()
-            logging.error("ffmpeg command failed with error: %s", error_str)
-            if os.path.exists(input_file):
-                os.remove(input_file)
-                logging.debug("removed input file due to ffmpeg error: %s", input_file)
-            return jsonify({"error": f"FFmpeg command failed: {error_str}"}), 500
-        else:
-            logging.debug("ffmpeg command executed successfully")
-    except Exception as e:
-        logging.error("exception executing ffmpeg command: %s", str(e))
-        if os.path.exists(input_file):
-            os.remove(input_file)
-            logging.debug("removed input file due to exception running ffmpeg: %s", input_file)
-        return jsonify({"error": f"Error executing FFmpeg command: {str(e)}"}), 500
+        statuses = run_items(items, process, BATCH_CONCURRENCY, publish)
+        on_stage("archiving")
+        summary = {
+            "items": statuses,
+            "succeeded": sum(status["status"] == "done" for status in statuses),
+            "failed": sum(status["status"] == "failed" for status in statuses),
+        }
+        with stage_timer("archive"):
+            write_archive(job["output_file"], [outputs[index] for index in sorted(outputs)], summary)
+    finally:
+        remove_files(*(path for path, _ in outputs.values()))
+        # uploads that never ran (e.g. the worker stopped) are removed as well
+        remove_files(*(item["input_file"] for item in items if item["source"] == "upload"))
+    return summary
+
+def run_job(job, on_stage):
+    """
+    job queue handler: runs the pipeline on a saved upload, or hands a batch job to run_batch. the input file is
+    removed once the job finishes, the output file is kept until the job's result expires.
+    """
+    if (job["options"] or {}).get("batch"):
+        return run_batch(job, on_stage)
+    try:
+        options = job["options"] or {}
+        # worker threads log under the id of the request that submitted the job
+        request_id_var.set(options.get("request_id") or job["id"])
+        result = run_pipeline(job["input_file"], job["output_file"], on_stage=on_stage, sample_accurate=options.get("sample_accurate", False), cache_key=options.get("cache_key"), provider=options.get("provider"))
+    except PipelineError:
+        remove_files(job["input_file"], job["output_file"])
+        raise
+    finally:
+        remove_files(job["input_file"])
+    return summarize_result(result)
+
+def expire_job(job):
+    """
+    removes an expired job's files, including the uploads of a batch that never finished
+    """
+    batch = (job["options"] or {}).get("batch") or []
+    remove_files(job["input_file"], job["output_file"], *(item["input_file"] for item in batch if item["source"] == "upload"))
+
+job_store = create_job_store(JOBS_BACKEND, JOBS_DB_PATH, redis=redis_client(REDIS_URL) if JOBS_BACKEND == "redis" else None)
+job_queue = JobQueue(
+    job_store,
+    run_job,
+    concurrency=JOBS_CONCURRENCY,
+    max_queue_depth=JOBS_MAX_QUEUE_DEPTH,
+    result_ttl_seconds=JOBS_RESULT_TTL_SECONDS,
+    on_expire=expire_job,
+    lease_seconds=JOBS_LEASE_SECONDS,
+    max_attempts=JOBS_MAX_ATTEMPTS,
+)
+
+def worker_share(total, slot, workers):
+    """
+    returns worker number slot's part of total when it is split as evenly as possible between workers processes
+    """
+    return total // workers + (1 if slot < total % workers else 0)
+
+def init_worker(slot=0, workers=1):
+    """
+    per-process startup: creates the upstream clients and starts the job workers.
+    gunicorn calls it in each worker after forking (gunicorn.conf.py), with the worker's number (slot) out of workers,
+    and the development server calls it before serving.
+    """
+    if workers > 1:
+        # the job store is shared, so any worker's threads can run any job: this worker runs its part of
+        # JOBS_CONCURRENCY, which can be none
+        job_queue.concurrency = worker_share(JOBS_CONCURRENCY, slot, workers)
+        totals = {"transcribe": STAGE_TRANSCRIBE_CONCURRENCY, "detect": STAGE_DETECT_CONCURRENCY, "ffmpeg": STAGE_FFMPEG_CONCURRENCY}
+        limits = {name: max(1, worker_share(total, slot, workers)) for name, total in totals.items()}
+        for name, limit in limits.items():
+            stage_slots[name] = threading.BoundedSemaphore(limit)
+        logging.debug("worker %d of %d: %d job workers, stage slots %s", slot, workers, job_queue.concurrency, limits)
+    init_clients()
+    job_queue.start()
+
+def shutdown_worker(timeout=None):
+    """
+    stops taking queued jobs and waits up to timeout seconds for the running ones to finish
+    """
+    job_queue.stop(timeout)
+
+# endpoints whose responses are counted in the requests metric
+COUNTED_ENDPOINTS = {"process_audio", "create_job", "create_batch"}
+
+@app.before_request
+def start_request():
+    g.request_started = time.perf_counter()
+    request_id_var.set(new_request_id(request.headers.get("X-Request-ID")))
+
+@app.after_request
+def finish_request(response):
+    response.headers["X-Request-ID"] = request_id_var.get()
+    if request.endpoint in COUNTED_ENDPOINTS:
+        REQUESTS.labels(endpoint=request.endpoint, status=response.status_code).inc()
+    return response
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    logging.error("upload rejected, larger than max_upload_bytes: %d", MAX_UPLOAD_BYTES)
+    return jsonify({"error": f"File too large, the maximum upload size is {MAX_UPLOAD_BYTES} bytes"}), 413
+
+@app.route("/jobs", methods=["POST"])
+@limiter.limit(RATE_LIMIT)
+def create_job():
+    """
+    same input as /process, but returns a job id straight away (202) and runs the pipeline on the worker pool.
+    poll GET /jobs/<id> for the status and fetch the cleaned file from GET /jobs/<id>/result.
+    """
+    logging.debug("received request at /jobs")
+    if "file" not in request.files:
+        logging.error("no file provided in request")
+        return jsonify({"error": "No file provided"}), 400
+    file = request.files["file"]
+    if file.filename == "":
+        logging.error("empty filename provided in request")
+        return jsonify({"error": "No selected file"}), 400
+
+    provider = request.form.get("provider") or TRANSCRIBE_PROVIDER
+    if provider not in TRANSCRIBE_PROVIDERS:
+        logging.error("unknown transcription provider requested: %s", provider)
+        return jsonify({"error": f"Unknown transcription provider: {provider}", "providers": TRANSCRIBE_PROVIDERS}), 400
+
+    if job_queue.is_full():
+        logging.error("job queue is full, rejecting job")
+        return jsonify({"error": "Job queue is full, try again later"}), 503
 
     try:
-        # read the processed output file
-        logging.debug("reading processed output file: %s", output_file)
-        with open(output_file, "rb") as f:
-            audio_data = f.read()
-        logging.debug("successfully read processed file, size: %d bytes", len(audio_data))
+        input_file, output_file, download_filename, content_hash = save_upload(file)
     except Exception as e:
-        logging.error("error reading output file: %s", str(e))
-        if os.path.exists(input_file):
-            os.remove(input_file)
-            logging.debug("removed input file during output file read error: %s", input_file)
-        if os.path.exists(output_file):
-            os.remove(output_file)
-            logging.debug("removed output file during output file read error: %s", output_file)
-        return jsonify({"error": f"Error reading output file: {str(e)}"}), 500
+        logging.error("error saving uploaded file: %s", str(e))
+        return jsonify({"error": f"Error saving file: {str(e)}"}), 500
+    # the upload streams to disk while the request body is parsed, so time it from the start of the request
+    observe_stage("save", time.perf_counter() - g.request_started)
 
-    # cleanup: deleting both the input and output files from the working dir
-    if os.path.exists(input_file):
-        os.remove(input_file)
-        logging.debug("cleaned up input file: %s", input_file)
-    if os.path.exists(output_file):
-        os.remove(output_file)
-        logging.debug("cleaned up output file: %s", output_file)
-
-    # extract the original filename to then create a new filename from it (without uuid)
-    original_base, _ = os.path.splitext(filename)
-    download_filename = original_base + "_edited.mp3"
-    logging.debug("final download filename set as: %s", download_filename)
+    try:
+        options = {"sample_accurate": request.form.get("sample_accurate") == "true", "cache_key": content_hash, "provider": provider, "request_id": request_id_var.get()}
+        job_id = job_queue.submit(input_file, output_file, download_filename, options=options)
+    except QueueFullError:
+        remove_files(input_file)
+        return jsonify({"error": "Job queue is full, try again later"}), 503
 
-    # return the cleaned audio file
-    logging.debug("returning the processed audio file")
+    return jsonify({"id": job_id, "status": "queued"}), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+@limiter.exempt
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(public_job_fields(job))
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+@limiter.exempt
+def get_job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == "failed":
+        return jsonify({"error": job["error"]}), 500
+    if job["status"] != "done":
+        return jsonify({"error": "Job is not finished", "status": job["status"]}), 409
+    if not os.path.exists(job["output_file"]):
+        return jsonify({"error": "Job result has expired"}), 410
     return send_file(
-        BytesIO(audio_data),
-        download_name=download_filename,
+        os.path.abspath(job["output_file"]),
+        download_name=job["download_name"],
         as_attachment=True,
-        mimetype="audio/mpeg"
+        mimetype=output_mimetype(job["download_name"])
     )
 
+def batch_manifest():
+    """
+    returns the batch manifest of the current request, sent as the json body or as a "manifest" form field
+    alongside uploaded files, or None if there is none
+    """
+    if request.is_json:
+        return request.get_json(silent=True)
+    if request.form.get("manifest"):
+        try:
+            return json.loads(request.form["manifest"])
+        except json.JSONDecodeError as e:
+            raise BatchError(f"manifest isn't valid json: {e}")
+    return None
+
+def batch_items(manifest):
+    """
+    expands a manifest into its list of items, checking local paths and urls and fetching feeds for their
+    enclosures. urls are checked again, redirect by redirect, when they are downloaded.
+    """
+    items, feeds = parse_manifest(manifest) if manifest is not None else ([], [])
+    for item in items:
+        if item["source"] == "path":
+            resolve_local_path(item["path"], BATCH_LOCAL_DIR)
+        else:
+            check_url(item["url"], BATCH_ALLOWED_HOSTS)
+    for feed in feeds:
+        try:
+            enclosures = fetch_feed(download_session, feed["url"], (UPSTREAM_CONNECT_TIMEOUT, BATCH_DOWNLOAD_READ_TIMEOUT), feed["limit"], BATCH_ALLOWED_HOSTS)
+        except BatchError:
+            raise
+        except Exception as e:
+            raise BatchError(f"error fetching feed {feed['url']}: {e}")
+        for item in enclosures:
+            check_url(item["url"], BATCH_ALLOWED_HOSTS)
+        items.extend(enclosures)
+    return items
+
+@app.route("/batches", methods=["POST"])
+@limiter.limit(RATE_LIMIT)
+def create_batch():
+    """
+    queues a batch of files as one job and returns its id straight away (202). files can be uploaded under the key
+    "files" (multipart/form-data, with an optional "manifest" form field) and/or listed in a json manifest of urls,
+    local paths (inside BATCH_LOCAL_DIR) and rss/atom feeds. poll GET /batches/<id> for per-item status and fetch
+    a zip of the cleaned files from GET /batches/<id>/archive.
+    """
+    logging.debug("received request at /batches")
+    files = [file for file in request.files.getlist("files") if file.filename]
+
+    # options come from the json body when the manifest is an object, from the form otherwise
+    body = request.get_json(silent=True) if request.is_json else None
+    params = body if isinstance(body, dict) else request.form
+    provider = params.get("provider") or TRANSCRIBE_PROVIDER
+    if provider not in TRANSCRIBE_PROVIDERS:
+        logging.error("unknown transcription provider requested: %s", provider)
+        return jsonify({"error": f"Unknown transcription provider: {provider}", "providers": TRANSCRIBE_PROVIDERS}), 400
+    sample_accurate = params.get("sample_accurate") in (True, "true")
+
+    # everything is checked before any upload is kept, so a bad manifest doesn't leave files behind
+    try:
+        items = batch_items(batch_manifest())
+    except BatchError as e:
+        logging.error("invalid batch: %s", str(e))
+        return jsonify({"error": str(e)}), 400
+    if not files and not items:
+        logging.error("no files or manifest items provided in batch request")
+        return jsonify({"error": "No files or manifest items provided"}), 400
+    if len(files) + len(items) > BATCH_MAX_ITEMS:
+        logging.error("batch of %d items rejected, larger than batch_max_items: %d", len(files) + len(items), BATCH_MAX_ITEMS)
+        return jsonify({"error": f"Too many items, the maximum batch size is {BATCH_MAX_ITEMS}"}), 400
+    if job_queue.is_full():
+        logging.error("job queue is full, rejecting batch")
+        return jsonify({"error": "Job queue is full, try again later"}), 503
+
+    uploads = []
+    try:
+        for file in files:
+            input_file, _, _, content_hash = save_upload(file)
+            uploads.append({"source": "upload", "input_file": input_file, "cache_key": content_hash, "name": file.filename})
+    except Exception as e:
+        logging.error("error saving uploaded file: %s", str(e))
+        remove_files(*(upload["input_file"] for upload in uploads))
+        return jsonify({"error": f"Error saving file: {str(e)}"}), 500
+    if uploads:
+        observe_stage("save", time.perf_counter() - g.request_started)
+    items = uploads + items
+
+    try:
+        options = {"batch": items, "sample_accurate": sample_accurate, "provider": provider, "request_id": request_id_var.get()}
+        output_file = os.path.join("uploads", uuid.uuid4().hex + "_batch.zip")
+        job_id = job_queue.submit(None, output_file, "batch_edited.zip", options=options)
+    except QueueFullError:
+        remove_files(*(upload["input_file"] for upload in uploads))
+        return jsonify({"error": "Job queue is full, try again later"}), 503
+
+    logging.debug("queued batch %s with %d items", job_id, len(items))
+    return jsonify({"id": job_id, "status": "queued", "items": [{"name": item["name"], "source": item["source"]} for item in items]}), 202
+
+@app.route("/batches/<job_id>", methods=["GET"])
+@limiter.exempt
+def get_batch(job_id):
+    """
+    returns the batch job's status with the status of each item and, once items finish, their summaries
+    """
+    job = job_queue.get(job_id)
+    if job is None or not (job["options"] or {}).get("batch"):
+        return jsonify({"error": "Batch not found"}), 404
+    fields = public_job_fields(job)
+    statuses = (job["result"] or {}).get("items") or [
+        {"name": item["name"], "source": item["source"], "status": "queued", "stage": None, "error": None, "result": None}
+        for item in job["options"]["batch"]
+    ]
+    fields["result"] = {
+        "items": statuses,
+        "succeeded": sum(status["status"] == "done" for status in statuses),
+        "failed": sum(status["status"] == "failed" for status in statuses),
+    }
+    return jsonify(fields)
+
+@app.route("/batches/<job_id>/archive", methods=["GET"])
+@limiter.exempt
+def get_batch_archive(job_id):
+    """
+    returns the zip of a finished batch: one cleaned file per item that succeeded, plus status.json
+    """
+    job = job_queue.get(job_id)
+    if job is None or not (job["options"] or {}).get("batch"):
+        return jsonify({"error": "Batch not found"}), 404
+    return get_job_result(job_id)
+
+@app.route("/cache/stats", methods=["GET"])
+@limiter.exempt
+def cache_stats():
+    """
+    returns the result cache hit/miss counters and how much transcription time the cache has saved
+    """
+    if cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **cache.stats()})
+
+@app.route("/metrics", methods=["GET"])
+@limiter.exempt
+def metrics():
+    """
+    prometheus scrape endpoint: per-stage latency histograms, request counts and bytes/audio/ad seconds processed
+    """
+    return Response(latest_metrics(), mimetype=CONTENT_TYPE_LATEST)
+
 if __name__ == "__main__":
+    # development server only; production runs under gunicorn (gunicorn -c gunicorn.conf.py api:app).
+    # the debug reloader runs this module in a watcher process and a serving child; only the child needs clients and job workers
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        init_worker()
     logging.debug("starting flask app on 0.0.0.0:7070")
-    app.run(debug=True, host="0.0.0.0", port=7070)
\ No newline at end of file
+    app.run(debug=True, host="0.0.0.0", port=7070)
@@ -0,0 +1,299 @@
+import os
+import json
+import uuid
+import logging
+import zipfile
+import socket
+import hashlib
+import ipaddress
+import mimetypes
+import threading
+import xml.etree.ElementTree as ElementTree
+from urllib.parse import urljoin, urlparse
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from werkzeug.utils import secure_filename
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# feeds are parsed in memory, so they are capped well below the upload size
+FEED_MAX_BYTES = 16 * 1024 * 1024
+MAX_REDIRECTS = 5
+ATOM_NAMESPACE = "{http://www.w3.org/2005/Atom}"
+
+
+class BatchError(Exception):
+    """
+    raised for a batch manifest or item that can't be used; the message is safe to return to the client
+    """
+
+
+def is_url(value):
+    return urlparse(value).scheme in ("http", "https")
+
+
+def check_url(url, allowed_hosts=None):
+    """
+    raises BatchError unless url may be fetched on a client's behalf: it has to be http(s), and its host has to be
+    in allowed_hosts if that is given, or otherwise resolve only to public addresses, so clients can't make the
+    server reach loopback, private, link-local (e.g. cloud metadata) or other internal addresses.
+    returns the address that was checked, which the request has to go to (see open_url), or None for an allowed host.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise BatchError(f"only http(s) urls can be fetched: {url}")
+    host = parsed.hostname.lower()
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise BatchError(f"host isn't in BATCH_ALLOWED_HOSTS: {host}")
+        return None
+    try:
+        addresses = socket.getaddrinfo(host, parsed.port or (443 if parsed.scheme == "https" else 80), proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError) as e:
+        raise BatchError(f"can't resolve {host}: {e}")
+    for address in addresses:
+        ip = ipaddress.ip_address(address[4][0].split("%")[0])
+        if ip.version == 6 and ip.ipv4_mapped is not None:
+            ip = ip.ipv4_mapped
+        if not ip.is_global or ip.is_multicast:
+            raise BatchError(f"{host} resolves to a non-public address ({ip})")
+    return addresses[0][4][0].split("%")[0]
+
+
+def pinned_url(url, address):
+    """
+    returns url with its host replaced by address
+    """
+    parsed = urlparse(url)
+    userinfo, _, _ = parsed.netloc.rpartition("@")
+    netloc = f"[{address}]" if ":" in address else address
+    if parsed.port:
+        netloc += f":{parsed.port}"
+    return parsed._replace(netloc=f"{userinfo}@{netloc}" if userinfo else netloc).geturl()
+
+
+class PinnedAddressAdapter(HTTPAdapter):
+    """
+    transport adapter for requests sent to a pinned_url: the connection goes to the address in the url, while tls
+    (sni and certificate checks) uses the original host, taken from the request's Host header
+    """
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        host = request.headers.get("Host")
+        if host and host_params["scheme"] == "https":
+            hostname = urlparse("//" + host).hostname
+            pool_kwargs["server_hostname"] = hostname
+            pool_kwargs["assert_hostname"] = hostname
+        return host_params, pool_kwargs
+
+
+def create_download_session(pool_size):
+    """
+    returns a requests session for open_url, keeping up to pool_size connections alive per address
+    """
+    session = requests.Session()
+    adapter = PinnedAddressAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def open_url(session, url, timeout, allowed_hosts=None):
+    """
+    starts a streamed get of url and returns the response. redirects are followed here rather than by requests, so
+    every hop goes through check_url. the request goes to the address check_url vetted rather than the host name,
+    so the name can't be re-resolved to an internal address in between (dns rebinding); session has to come from
+    create_download_session for https urls to be verified against their host.
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        address = check_url(url, allowed_hosts)
+        if address is None:
+            response = session.get(url, stream=True, timeout=timeout, allow_redirects=False)
+        else:
+            host = urlparse(url).netloc.rpartition("@")[2]
+            response = session.get(pinned_url(url, address), headers={"Host": host}, stream=True, timeout=timeout, allow_redirects=False)
+        if not response.is_redirect:
+            response.raise_for_status()
+            return response
+        response.close()
+        url = urljoin(url, response.headers["Location"])
+    raise BatchError(f"too many redirects fetching {url}")
+
+
+def parse_manifest(manifest):
+    """
+    validates a batch manifest and returns (items, feeds). the manifest is a list of items, or a dict with "items"
+    and/or "feeds" lists. an item is a url or a local path, as a string or as {"url": ...} / {"path": ...} with an
+    optional "name"; a feed is an rss/atom url, or {"url": ..., "limit": n} to take only its n newest episodes.
+    """
+    if isinstance(manifest, list):
+        manifest = {"items": manifest}
+    if not isinstance(manifest, dict):
+        raise BatchError("manifest must be a JSON list of items or an object with \"items\" and/or \"feeds\"")
+
+    items = []
+    for entry in manifest.get("items") or []:
+        if isinstance(entry, str):
+            entry = {"url": entry} if is_url(entry) else {"path": entry}
+        if not isinstance(entry, dict) or not (isinstance(entry.get("url"), str) or isinstance(entry.get("path"), str)):
+            raise BatchError(f"invalid manifest item: {entry!r}")
+        if "url" in entry and not is_url(entry["url"]):
+            raise BatchError(f"only http(s) urls can be fetched: {entry['url']}")
+        source = "url" if "url" in entry else "path"
+        name = entry.get("name") or os.path.basename(urlparse(entry[source]).path if source == "url" else entry[source])
+        items.append({"source": source, source: entry[source], "name": name})
+
+    feeds = []
+    for entry in manifest.get("feeds") or []:
+        if isinstance(entry, str):
+            entry = {"url": entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get("url"), str) or not is_url(entry["url"]):
+            raise BatchError(f"invalid feed: {entry!r}")
+        feeds.append({"url": entry["url"], "limit": entry.get("limit")})
+    return items, feeds
+
+
+def feed_enclosures(xml_text, limit=None):
+    """
+    returns the audio/video enclosures of an rss or atom feed, newest first as feeds list them, as url items named
+    after their episode titles
+    """
+    try:
+        root = ElementTree.fromstring(xml_text)
+    except ElementTree.ParseError as e:
+        raise BatchError(f"feed isn't valid xml: {e}")
+    items = []
+    # rss 2.0: <item><title/><enclosure url="..."/></item>
+    for entry in root.iter("item"):
+        enclosure = entry.find("enclosure")
+        if enclosure is not None and enclosure.get("url"):
+            items.append({"source": "url", "url": enclosure.get("url"), "name": (entry.findtext("title") or "").strip()})
+    # atom: <entry><title/><link rel="enclosure" href="..."/></entry>
+    for entry in root.iter(ATOM_NAMESPACE + "entry"):
+        for link in entry.findall(ATOM_NAMESPACE + "link"):
+            if link.get("rel") == "enclosure" and link.get("href"):
+                items.append({"source": "url", "url": link.get("href"), "name": (entry.findtext(ATOM_NAMESPACE + "title") or "").strip()})
+                break
+    # enclosures are fetched on the client's behalf, like manifest urls
+    items = [item for item in items if is_url(item["url"])]
+    for item in items:
+        if not item["name"]:
+            item["name"] = os.path.basename(urlparse(item["url"]).path)
+    return items[:limit] if limit else items
+
+
+def fetch_feed(session, url, timeout, limit=None, allowed_hosts=None):
+    """
+    fetches an rss/atom feed (at most FEED_MAX_BYTES) and returns its enclosures as url items
+    """
+    with open_url(session, url, timeout, allowed_hosts) as response:
+        content = b""
+        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            content += chunk
+            if len(content) > FEED_MAX_BYTES:
+                raise BatchError(f"feed {url} is larger than {FEED_MAX_BYTES} bytes")
+    return feed_enclosures(content, limit)
+
+
+def resolve_local_path(path, root):
+    """
+    returns the real path of a manifest path, which has to be a file inside root. relative paths are taken
+    relative to root. raises BatchError if local paths are disabled (no root) or the path is outside it.
+    """
+    if not root:
+        raise BatchError("local paths are disabled; set BATCH_LOCAL_DIR to allow them")
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise BatchError(f"path is outside BATCH_LOCAL_DIR: {path}")
+    if not os.path.isfile(resolved):
+        raise BatchError(f"no such file: {path}")
+    return resolved
+
+
+def item_filename(name, extension=""):
+    """
+    returns a safe file name for an item, keeping its extension or adding the given one if it has none
+    """
+    base, ext = os.path.splitext(secure_filename(name) or "item")
+    return (base or "item") + (ext or extension)
+
+
+def download(session, url, destination_dir, name, timeout, max_bytes, allowed_hosts=None):
+    """
+    streams url into destination_dir under a uuid-prefixed name and returns (path, sha256 of its bytes). the file's
+    extension comes from the item name or url, or from the response's content type; downloads larger than
+    max_bytes are abandoned. url (and every redirect) has to pass check_url.
+    """
+    with open_url(session, url, timeout, allowed_hosts) as response:
+        if int(response.headers.get("Content-Length") or 0) > max_bytes:
+            raise BatchError(f"{url} is larger than the maximum upload size ({max_bytes} bytes)")
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+        filename = item_filename(name, os.path.splitext(urlparse(url).path)[1] or mimetypes.guess_extension(content_type) or "")
+        if not os.path.splitext(filename)[1]:
+            raise BatchError(f"can't tell the file type of {url} (content type {content_type or 'missing'})")
+        path = os.path.join(destination_dir, uuid.uuid4().hex + "_" + filename)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(path, "wb") as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise BatchError(f"{url} is larger than the maximum upload size ({max_bytes} bytes)")
+                    digest.update(chunk)
+                    f.write(chunk)
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+    logging.debug("downloaded %s (%d bytes) to %s", url, size, path)
+    return path, digest.hexdigest()
+
+
+def write_archive(archive_path, entries, status):
+    """
+    writes a zip of the given (path, name in archive) entries plus status.json. audio and video are already
+    compressed, so entries are stored rather than deflated.
+    """
+    tmp_path = f"{archive_path}.{os.getpid()}.tmp"
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for path, name in entries:
+            archive.write(path, name)
+        archive.writestr("status.json", json.dumps(status, indent=2))
+    os.replace(tmp_path, archive_path)
+
+
+def run_items(items, process, concurrency, on_update):
+    """
+    runs process(index, item, set_stage) for every item on a pool of concurrency threads and returns their statuses
+    in item order. a status holds the item's name and source, its "status" ("queued", "running", "done" or
+    "failed"), its current stage, and the dict process returned ("result") or the error it raised.
+    on_update(statuses) is called with a snapshot after every change, e.g. to publish progress.
+    """
+    lock = threading.Lock()
+    statuses = [
+        {"name": item["name"], "source": item["source"], "status": "queued", "stage": None, "error": None, "result": None}
+        for item in items
+    ]
+
+    def update(index, **fields):
+        # published under the lock so snapshots can't reach on_update out of order
+        with lock:
+            statuses[index].update(fields)
+            on_update([dict(status) for status in statuses])
+
+    def run_one(index):
+        update(index, status="running")
+        try:
+            result = process(index, items[index], lambda stage: update(index, stage=stage))
+        except Exception as e:
+            logging.error("batch item %d (%s) failed: %s", index, items[index]["name"], str(e))
+            update(index, status="failed", stage=None, error=str(e))
+            return
+        update(index, status="done", stage=None, result=result)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-item") as executor:
+        list(executor.map(run_one, range(len(items))))
+    return statuses
@@ -0,0 +1,113 @@
+"""
+measures what snapping cut boundaries to pauses costs next to the trim itself.
+
+    python benchmarks/bench_boundaries.py --minutes 10 60 --cuts 12 --format mp3
+
+the input is generated: a tone switched on for a few seconds and off for a short pause, like speech between
+breaths, encoded in --format. --cuts cuts are placed at random and each one is timed three ways: snapping
+(boundaries.refine_cuts), the stream-copy trim and the re-encoding trim (api.trim_file). snapping decodes only
+the audio around each cut boundary, so its cost should stay a small fraction of either trim as the file grows.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from boundaries import refine_cuts
+from matching import merge_intervals
+from probe import probe_media
+
+import api
+
+# the tone is on for TALK_SECONDS, then off for PAUSE_SECONDS
+TALK_SECONDS = 3.2
+PAUSE_SECONDS = 0.4
+
+
+def make_audio(minutes, audio_format, work_dir):
+    path = os.path.join(work_dir, f"bench_{minutes}min.{audio_format}")
+    period = TALK_SECONDS + PAUSE_SECONDS
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "lavfi", "-i", f"sine=frequency=220:duration={minutes * 60}",
+         "-af", f"volume='lt(mod(t,{period}),{TALK_SECONDS})':eval=frame", "-ac", "1", "-ar", "44100", path],
+        check=True,
+    )
+    return path
+
+
+def make_cuts(duration, count, rng):
+    cuts = []
+    for _ in range(count):
+        start = rng.uniform(0, max(0.0, duration - 90))
+        # cuts are 15-90s, shorter on short files, and always leave the last second in place
+        longest = min(90.0, duration - start - 1)
+        cuts.append((round(start, 2), round(start + rng.uniform(min(15.0, longest / 2), longest), 2)))
+    return merge_intervals(cuts)
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="cut boundary snapping benchmark")
+    parser.add_argument("--minutes", type=int, nargs="+", default=[10, 60])
+    parser.add_argument("--cuts", type=int, default=12)
+    parser.add_argument("--format", default="mp3", help="container/extension of the generated audio")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    if min(args.minutes) < 1:
+        parser.error("--minutes must be at least 1")
+
+    rng = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix="bench_boundaries_")
+    results = []
+    print(f"{'minutes':>7} {'cuts':>5} {'snap_s':>8} {'copy_s':>8} {'reencode_s':>10} {'snap/copy':>10} {'snap/reencode':>14}")
+    try:
+        for minutes in args.minutes:
+            path = make_audio(minutes, args.format, work_dir)
+            try:
+                media_info = probe_media(path)
+            except Exception:
+                media_info = None
+            cuts = make_cuts(minutes * 60, args.cuts, rng)
+            output = os.path.join(work_dir, f"out.{args.format}")
+
+            snapped, snap_seconds = timed(refine_cuts, path, cuts, duration=minutes * 60)
+            copy_engine, copy_seconds = timed(api.trim_file, path, output, list(snapped), media_info=media_info)
+            _, reencode_seconds = timed(api.trim_file, path, output, list(snapped), sample_accurate=True, media_info=media_info)
+            os.remove(output)
+
+            row = {
+                "minutes": minutes,
+                "cuts": len(cuts),
+                "snap_seconds": snap_seconds,
+                "copy_engine": copy_engine,
+                "copy_seconds": copy_seconds,
+                "reencode_seconds": reencode_seconds,
+                "moved_boundaries": sum(a != b for cut, new in zip(cuts, snapped) for a, b in zip(cut, new)),
+            }
+            results.append(row)
+            print(f"{minutes:>7} {len(cuts):>5} {snap_seconds:>8.3f} {copy_seconds:>8.3f} {reencode_seconds:>10.3f} "
+                  f"{snap_seconds / copy_seconds:>10.2f} {snap_seconds / reencode_seconds:>14.3f}"
+                  + ("" if copy_engine == "copy" else f"  (copy fell back to {copy_engine})"))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+measures the logging overhead of parsing one transcription response, before and after the logging changes.
+
+    python benchmarks/bench_logging.py --words 2000 20000 60000
+
+"before" is the old setup: a synchronous DEBUG handler (basicConfig) and a debug record per transcript word.
+"after" is configure_logging(): records go through a queue to a background writer, at INFO (the default), at
+DEBUG without word tracing, and at DEBUG with one word in 100 traced. logs are written to a temporary file.
+request_seconds is the time spent on the request thread; drain_seconds is the extra time the background
+writer needed to flush the queue afterwards (zero for the synchronous handler).
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logconfig import TEXT_FORMAT, configure_logging, stop_logging, trace_words
+from metrics import RequestIdFilter
+from transcribers import AzureSpeechTranscriber
+
+
+def make_response(word_count):
+    phrases = []
+    for start in range(0, word_count, 10):
+        words = [{"text": f"w{i}", "offsetMilliseconds": i * 400, "durationMilliseconds": 300} for i in range(start, min(word_count, start + 10))]
+        phrases.append({"text": " ".join(w["text"] for w in words), "words": words})
+    return {"phrases": phrases}
+
+
+def parse_before(response):
+    # the parser as it was, logging every word
+    cleaned_words = []
+    for p_index, phrase in enumerate(response["phrases"]):
+        for w_index, word in enumerate(phrase["words"]):
+            start_time = word["offsetMilliseconds"] / 1000
+            end_time = start_time + (word["durationMilliseconds"] / 1000)
+            word_entry = {"word": word["text"], "start": start_time, "end": end_time}
+            cleaned_words.append(word_entry)
+            logging.debug("phrase %d, word %d: %s", p_index, w_index, word_entry)
+    return cleaned_words
+
+
+def parse_after(response, trace_every):
+    timeline = AzureSpeechTranscriber.parse(response)
+    trace_words("azure", timeline, trace_every)
+    return timeline
+
+
+def run_before(response, log_file):
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    handler = logging.StreamHandler(log_file)
+    handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handler.addFilter(RequestIdFilter())
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+    started = time.perf_counter()
+    parse_before(response)
+    return time.perf_counter() - started, 0.0
+
+
+def run_after(response, log_file, level, trace_every):
+    configure_logging(level, "text", stream=log_file)
+    started = time.perf_counter()
+    parse_after(response, trace_every)
+    request_seconds = time.perf_counter() - started
+    stop_logging()
+    return request_seconds, time.perf_counter() - started - request_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="per-request logging overhead benchmark")
+    parser.add_argument("--words", type=int, nargs="+", default=[2000, 20000, 60000])
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    setups = (
+        ("before", lambda response, f: run_before(response, f)),
+        ("after-info", lambda response, f: run_after(response, f, "INFO", 0)),
+        ("after-debug", lambda response, f: run_after(response, f, "DEBUG", 0)),
+        ("after-trace100", lambda response, f: run_after(response, f, "DEBUG", 100)),
+    )
+    results = []
+    print(f"{'words':>8} {'setup':>15} {'request_seconds':>16} {'drain_seconds':>14} {'log_bytes':>10}")
+    for word_count in args.words:
+        response = make_response(word_count)
+        for name, run in setups:
+            with tempfile.TemporaryFile("w+") as log_file:
+                request_seconds, drain_seconds = run(response, log_file)
+                log_file.flush()
+                log_bytes = log_file.tell()
+            row = {"words": word_count, "setup": name, "request_seconds": request_seconds, "drain_seconds": drain_seconds, "log_bytes": log_bytes}
+            results.append(row)
+            print(f"{word_count:>8} {name:>15} {request_seconds:>16.4f} {drain_seconds:>14.4f} {log_bytes:>10}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
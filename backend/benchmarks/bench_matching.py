@@ -0,0 +1,99 @@
+"""
+compares the exact and fuzzy phrase matchers on synthetic transcripts.
+
+    python benchmarks/bench_matching.py --words 20000 200000 --ads 20 --error-rate 0.1
+
+each synthetic transcript draws words from a zipf-like vocabulary and has --ads ad reads inserted into it.
+the phrases handed to the matchers are copies of those ad reads with a fraction of words misheard
+(a letter changed), replaced by another word or dropped, like an llm paraphrase or an asr error.
+recall is the fraction of inserted ads overlapped by at least one returned interval.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matching import Transcript, find_phrases, find_phrases_fuzzy
+
+WORD_SECONDS = 0.35
+
+
+def make_vocabulary(size, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    vocabulary = set()
+    while len(vocabulary) < size:
+        vocabulary.add("".join(rng.choice(letters) for _ in range(rng.randint(2, 9))))
+    return sorted(vocabulary)
+
+
+def corrupt(words, error_rate, vocabulary, rng):
+    corrupted = []
+    for word in words:
+        roll = rng.random()
+        if roll >= error_rate:
+            corrupted.append(word)
+        elif roll < error_rate / 2 and len(word) > 3:
+            # misheard: one letter changed
+            i = rng.randrange(len(word))
+            corrupted.append(word[:i] + rng.choice("aeiouxyz") + word[i + 1:])
+        elif roll < error_rate * 3 / 4:
+            corrupted.append(rng.choice(vocabulary))
+        # otherwise the word is dropped
+    return corrupted
+
+
+def make_case(word_count, ad_count, ad_words, error_rate, rng):
+    vocabulary = make_vocabulary(5000, rng)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    words = rng.choices(vocabulary, weights=weights, k=word_count)
+    ads = []
+    positions = sorted(rng.sample(range(0, word_count - ad_words, ad_words * 2), ad_count))
+    phrases = []
+    for position in positions:
+        ad = [rng.choice(vocabulary) for _ in range(ad_words)]
+        words[position:position + ad_words] = ad
+        ads.append((position * WORD_SECONDS, (position + ad_words) * WORD_SECONDS))
+        phrases.append(" ".join(corrupt(ad, error_rate, vocabulary, rng)))
+    transcript_words = [{"word": w, "start": i * WORD_SECONDS, "end": i * WORD_SECONDS + 0.3} for i, w in enumerate(words)]
+    return transcript_words, phrases, ads
+
+
+def recall(ads, intervals):
+    hit = sum(1 for start, end in ads if any(s < end and e > start for s, e in intervals))
+    return hit / len(ads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="exact vs fuzzy phrase matching benchmark")
+    parser.add_argument("--words", type=int, nargs="+", default=[20000, 100000, 200000])
+    parser.add_argument("--ads", type=int, default=20)
+    parser.add_argument("--ad-words", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'words':>8} {'matcher':>7} {'recall':>7} {'seconds':>8}")
+    for word_count in args.words:
+        rng = random.Random(args.seed)
+        words, phrases, ads = make_case(word_count, args.ads, args.ad_words, args.error_rate, rng)
+        for name, matcher in (("exact", find_phrases), ("fuzzy", find_phrases_fuzzy)):
+            started = time.perf_counter()
+            intervals = matcher(Transcript.from_words(words), phrases)
+            elapsed = time.perf_counter() - started
+            row = {"words": word_count, "matcher": name, "recall": recall(ads, intervals), "seconds": elapsed}
+            results.append(row)
+            print(f"{word_count:>8} {name:>7} {row['recall']:>7.2f} {elapsed:>8.3f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+end-to-end benchmark of /process against local stand-ins for azure speech and azure openai.
+
+    python benchmarks/bench_pipeline.py --minutes 1 10 60 180 --json results.json
+    python benchmarks/bench_pipeline.py --minutes 1 10 60 --compare results.json
+
+for each length the harness generates audio with ffmpeg's tone and noise sources (a tone over pink noise, switched
+off for a short pause every few seconds like speech between breaths) and places --ads-per-hour ad reads of
+--ad-seconds in it. stub_server.py is started with those ads as its chat answer: the speech stub names its words
+after their position (w0, w1, ... one every --word-seconds), so each ad phrase is the run of words its read covers
+and the cuts the pipeline should make are known exactly.
+
+every length runs in a fresh worker process, which uploads the file to /process through the flask test client and
+reads back the streamed response, so peak rss is per length. reported per length:
+- the wall time of the request and the time spent in each pipeline stage (the adtrimmer_stage_seconds histogram)
+- peak rss of the worker. ffmpeg's isn't included: ru_maxrss of a forked child counts the parent's pages it held
+  before exec, so it can't be told apart from the worker's
+- cpu seconds spent on the request by the worker and its ffmpeg children, not counting imports and startup (the
+  stub's own cpu isn't counted either, it stands in for a remote service), and throughput in audio-hours per cpu-hour
+- ad seconds removed against the ad seconds placed, which catches regressions in matching and trimming
+
+environment variables are passed through to the backend (e.g. TRANSCRIBE_CHUNKING=true, MATCH_MODE=fuzzy), except
+that the upstream endpoints always point at the stub and the result cache is always off.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# the tone is on for TALK_SECONDS, then off for PAUSE_SECONDS
+TALK_SECONDS = 3.2
+PAUSE_SECONDS = 0.4
+SAMPLE_RATE = 16000
+# the speech stub gives each word this fraction of --word-seconds
+STUB_WORD_FRACTION = 0.8
+
+
+def make_audio(minutes, audio_format, work_dir):
+    path = os.path.join(work_dir, f"bench_{minutes}min.{audio_format}")
+    seconds = minutes * 60
+    period = TALK_SECONDS + PAUSE_SECONDS
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+         "-f", "lavfi", "-i", f"sine=frequency=220:sample_rate={SAMPLE_RATE}:duration={seconds}",
+         "-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.05:sample_rate={SAMPLE_RATE}:duration={seconds}",
+         "-filter_complex", f"[0][1]amix=inputs=2:duration=first,volume='lt(mod(t,{period}),{TALK_SECONDS})':eval=frame",
+         "-ac", "1", "-ar", str(SAMPLE_RATE), path],
+        check=True,
+    )
+    return path
+
+
+def make_ads(duration, ads_per_hour, ad_seconds, word_seconds, rng):
+    """
+    places ad reads at random, non-overlapping positions and returns (phrases, expected cuts). each phrase is the
+    run of stub words the read covers; its expected cut runs from the first word's start to the last word's end.
+    """
+    count = max(1, round(ads_per_hour * duration / 3600))
+    slots = int(duration // (ad_seconds * 2))
+    starts = sorted(rng.sample(range(slots), min(count, slots)))
+    phrases = []
+    cuts = []
+    for slot in starts:
+        first = int(slot * ad_seconds * 2 / word_seconds)
+        last = min(first + int(ad_seconds / word_seconds), int(duration / word_seconds)) - 1
+        phrases.append(" ".join(f"w{index}" for index in range(first, last + 1)))
+        cuts.append((first * word_seconds, (last + STUB_WORD_FRACTION) * word_seconds))
+    return phrases, cuts
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub(port, phrases, word_seconds, seconds_per_audio_minute):
+    stub = subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, "stub_server.py"), "--port", str(port), "--phrases", json.dumps(phrases),
+         "--word-seconds", str(word_seconds), "--seconds-per-audio-minute", str(seconds_per_audio_minute)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/stats", timeout=1)
+            return stub
+        except requests.RequestException:
+            time.sleep(0.1)
+    stub.kill()
+    raise RuntimeError("stub server didn't start")
+
+
+def cpu_seconds():
+    """
+    returns the cpu time used so far by this process and its finished children
+    """
+    return sum(usage.ru_utime + usage.ru_stime for usage in (resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)))
+
+
+def run_worker(args):
+    """
+    worker process: runs one upload through /process and prints its measurements as json on the last line
+    """
+    import api
+    from metrics import AD_SECONDS_REMOVED, STAGE_SECONDS
+
+    api.init_worker()
+    client = api.app.test_client()
+    data = {"file": (open(args.worker, "rb"), os.path.basename(args.worker))}
+    if args.sample_accurate:
+        data["sample_accurate"] = "true"
+
+    cpu_started = cpu_seconds()
+    started = time.perf_counter()
+    response = client.post("/process", data=data, content_type="multipart/form-data", buffered=False)
+    output_bytes = 0
+    for chunk in response.response:
+        output_bytes += len(chunk)
+    response.close()
+    wall_seconds = time.perf_counter() - started
+    request_cpu_seconds = cpu_seconds() - cpu_started
+    api.shutdown_worker()
+
+    stages = {}
+    for metric in STAGE_SECONDS.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_sum"):
+                stages[sample.labels["stage"]] = round(sample.value, 4)
+    print(json.dumps({
+        "status": response.status_code,
+        "trim_engine": response.headers.get("X-Trim-Engine"),
+        "output_bytes": output_bytes,
+        "wall_seconds": wall_seconds,
+        "stages": stages,
+        # ru_maxrss is in kilobytes on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "cpu_seconds": request_cpu_seconds,
+        "startup_cpu_seconds": cpu_started,
+        "ad_seconds_removed": sum(sample.value for metric in AD_SECONDS_REMOVED.collect() for sample in metric.samples if sample.name.endswith("_total")),
+    }))
+
+
+def run_length(minutes, args, work_dir, rng):
+    path = make_audio(minutes, args.format, work_dir)
+    duration = minutes * 60
+    phrases, cuts = make_ads(duration, args.ads_per_hour, args.ad_seconds, args.word_seconds, rng)
+    port = free_port()
+    stub = start_stub(port, phrases, args.word_seconds, args.seconds_per_audio_minute)
+    env = dict(os.environ)
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    env.update({
+        "AI_SPEECH_RESOURCE_ENDPOINT": f"http://127.0.0.1:{port}/speechtotext/transcriptions:transcribe",
+        "AZURE_API_ENDPOINT": f"http://127.0.0.1:{port}",
+        "CACHE_ENABLED": "false",
+        "RATE_LIMITING_ENABLED": "false",
+        "JOBS_BACKEND": "memory",
+    })
+    for name, value in (("AI_SPEECH_PRIMARY_KEY", "stub"), ("AZURE_OPENAI_KEY", "stub"), ("AZURE_OPENAI_DEPLOYMENT", "stub"),
+                        ("AZURE_API_VERSION", "2024-08-01-preview"), ("LOG_LEVEL", "WARNING")):
+        env.setdefault(name, value)
+    command = [sys.executable, os.path.abspath(__file__), "--worker", path]
+    if args.sample_accurate:
+        command.append("--sample-accurate")
+    try:
+        # the worker's uploads dir is relative, so it runs in the scratch directory
+        result = subprocess.run(command, cwd=work_dir, env=env, capture_output=True, text=True)
+    finally:
+        stub.terminate()
+        stub.wait()
+        os.remove(path)
+    if result.returncode != 0:
+        raise RuntimeError(f"worker failed for {minutes} min: {result.stderr.strip()[-2000:]}")
+    measured = json.loads(result.stdout.strip().splitlines()[-1])
+
+    expected_ad_seconds = sum(end - start for start, end in cuts)
+    return {
+        "minutes": minutes,
+        "ads": len(cuts),
+        "expected_ad_seconds": round(expected_ad_seconds, 3),
+        **measured,
+        "ad_seconds_error": round(measured["ad_seconds_removed"] - expected_ad_seconds, 3),
+        "audio_hours_per_cpu_hour": duration / measured["cpu_seconds"] if measured["cpu_seconds"] else None,
+        "realtime_factor": measured["wall_seconds"] / duration,
+    }
+
+
+def environment():
+    try:
+        ffmpeg = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        ffmpeg = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "ffmpeg": ffmpeg,
+    }
+
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {row["minutes"]: row for row in json.load(f)["results"]}
+    print(f"\ncompared with {baseline_path}:")
+    print(f"{'minutes':>7} {'wall':>8} {'cpu':>8} {'rss':>8}")
+    for row in results:
+        before = baseline.get(row["minutes"])
+        if before is None:
+            continue
+        print(f"{row['minutes']:>7} {row['wall_seconds'] / before['wall_seconds']:>7.2f}x "
+              f"{row['cpu_seconds'] / before['cpu_seconds']:>7.2f}x {row['peak_rss_mb'] / before['peak_rss_mb']:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="end-to-end /process benchmark against stubbed azure services")
+    parser.add_argument("--minutes", type=int, nargs="+", default=[1, 10, 60])
+    parser.add_argument("--format", default="wav", help="container/extension of the generated audio (the stub reads anything but wav with ffprobe)")
+    parser.add_argument("--ads-per-hour", type=float, default=6)
+    parser.add_argument("--ad-seconds", type=float, default=30)
+    parser.add_argument("--word-seconds", type=float, default=0.5)
+    parser.add_argument("--seconds-per-audio-minute", type=float, default=0.0, help="simulated speech api latency")
+    parser.add_argument("--sample-accurate", action="store_true", help="use the re-encoding trim engine")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--compare", help="a results file from an earlier run to compare against")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(args)
+        return
+
+    rng = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    results = []
+    print(f"{'minutes':>7} {'status':>6} {'wall_s':>8} {'cpu_s':>8} {'rss_mb':>8} {'ah/cpuh':>8} {'ad_err_s':>8}  stages")
+    try:
+        for minutes in args.minutes:
+            row = run_length(minutes, args, work_dir, rng)
+            results.append(row)
+            stages = " ".join(f"{stage}={seconds:.2f}" for stage, seconds in row["stages"].items())
+            print(f"{minutes:>7} {row['status']:>6} {row['wall_seconds']:>8.2f} {row['cpu_seconds']:>8.2f} {row['peak_rss_mb']:>8.1f} "
+                  f"{row['audio_hours_per_cpu_hour'] or 0:>8.1f} {row['ad_seconds_error']:>8.2f}  {stages}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "environment": environment(), "results": results}, f, indent=2)
+    if args.compare:
+        print_comparison(results, args.compare)
+    if any(row["status"] != 200 for row in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+measures the real-time factor (transcription seconds per audio second) of a transcription provider.
+
+    python benchmarks/bench_transcribers.py --provider local --model small.en episode.mp3
+    python benchmarks/bench_transcribers.py --provider azure --repeat 3 episode.mp3
+
+the azure provider reads AI_SPEECH_RESOURCE_ENDPOINT and AI_SPEECH_PRIMARY_KEY from the environment (point them at
+stub_server.py to measure the client side alone). the local provider needs faster-whisper; its first run
+includes loading the model, so use --repeat to see the steady state.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from probe import probe_duration
+from transcribers import AzureSpeechTranscriber, LocalWhisperTranscriber
+from upstream import Upstream, create_session
+
+
+def make_transcriber(args):
+    if args.provider == "local":
+        return LocalWhisperTranscriber(model=args.model, compute_type=args.compute_type, cpu_threads=args.cpu_threads, beam_size=args.beam_size)
+    return AzureSpeechTranscriber(
+        os.environ.get("AI_SPEECH_RESOURCE_ENDPOINT"),
+        os.environ.get("AI_SPEECH_PRIMARY_KEY"),
+        create_session(1),
+        Upstream("azure speech", max_concurrency=1),
+        (10, 900),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="transcription real-time factor benchmark")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--provider", choices=("azure", "local"), default="local")
+    parser.add_argument("--model", default="small.en")
+    parser.add_argument("--compute-type", default="int8")
+    parser.add_argument("--cpu-threads", type=int, default=0)
+    parser.add_argument("--beam-size", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    transcriber = make_transcriber(args)
+    results = []
+    print(f"{'file':>30} {'run':>4} {'audio_s':>9} {'seconds':>9} {'words':>7} {'rtf':>7}")
+    for path in args.files:
+        duration = probe_duration(path)
+        for run in range(args.repeat):
+            started = time.perf_counter()
+            timeline = transcriber.transcribe(path)
+            elapsed = time.perf_counter() - started
+            audio_seconds = duration if duration is not None else timeline.end_time()
+            row = {"file": path, "run": run, "audio_seconds": audio_seconds, "seconds": elapsed, "words": len(timeline), "rtf": elapsed / audio_seconds}
+            results.append(row)
+            print(f"{os.path.basename(path)[-30:]:>30} {run:>4} {audio_seconds:>9.1f} {elapsed:>9.2f} {len(timeline):>7} {row['rtf']:>7.3f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+load test for a running backend: sends --requests uploads to /process from --concurrency clients at once and
+reports requests per second and latency percentiles.
+
+    python stub_server.py --port 7071 --seconds-per-audio-minute 0.5 --phrases '["w4 w5 w6 w7"]'
+    AI_SPEECH_RESOURCE_ENDPOINT=http://localhost:7071/speechtotext/transcriptions:transcribe \\
+    AZURE_API_ENDPOINT=http://localhost:7071 CACHE_ENABLED=false RATE_LIMITING_ENABLED=false \\
+        gunicorn -c gunicorn.conf.py api:app
+    python benchmarks/load_test.py --url http://localhost:7070 --concurrency 16 --requests 200
+
+the upload is a generated sine-wave wav of --audio-seconds unless --file is given. run the backend with the cache
+disabled, or every request after the first is served from it.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+
+def make_audio(seconds):
+    path = os.path.join(tempfile.mkdtemp(prefix="load_test_"), "load_test.wav")
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}", "-ac", "1", "-ar", "16000", path],
+        check=True,
+    )
+    return path
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/process load test")
+    parser.add_argument("--url", default="http://localhost:7070")
+    parser.add_argument("--file", help="file to upload (default: a generated wav)")
+    parser.add_argument("--audio-seconds", type=float, default=60)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    path = args.file or make_audio(args.audio_seconds)
+    with open(path, "rb") as f:
+        data = f.read()
+    name = os.path.basename(path)
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+
+    def one(_):
+        started = time.perf_counter()
+        try:
+            response = session.post(args.url + "/process", files={"file": (name, data)}, timeout=3600)
+            status = response.status_code
+        except requests.RequestException:
+            status = None
+        return status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [seconds for status, seconds in results if status == 200]
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    summary = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "seconds": elapsed,
+        "requests_per_second": args.requests / elapsed,
+        "statuses": statuses,
+    }
+    if latencies:
+        summary.update({
+            "p50_seconds": percentile(latencies, 0.50),
+            "p95_seconds": percentile(latencies, 0.95),
+            "p99_seconds": percentile(latencies, 0.99),
+            "max_seconds": max(latencies),
+        })
+    for key, value in summary.items():
+        print(f"{key:>20}: {value:.3f}" if isinstance(value, float) else f"{key:>20}: {value}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": summary}, f, indent=2)
+    if not latencies:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import sys
+import math
+import array
+import operator
+import logging
+import subprocess
+
+# envelope frames per second; each frame is the mean power of 10ms of audio
+ENVELOPE_RATE = 100
+# windows are decoded to mono pcm at this rate, which keeps the speech band and keeps the python side cheap
+ENVELOPE_SAMPLE_RATE = 8000
+SAMPLES_PER_FRAME = ENVELOPE_SAMPLE_RATE // ENVELOPE_RATE
+# full-scale power of a 16-bit sample, so envelope values are relative to full scale (1.0 = 0 dBFS)
+FULL_SCALE_POWER = 32768.0 ** 2
+# decoding starts this long before each window and the extra frames are dropped: right after a seek the decoder
+# outputs a few milliseconds of silence while it warms up, which would look like a pause at the window's start
+PREROLL_FRAMES = 10
+
+
+def boundary_windows(boundaries, tolerance, duration=None):
+    """
+    returns the sorted, merged (start, end) windows covering tolerance seconds either side of each boundary
+    """
+    windows = []
+    for boundary in sorted(boundaries):
+        start = max(0.0, boundary - tolerance)
+        end = boundary + tolerance if duration is None else min(duration, boundary + tolerance)
+        if end <= start:
+            continue
+        if windows and start <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], end)
+        else:
+            windows.append([start, end])
+    return [(start, end) for start, end in windows]
+
+
+def energy_envelopes(input_file, windows):
+    """
+    decodes only the given (start, end) windows of input_file, all in one ffmpeg run, and returns one array of
+    mean power (relative to full scale) per 1/ENVELOPE_RATE seconds for each window. each input seeks straight to
+    its window, so the cost grows with the number of cuts rather than with the length of the file.
+    """
+    command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin"]
+    filters = []
+    lengths = []
+    for index, (start, end) in enumerate(windows):
+        preroll = min(PREROLL_FRAMES, math.floor(start * ENVELOPE_RATE))
+        start -= preroll / ENVELOPE_RATE
+        frames = max(1, round((end - start) * ENVELOPE_RATE))
+        lengths.append((preroll, frames))
+        command += ["-ss", f"{start:.3f}", "-t", f"{end - start:.3f}", "-i", input_file]
+        # pad or cut every window to exactly its frame count so the concatenated output can be split again
+        samples = frames * SAMPLES_PER_FRAME
+        filters.append(
+            f"[{index}:a]aformat=channel_layouts=mono,aresample={ENVELOPE_SAMPLE_RATE},"
+            f"apad=whole_len={samples},atrim=end_sample={samples}[w{index}]"
+        )
+    labels = "".join(f"[w{index}]" for index in range(len(windows)))
+    filters.append(f"{labels}concat=n={len(windows)}:v=0:a=1[out]")
+    command += ["-filter_complex", ";".join(filters), "-map", "[out]", "-f", "s16le", "-acodec", "pcm_s16le", "-"]
+
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg energy envelope failed: {result.stderr.decode(errors='replace').strip()[-500:]}")
+    pcm = array.array("h")
+    pcm.frombytes(result.stdout[:len(result.stdout) - len(result.stdout) % pcm.itemsize])
+    if sys.byteorder == "big":
+        pcm.byteswap()
+    expected = sum(frames for _, frames in lengths) * SAMPLES_PER_FRAME
+    if len(pcm) < expected:
+        raise RuntimeError(f"ffmpeg energy envelope returned {len(pcm)} samples, expected {expected}")
+
+    envelopes = []
+    scale = 1 / (SAMPLES_PER_FRAME * FULL_SCALE_POWER)
+    offset = 0
+    for preroll, frames in lengths:
+        offset += preroll * SAMPLES_PER_FRAME
+        envelope = array.array("d")
+        for _ in range(frames - preroll):
+            chunk = pcm[offset:offset + SAMPLES_PER_FRAME]
+            envelope.append(sum(map(operator.mul, chunk, chunk)) * scale)
+            offset += SAMPLES_PER_FRAME
+        envelopes.append(envelope)
+    return envelopes
+
+
+def snap_point(time, window_start, envelope, tolerance, silence_power):
+    """
+    returns the middle of the run of frames below silence_power closest to time, looking tolerance seconds either
+    side. returns time unchanged if there is no such pause (e.g. the cut falls inside music) or the envelope
+    doesn't reach it.
+    """
+    first = max(0, math.ceil((time - tolerance - window_start) * ENVELOPE_RATE - 0.5))
+    last = min(len(envelope) - 1, math.floor((time + tolerance - window_start) * ENVELOPE_RATE - 0.5))
+
+    def frame_time(index):
+        return window_start + (index + 0.5) / ENVELOPE_RATE
+
+    best_run = None
+    best_distance = None
+    run_start = None
+    for index in range(first, last + 2):
+        silent = index <= last and envelope[index] <= silence_power
+        if silent and run_start is None:
+            run_start = index
+        elif not silent and run_start is not None:
+            # distance from time to the nearest frame of the run (zero if time falls inside it)
+            distance = max(0.0, frame_time(run_start) - time, time - frame_time(index - 1))
+            if best_distance is None or distance < best_distance:
+                best_run = (run_start, index - 1)
+                best_distance = distance
+            run_start = None
+
+    if best_run is None:
+        return time
+    return (frame_time(best_run[0]) + frame_time(best_run[1])) / 2
+
+
+def refine_cuts(input_file, cuts, tolerance=0.5, silence_db=-45, merge_gap=0.5, duration=None):
+    """
+    moves each cut's start and end to the nearest pause (frames quieter than silence_db dBFS) within tolerance seconds, so cuts land in the
+    pauses between words instead of clipping a breath or leaving a click, then merges cuts less than merge_gap
+    seconds apart. cuts is a sorted list of (start, end) tuples; returns a new list. duration, if known, bounds
+    the cuts to the file.
+    """
+    if not cuts:
+        return []
+    boundaries = [point for cut in cuts for point in cut]
+    windows = boundary_windows(boundaries, tolerance, duration)
+    if not windows:
+        return list(cuts)
+    envelopes = energy_envelopes(input_file, windows)
+    silence_power = 10 ** (silence_db / 10)
+
+    def snap(time):
+        for (start, end), envelope in zip(windows, envelopes):
+            if start <= time <= end:
+                return snap_point(time, start, envelope, tolerance, silence_power)
+        return time
+
+    snapped = []
+    for start, end in cuts:
+        new_start, new_end = snap(start), snap(end)
+        if duration is not None:
+            new_start, new_end = max(0.0, new_start), min(duration, new_end)
+        # a boundary snapping past the other end would remove nothing; keep the cut as matched
+        if new_end <= new_start:
+            new_start, new_end = start, end
+        snapped.append((new_start, new_end))
+
+    merged = []
+    for start, end in sorted(snapped):
+        if merged and start - merged[-1][1] <= merge_gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    logging.debug("refined %d cuts into %d using %d envelope windows", len(cuts), len(merged), len(windows))
+    return [(start, end) for start, end in merged]
@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# entry directories without metadata are left alone for this long, in case another process is still writing them
+ORPHAN_GRACE_SECONDS = 3600
+
+
+def hash_file(file_path):
+    """
+    returns the sha256 hex digest of a file's bytes, read in chunks so large uploads aren't loaded into memory
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    persistent on-disk cache of pipeline results, keyed by the hash of the uploaded audio bytes.
+    each entry is a directory holding meta.json (word-level transcript as WordTimeline json, ad phrases, the matched cut
+    intervals of each stored output) and optionally trimmed output files, one per variant. entries are evicted by age and by total size on disk.
+    entries are written with atomic renames and the hit/miss counters are kept in a locked file, so every process on a
+    node can share one cache_dir (and replicas can share it on a common volume).
+    """
+
+    def __init__(self, cache_dir, max_bytes, max_age_seconds, store_output=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.store_output = store_output
+        os.makedirs(cache_dir, exist_ok=True)
+        self._stats_path = os.path.join(cache_dir, "stats.json")
+        logging.debug("initialized result cache at %s (max_bytes=%d, max_age_seconds=%d)", cache_dir, max_bytes, max_age_seconds)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _meta_path(self, key):
+        return os.path.join(self._entry_dir(key), "meta.json")
+
+    def _output_path(self, key, variant, ext):
+        return os.path.join(self._entry_dir(key), f"output_{variant}{ext}")
+
+    def _read_meta(self, key):
+        """
+        returns the stored metadata dict for key, or None if there is none
+        """
+        try:
+            with open(self._meta_path(key), "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def _write_meta(self, key, meta):
+        os.makedirs(self._entry_dir(key), exist_ok=True)
+        # write to a temp file and rename so concurrent readers never see a half-written entry
+        tmp_meta_path = f"{self._meta_path(key)}.{os.getpid()}.tmp"
+        with open(tmp_meta_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_meta_path, self._meta_path(key))
+
+    def _touch(self, key):
+        # touch the entry so size-based eviction drops the least recently used entries first
+        try:
+            os.utime(self._meta_path(key), None)
+        except OSError:
+            pass
+
+    def _delete_meta(self, key):
+        pass
+
+    def _count(self, **deltas):
+        """
+        adds deltas to the shared hit/miss counters
+        """
+        with open(self._stats_path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                counts = json.loads(f.read() or "{}")
+            except json.JSONDecodeError:
+                counts = {}
+            for field, delta in deltas.items():
+                counts[field] = counts.get(field, 0) + delta
+            f.seek(0)
+            f.truncate()
+            json.dump(counts, f)
+
+    def _read_counts(self):
+        try:
+            with open(self._stats_path, "r") as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                return json.loads(f.read() or "{}")
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def get(self, key):
+        """
+        returns the cached metadata dict for key, or None on a miss. expired entries count as misses.
+        """
+        meta = self._read_meta(key)
+        if meta is None:
+            self._count(misses=1)
+            logging.debug("cache miss for key: %s", key)
+            return None
+
+        if time.time() - meta.get("created", 0) > self.max_age_seconds:
+            logging.debug("cache entry expired for key: %s", key)
+            self._remove_entry(key)
+            self._count(misses=1)
+            return None
+
+        self._touch(key)
+        self._count(hits=1, transcribe_seconds_saved=meta.get("transcribe_seconds", 0.0))
+        logging.debug("cache hit for key: %s", key)
+        return meta
+
+    def get_output(self, key, meta, variant="default"):
+        """
+        returns the path of the cached trimmed output for key, or None if it wasn't stored.
+        the cut intervals it was trimmed at are meta["outputs"][variant].
+        """
+        if variant not in meta.get("outputs", {}):
+            return None
+        ext = meta.get("ext", "")
+        output_path = self._output_path(key, variant, ext)
+        try:
+            os.utime(output_path, None)
+        except OSError:
+            return None
+        self._count(output_hits=1)
+        return output_path
+
+    def put(self, key, ext, transcript, phrases, matches, transcribe_seconds=0.0, output_file=None, variant="default", phrases_version=None):
+        """
+        stores (or updates) the cache entry for key, copying output_file into the cache if output storage is enabled.
+        outputs of other variants already stored for key are kept. phrases_version is stored with the phrases, for
+        the caller to tell whether they were detected under its current settings.
+        """
+        previous = self._read_meta(key) or {}
+        outputs = dict(previous.get("outputs") or {})
+        if self.store_output and output_file and os.path.exists(output_file):
+            os.makedirs(self._entry_dir(key), exist_ok=True)
+            output_path = self._output_path(key, variant, ext)
+            tmp_output_path = f"{output_path}.{os.getpid()}.tmp"
+            shutil.copyfile(output_file, tmp_output_path)
+            os.replace(tmp_output_path, output_path)
+            outputs[variant] = [list(match) for match in matches]
+
+        meta = {
+            "created": time.time(),
+            "ext": ext,
+            # an update from cached phrases didn't transcribe, but a later hit still saves the first transcription
+            "transcribe_seconds": transcribe_seconds or previous.get("transcribe_seconds", 0.0),
+            "transcript": transcript,
+            "phrases": phrases,
+            "phrases_version": phrases_version,
+            "outputs": outputs,
+        }
+        self._write_meta(key, meta)
+        logging.debug("stored cache entry for key: %s", key)
+        self.evict()
+
+    def _remove_entry(self, key):
+        self._delete_meta(key)
+        self._remove_files(key)
+
+    def _entries(self):
+        """
+        returns a list of (key, created, last_used, size_in_bytes, has_meta) for every entry directory on disk, from
+        file stats alone. put renames its files into the entry directory, so the directory's mtime is when the entry
+        was last written; hits touch the files, not the directory.
+        """
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self._entry_dir(key)
+            try:
+                created = os.stat(entry_dir).st_mtime
+                names = os.listdir(entry_dir)
+            except (NotADirectoryError, FileNotFoundError):
+                continue
+            size = 0
+            last_used = created
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(entry_dir, name))
+                except OSError:
+                    continue
+                size += stat.st_size
+                last_used = max(last_used, stat.st_mtime)
+            entries.append((key, created, last_used, size, "meta.json" in names))
+        return entries
+
+    def _orphaned(self, has_meta, last_used, now):
+        """
+        returns whether an entry directory without metadata is left over (expired elsewhere, or a write that never
+        finished) rather than still being written
+        """
+        return not has_meta and now - last_used > ORPHAN_GRACE_SECONDS
+
+    def _remove_files(self, key):
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        logging.debug("removed cache files: %s", key)
+
+    def evict(self):
+        """
+        removes entries older than max_age_seconds, then the least recently used entries until under max_bytes.
+        runs on every put, so it only looks at file stats and never reads entry metadata.
+        """
+        now = time.time()
+        entries = []
+        for key, created, last_used, size, has_meta in self._entries():
+            if now - created > self.max_age_seconds or self._orphaned(has_meta, last_used, now):
+                self._remove_files(key)
+                continue
+            entries.append((key, last_used, size))
+
+        total_bytes = sum(size for _, _, size in entries)
+        entries.sort(key=lambda entry: entry[1])
+        for key, _, size in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            self._remove_files(key)
+            total_bytes -= size
+        logging.debug("cache eviction done; %d bytes on disk", total_bytes)
+
+    def _count_entries(self, entries):
+        return len(entries)
+
+    def stats(self):
+        entries = self._entries()
+        counts = self._read_counts()
+        hits = counts.get("hits", 0)
+        lookups = hits + counts.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": counts.get("misses", 0),
+            "output_hits": counts.get("output_hits", 0),
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "transcribe_seconds_saved": round(counts.get("transcribe_seconds_saved", 0.0), 3),
+            "entries": self._count_entries(entries),
+            "bytes": sum(entry[3] for entry in entries),
+        }
+
+
+class RedisResultCache(ResultCache):
+    """
+    result cache whose metadata (transcript, phrases, matches) and counters live in redis, so replicas on different
+    nodes share transcriptions. redis expires the metadata after max_age_seconds. trimmed outputs are still files
+    under cache_dir, evicted by age and size as before; put cache_dir on a shared volume to share them as well.
+    evicting an output for disk space leaves its transcript in redis.
+    """
+
+    def __init__(self, redis, cache_dir, max_bytes, max_age_seconds, store_output=True, prefix="adtrimmer:"):
+        self.redis = redis
+        self.prefix = prefix
+        super().__init__(cache_dir, max_bytes, max_age_seconds, store_output)
+
+    def _redis_key(self, key):
+        return f"{self.prefix}cache:{key}"
+
+    def _read_meta(self, key):
+        data = self.redis.get(self._redis_key(key))
+        return json.loads(data) if data is not None else None
+
+    def _write_meta(self, key, meta):
+        self.redis.set(self._redis_key(key), json.dumps(meta), ex=self.max_age_seconds)
+
+    def _touch(self, key):
+        pass
+
+    def _delete_meta(self, key):
+        self.redis.delete(self._redis_key(key))
+
+    def _count(self, **deltas):
+        pipe = self.redis.pipeline()
+        for field, delta in deltas.items():
+            pipe.hincrbyfloat(self.prefix + "cache_stats", field, delta)
+        pipe.execute()
+
+    def _read_counts(self):
+        counts = {field.decode(): float(value) for field, value in self.redis.hgetall(self.prefix + "cache_stats").items()}
+        return {field: value if field == "transcribe_seconds_saved" else int(value) for field, value in counts.items()}
+
+    def _orphaned(self, has_meta, last_used, now):
+        # the metadata is in redis, never on disk
+        return False
+
+    def _count_entries(self, entries):
+        # entries without an output file only exist in redis
+        on_disk = {entry[0] for entry in entries}
+        prefix = self._redis_key("")
+        in_redis = {redis_key.decode()[len(prefix):] for redis_key in self.redis.scan_iter(match=prefix + "*")}
+        return len(on_disk | in_redis)
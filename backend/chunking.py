@@ -0,0 +1,171 @@
+import os
+import re
+import shutil
+import tempfile
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from probe import probe_duration
+from transcribers import WordTimeline
+
+SILENCE_START_RE = re.compile(r"silence_start: (-?[0-9.]+)")
+SILENCE_END_RE = re.compile(r"silence_end: (-?[0-9.]+)")
+
+
+def detect_silences(input_file, noise_db=-35, min_silence_seconds=0.4):
+    """
+    runs ffmpeg's silencedetect filter over the file and returns a list of (start, end) silent intervals in seconds
+    """
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-nostats", "-i", input_file, "-vn", "-af", f"silencedetect=n={noise_db}dB:d={min_silence_seconds}", "-f", "null", "-"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg silencedetect failed: {result.stderr.strip()[-500:]}")
+    silences = []
+    start = None
+    for line in result.stderr.splitlines():
+        start_match = SILENCE_START_RE.search(line)
+        if start_match:
+            start = max(0.0, float(start_match.group(1)))
+            continue
+        end_match = SILENCE_END_RE.search(line)
+        if end_match and start is not None:
+            silences.append((start, float(end_match.group(1))))
+            start = None
+    logging.debug("detected %d silences in %s", len(silences), input_file)
+    return silences
+
+
+def plan_chunks(duration, chunk_seconds, overlap_seconds, silences=None, search_seconds=None):
+    """
+    splits [0, duration) into chunks of roughly chunk_seconds. each chunk is a dict with:
+      - "start"/"end": the audio range to transcribe, which reaches overlap_seconds past each cut into the neighbours
+      - "own_start"/"own_end": the range whose words this chunk contributes to the merged timeline
+    if silences are given, each cut is moved to the middle of the silence closest to its fixed position
+    (within search_seconds), so cuts fall between words instead of through them.
+    """
+    if chunk_seconds <= 0:
+        raise ValueError("chunk_seconds must be positive")
+    if search_seconds is None:
+        search_seconds = chunk_seconds * 0.1
+
+    cuts = []
+    position = chunk_seconds
+    previous_cut = 0.0
+    while position < duration:
+        cut = position
+        if silences:
+            candidates = [(s + e) / 2 for s, e in silences if abs((s + e) / 2 - position) <= search_seconds]
+            candidates = [c for c in candidates if previous_cut + overlap_seconds < c < duration - overlap_seconds]
+            if candidates:
+                cut = min(candidates, key=lambda c: abs(c - position))
+        cuts.append(cut)
+        previous_cut = cut
+        position = cut + chunk_seconds
+
+    bounds = [0.0] + cuts + [duration]
+    chunks = []
+    for own_start, own_end in zip(bounds, bounds[1:]):
+        chunks.append({
+            "start": max(0.0, own_start - overlap_seconds),
+            "end": min(duration, own_end + overlap_seconds),
+            "own_start": own_start,
+            "own_end": own_end,
+        })
+    return chunks
+
+
+def split_chunk(input_file, start, end, output_file):
+    """
+    extracts [start, end) of the input's audio into a 16khz mono wav file
+    """
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-ss", str(start), "-t", str(end - start), "-i", input_file,
+         "-vn", "-ac", "1", "-ar", "16000", "-c:a", "pcm_s16le", output_file],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg chunk split failed: {result.stderr.strip()}")
+
+
+def extract_audio(input_file, output_file):
+    """
+    extracts the input's audio into a 16khz mono wav file, e.g. to transcribe a video without uploading the picture
+    """
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", input_file, "-vn", "-ac", "1", "-ar", "16000", "-c:a", "pcm_s16le", output_file],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg audio extraction failed: {result.stderr.strip()}")
+
+
+def merge_chunk_timelines(chunk_timelines):
+    """
+    merges per-chunk timelines (already shifted onto the global timeline) into one WordTimeline.
+    chunk_timelines is a list of (chunk, timeline) in chunk order. each chunk keeps only the words whose midpoint lies
+    in its own range, and a word that repeats the previous one while overlapping it in time is dropped as a duplicate
+    transcribed on both sides of a cut.
+    """
+    merged = WordTimeline()
+    previous_word = None
+    for chunk, timeline in chunk_timelines:
+        is_last = chunk is chunk_timelines[-1][0]
+        for word, start, end in zip(timeline.words, timeline.starts, timeline.ends):
+            midpoint = (start + end) / 2
+            if midpoint < chunk["own_start"]:
+                continue
+            if midpoint >= chunk["own_end"] and not is_last:
+                continue
+            normalized = word.strip().lower()
+            if merged and start < merged.ends[-1] and normalized == previous_word:
+                continue
+            merged.append(word, start, end)
+            previous_word = normalized
+    return merged
+
+
+def transcribe_chunked(input_file, transcribe, chunk_seconds=600, overlap_seconds=4, max_workers=4, mode="silence", work_dir=None):
+    """
+    transcribes a long file as concurrent chunks and merges the word timestamps back into one global timeline.
+    transcribe is a function like Transcriber.transcribe, taking a file path and returning a WordTimeline.
+    mode is "silence" (cut at silences near each chunk boundary) or "fixed" (cut every chunk_seconds).
+    returns the merged WordTimeline.
+    """
+    duration = probe_duration(input_file)
+    if duration is None:
+        logging.debug("file duration unknown, can't plan chunks; transcribing in one request")
+        return transcribe(input_file)
+    if duration <= chunk_seconds:
+        logging.debug("file is %.1fs, not longer than one chunk; transcribing in one request", duration)
+        return transcribe(input_file)
+
+    silences = detect_silences(input_file) if mode == "silence" else None
+    chunks = plan_chunks(duration, chunk_seconds, overlap_seconds, silences=silences)
+    logging.debug("transcribing %.1fs file as %d chunks with %d workers", duration, len(chunks), max_workers)
+
+    temp_dir = tempfile.mkdtemp(prefix="chunks_", dir=work_dir)
+
+    def transcribe_one(index):
+        chunk = chunks[index]
+        chunk_file = os.path.join(temp_dir, f"chunk_{index:04d}.wav")
+        split_chunk(input_file, chunk["start"], chunk["end"], chunk_file)
+        try:
+            timeline = transcribe(chunk_file)
+        finally:
+            os.remove(chunk_file)
+        return timeline.shifted(chunk["start"])
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            chunk_timelines = list(executor.map(transcribe_one, range(len(chunks))))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    timeline = merge_chunk_timelines(list(zip(chunks, chunk_timelines)))
+    logging.debug("merged chunked transcription: %d words", len(timeline))
+    return timeline
@@ -0,0 +1,115 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from matching import normalize_token
+
+# rough tokens per transcript word for english speech, used to size windows without a tokenizer
+TOKENS_PER_WORD = 1.35
+
+# json schema for structured output, so the model can only answer with a list of phrases
+PHRASES_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "ad_phrases",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"phrases": {"type": "array", "items": {"type": "string"}}},
+            "required": ["phrases"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def parse_phrases(content):
+    """
+    parses a model response into a list of phrases. accepts {"phrases": [...]} (structured output) or a bare json array.
+    raises ValueError if the content is neither.
+    """
+    try:
+        parsed = json.loads(content)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"response is not valid json: {str(e)}")
+    if isinstance(parsed, dict):
+        parsed = parsed.get("phrases")
+    if not isinstance(parsed, list):
+        raise ValueError("response is not a list of phrases")
+    return [phrase for phrase in parsed if isinstance(phrase, str) and phrase.strip()]
+
+
+def plan_windows(word_count, window_tokens, overlap_tokens):
+    """
+    returns (start, end) word index ranges of at most window_tokens (estimated) each, where consecutive
+    windows share overlap_tokens worth of words so an ad crossing a boundary is seen whole by at least one window
+    or in two halves that can be stitched back together
+    """
+    window_words = max(1, int(window_tokens / TOKENS_PER_WORD))
+    overlap_words = min(window_words - 1, max(0, int(overlap_tokens / TOKENS_PER_WORD)))
+    windows = []
+    start = 0
+    while True:
+        end = min(word_count, start + window_words)
+        windows.append((start, end))
+        if end >= word_count:
+            return windows
+        start = end - overlap_words
+
+
+def _tokens(phrase):
+    return [normalize_token(word) for word in phrase.split()]
+
+
+def merge_phrases(phrase_lists, min_stitch_words=3):
+    """
+    reduces the per-window phrase lists into one list:
+      - an ad split across a window boundary (the end of a phrase from one window is the start of a phrase from
+        the next) is stitched back into one phrase
+      - exact duplicates (the same words, e.g. an ad reported whole by both windows of an overlap) are dropped.
+        a phrase contained in a longer one is kept: it can be a separate occurrence of the ad elsewhere in the
+        audio, and where it is the same occurrence the overlapping matches are merged later
+    """
+    stitched_lists = [list(phrases) for phrases in phrase_lists]
+    for i in range(len(stitched_lists) - 1):
+        current, following = stitched_lists[i], stitched_lists[i + 1]
+        for a_index, a in enumerate(current):
+            a_tokens = _tokens(a)
+            for b_index, b in enumerate(following):
+                b_tokens = _tokens(b)
+                longest = min(len(a_tokens), len(b_tokens))
+                overlap = next((k for k in range(longest, min_stitch_words - 1, -1) if a_tokens[-k:] == b_tokens[:k]), 0)
+                if overlap and overlap < len(b_tokens):
+                    joined = a + " " + " ".join(b.split()[overlap:])
+                    logging.debug("stitched phrases across window boundary (%d shared words)", overlap)
+                    current[a_index] = joined
+                    following[b_index] = joined
+                    a, a_tokens = joined, _tokens(joined)
+
+    merged = []
+    seen = set()
+    for phrases in stitched_lists:
+        for phrase in phrases:
+            tokens = tuple(_tokens(phrase))
+            if tokens in seen:
+                continue
+            seen.add(tokens)
+            merged.append(phrase)
+    return merged
+
+
+def detect_windowed(words, detect_window, window_tokens=12000, overlap_tokens=1000, max_workers=4):
+    """
+    map-reduce ad detection over the words of a transcript (a list of strings). they are split into overlapping windows,
+    detect_window(text) is called for each window concurrently (at most max_workers at once) and returns that
+    window's phrases, and the phrase lists are merged across the overlaps.
+    """
+    windows = plan_windows(len(words), window_tokens, overlap_tokens)
+    texts = [" ".join(words[start:end]) for start, end in windows]
+    logging.debug("detecting ads in %d windows with %d workers", len(windows), max_workers)
+    if len(texts) == 1:
+        return merge_phrases([detect_window(texts[0])])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        phrase_lists = list(executor.map(detect_window, texts))
+    merged = merge_phrases(phrase_lists)
+    logging.debug("merged %d window phrases into %d", sum(len(p) for p in phrase_lists), len(merged))
+    return merged
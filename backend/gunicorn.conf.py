@@ -0,0 +1,81 @@
+"""
+gunicorn settings for production: gunicorn -c gunicorn.conf.py api:app
+
+the app is imported once in the master (preload_app) and forked into GUNICORN_WORKERS processes, each serving
+GUNICORN_THREADS requests at a time. every worker then creates its own upstream clients and job workers
+(api.init_worker), since connection pools and threads don't survive a fork. JOBS_CONCURRENCY and the
+STAGE_*_CONCURRENCY caps are for the whole server and split between the workers.
+"""
+import os
+import shutil
+import logging
+import tempfile
+
+
+def cpu_count():
+    """
+    returns the cpus this process may run on, which in a container can be fewer than the host has
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:7070")
+# requests spend most of their time waiting on the speech/llm apis and on ffmpeg subprocesses rather than holding
+# the gil, so threads per worker do most of the concurrency and one worker per cpu covers the python-side work
+# GUNICORN_WORKERS is left empty in .env.example, which means the default
+workers = int(os.environ.get("GUNICORN_WORKERS") or cpu_count())
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+preload_app = True
+
+# gthread workers heartbeat from their main thread, so timeout only catches a hung worker, not a long request.
+# how long a request can run is bounded by the upstream timeouts (SPEECH_READ_TIMEOUT, OPENAI_READ_TIMEOUT)
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+# on shutdown (SIGTERM), workers stop accepting connections and get this long to finish requests in flight,
+# which for a long episode can be several minutes
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "900"))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+# uploads are streamed to disk, but keep the request line and headers bounded
+limit_request_line = 8190
+
+accesslog = "-"
+errorlog = "-"
+
+# the in-memory job store is private to each process, so a job submitted to one worker would be invisible to the rest
+if workers > 1 and os.environ.get("JOBS_BACKEND", "memory") == "memory":
+    logging.warning("jobs_backend memory isn't shared between %d workers, using sqlite", workers)
+    os.environ["JOBS_BACKEND"] = "sqlite"
+if workers > 1 and os.environ.get("RATE_LIMIT_STORAGE_URI", "").startswith("memory://"):
+    logging.warning("rate limit storage memory:// isn't shared between %d workers, each enforces RATE_LIMIT on its own", workers)
+
+# prometheus metrics from every worker are written to files here and summed at scrape time. this has to be set up
+# before the app (and prometheus_client) is imported, and values left over from a previous run are cleared first
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "adtrimmer_metrics"))
+shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+
+def pre_fork(server, worker):
+    # number the workers 0..workers-1, a replacement taking the number of the worker it replaces, so each one knows
+    # its part of the server-wide JOBS_CONCURRENCY and STAGE_*_CONCURRENCY
+    taken = {getattr(other, "slot", None) for other in server.WORKERS.values()}
+    worker.slot = next(slot for slot in range(len(taken) + 1) if slot not in taken)
+
+
+def post_fork(server, worker):
+    import api
+    api.init_worker(slot=worker.slot, workers=server.num_workers)
+
+
+def worker_exit(server, worker):
+    import api
+    # let running jobs finish within the graceful shutdown window; jobs not started yet stay queued in the sqlite store
+    api.shutdown_worker(timeout=graceful_timeout)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,505 @@
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from contextlib import closing
+from collections import OrderedDict
+
+JOB_FIELDS = ("id", "status", "stage", "created", "started", "finished", "error", "input_file", "output_file", "download_name", "options", "result", "heartbeat", "attempts")
+PUBLIC_JOB_FIELDS = ("id", "status", "stage", "created", "started", "finished", "error", "result")
+JSON_JOB_FIELDS = ("options", "result")
+
+
+class QueueFullError(Exception):
+    """
+    raised when a job is submitted while the queue is already at its maximum depth
+    """
+
+
+def recovered_fields(job, now, max_attempts):
+    """
+    returns the fields that recover a running job whose worker stopped heartbeating: back to queued, or failed once
+    it has been claimed max_attempts times (a job that keeps killing its worker, e.g. by running out of memory)
+    """
+    if (job.get("attempts") or 0) < max_attempts:
+        return {"status": "queued", "stage": None, "started": None, "heartbeat": None}
+    return {"status": "failed", "stage": None, "error": "the worker running this job stopped", "finished": now}
+
+
+def public_job_fields(job):
+    """
+    returns the subset of a job record that is safe to send to clients (no server-side file paths)
+    """
+    return {field: job.get(field) for field in PUBLIC_JOB_FIELDS}
+
+
+class MemoryJobStore:
+    """
+    in-process job store; job records live only as long as the process does
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+
+    def add(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def delete(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def claim_next(self):
+        """
+        marks the oldest queued job as running and returns it, or returns None if nothing is queued
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job["status"] == "queued":
+                    job["status"] = "running"
+                    job["started"] = job["heartbeat"] = time.time()
+                    job["attempts"] = (job.get("attempts") or 0) + 1
+                    return dict(job)
+        return None
+
+    def recover_stale(self, timestamp, max_attempts):
+        """
+        re-queues (or fails) running jobs whose heartbeat is older than timestamp and returns them
+        """
+        now = time.time()
+        recovered = []
+        with self._lock:
+            for job in self._jobs.values():
+                if job["status"] == "running" and (job.get("heartbeat") or job["started"]) < timestamp:
+                    job.update(recovered_fields(job, now, max_attempts))
+                    recovered.append(dict(job))
+        return recovered
+
+    def count_queued(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job["status"] == "queued")
+
+    def finished_before(self, timestamp):
+        with self._lock:
+            return [dict(job) for job in self._jobs.values() if job["finished"] is not None and job["finished"] < timestamp]
+
+
+class SQLiteJobStore:
+    """
+    sqlite-backed job store; the queue survives restarts and can be shared by several processes on one node
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    created REAL NOT NULL,
+                    started REAL,
+                    finished REAL,
+                    error TEXT,
+                    input_file TEXT,
+                    output_file TEXT,
+                    download_name TEXT,
+                    options TEXT,
+                    result TEXT,
+                    heartbeat REAL,
+                    attempts INTEGER
+                )
+                """
+            )
+            # databases created before leases were added lack these columns
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (("heartbeat", "REAL"), ("attempts", "INTEGER")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created)")
+        logging.debug("initialized sqlite job store at %s", db_path)
+
+    def _connect(self):
+        # a short-lived connection per call keeps the store safe to use from any thread
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _row_to_job(self, row):
+        job = dict(row)
+        for field in JSON_JOB_FIELDS:
+            job[field] = json.loads(job[field]) if job[field] else None
+        return job
+
+    def add(self, job):
+        record = dict(job)
+        for field in JSON_JOB_FIELDS:
+            record[field] = json.dumps(record[field]) if record.get(field) is not None else None
+        with closing(self._connect()) as conn:
+            conn.execute(
+                f"INSERT INTO jobs ({', '.join(JOB_FIELDS)}) VALUES ({', '.join('?' for _ in JOB_FIELDS)})",
+                [record.get(field) for field in JOB_FIELDS],
+            )
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row is not None else None
+
+    def update(self, job_id, **fields):
+        for field in JSON_JOB_FIELDS:
+            if fields.get(field) is not None:
+                fields[field] = json.dumps(fields[field])
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        with closing(self._connect()) as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", [*fields.values(), job_id])
+
+    def delete(self, job_id):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def claim_next(self):
+        """
+        marks the oldest queued job as running and returns it, or returns None if nothing is queued.
+        the claim is a single immediate transaction so two processes can never pick up the same job.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1").fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            started = time.time()
+            attempts = (row["attempts"] or 0) + 1
+            conn.execute(
+                "UPDATE jobs SET status = 'running', started = ?, heartbeat = ?, attempts = ? WHERE id = ?",
+                (started, started, attempts, row["id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        job = self._row_to_job(row)
+        job.update(status="running", started=started, heartbeat=started, attempts=attempts)
+        return job
+
+    def recover_stale(self, timestamp, max_attempts):
+        """
+        re-queues (or fails) running jobs whose heartbeat is older than timestamp and returns them, in one immediate
+        transaction so a job is recovered once however many processes look for stale jobs
+        """
+        now = time.time()
+        recovered = []
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'running' AND COALESCE(heartbeat, started) < ?", (timestamp,)
+            ).fetchall()
+            for row in rows:
+                job = self._row_to_job(row)
+                fields = recovered_fields(job, now, max_attempts)
+                conn.execute(f"UPDATE jobs SET {', '.join(f'{field} = ?' for field in fields)} WHERE id = ?", [*fields.values(), job["id"]])
+                job.update(fields)
+                recovered.append(job)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return recovered
+
+    def count_queued(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    def finished_before(self, timestamp):
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE finished IS NOT NULL AND finished < ?", (timestamp,)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+
+class RedisJobStore:
+    """
+    redis-backed job store, shared by every process and replica connected to the same redis.
+    each job is a json string under <prefix>job:<id>; queued ids wait in a list, running ids in a sorted set scored by
+    their last heartbeat and finished ids in a sorted set scored by their finish time.
+    """
+
+    def __init__(self, redis, prefix="adtrimmer:"):
+        self.redis = redis
+        self.prefix = prefix
+        self._queued_key = prefix + "jobs:queued"
+        self._running_key = prefix + "jobs:running"
+        self._finished_key = prefix + "jobs:finished"
+        logging.debug("initialized redis job store with prefix %s", prefix)
+
+    def _job_key(self, job_id):
+        return f"{self.prefix}job:{job_id}"
+
+    def add(self, job):
+        pipe = self.redis.pipeline()
+        pipe.set(self._job_key(job["id"]), json.dumps(job))
+        pipe.lpush(self._queued_key, job["id"])
+        pipe.execute()
+
+    def get(self, job_id):
+        data = self.redis.get(self._job_key(job_id))
+        return json.loads(data) if data is not None else None
+
+    def update(self, job_id, **fields):
+        key = self._job_key(job_id)
+
+        def apply(pipe):
+            data = pipe.get(key)
+            if data is None:
+                return
+            job = json.loads(data)
+            job.update(fields)
+            pipe.multi()
+            pipe.set(key, json.dumps(job))
+            if job["status"] == "running":
+                pipe.zadd(self._running_key, {job_id: job.get("heartbeat") or job["started"]})
+            else:
+                pipe.zrem(self._running_key, job_id)
+            if job["status"] == "queued" and fields.get("status") == "queued":
+                pipe.lpush(self._queued_key, job_id)
+            if job.get("finished") is not None:
+                pipe.zadd(self._finished_key, {job_id: job["finished"]})
+
+        # optimistic transaction: retried if another process changes the job in between
+        self.redis.transaction(apply, key)
+
+    def delete(self, job_id):
+        pipe = self.redis.pipeline()
+        pipe.delete(self._job_key(job_id))
+        pipe.zrem(self._finished_key, job_id)
+        pipe.zrem(self._running_key, job_id)
+        pipe.lrem(self._queued_key, 0, job_id)
+        pipe.execute()
+
+    def claim_next(self):
+        """
+        marks the oldest queued job as running and returns it, or returns None if nothing is queued.
+        popping the id from the queue list is atomic, so two processes can never pick up the same job.
+        """
+        while True:
+            job_id = self.redis.rpop(self._queued_key)
+            if job_id is None:
+                return None
+            job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+            started = time.time()
+            job = self.get(job_id)
+            # a job deleted while it was queued leaves a dangling id behind; skip it
+            if job is None:
+                continue
+            attempts = (job.get("attempts") or 0) + 1
+            self.update(job_id, status="running", started=started, heartbeat=started, attempts=attempts)
+            job.update(status="running", started=started, heartbeat=started, attempts=attempts)
+            return job
+
+    def recover_stale(self, timestamp, max_attempts):
+        """
+        re-queues (or fails) running jobs whose heartbeat is older than timestamp and returns them. removing the id
+        from the running set is atomic, so a job is recovered once however many processes look for stale jobs.
+        """
+        now = time.time()
+        recovered = []
+        for job_id in self.redis.zrangebyscore(self._running_key, "-inf", f"({timestamp}"):
+            if not self.redis.zrem(self._running_key, job_id):
+                continue
+            job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+            job = self.get(job_id)
+            if job is None or job["status"] != "running":
+                continue
+            fields = recovered_fields(job, now, max_attempts)
+            self.update(job_id, **fields)
+            job.update(fields)
+            recovered.append(job)
+        return recovered
+
+    def count_queued(self):
+        return self.redis.llen(self._queued_key)
+
+    def finished_before(self, timestamp):
+        job_ids = self.redis.zrangebyscore(self._finished_key, "-inf", f"({timestamp}")
+        jobs = [self.get(job_id.decode() if isinstance(job_id, bytes) else job_id) for job_id in job_ids]
+        return [job for job in jobs if job is not None]
+
+
+def create_job_store(backend, db_path=None, redis=None):
+    """
+    returns a job store for the configured backend ("memory", "sqlite" or "redis"; the last needs a redis client)
+    """
+    if backend == "memory":
+        return MemoryJobStore()
+    if backend == "sqlite":
+        return SQLiteJobStore(db_path)
+    if backend == "redis":
+        return RedisJobStore(redis)
+    raise ValueError(f"unknown job store backend: {backend}")
+
+
+class JobQueue:
+    """
+    bounded pool of worker threads that run handler(job, on_stage) for each submitted job.
+    handler returns a json-serialisable result dict, or raises to mark the job as failed.
+    finished jobs are dropped (and on_expire called for them) once they are older than result_ttl_seconds.
+    running jobs are leased: their worker refreshes a heartbeat every lease_seconds / 5, and a job whose heartbeat is
+    older than lease_seconds (its process was killed, e.g. by a timeout, oom or redeploy) is queued again, or failed
+    once it has been claimed max_attempts times.
+    """
+
+    def __init__(self, store, handler, concurrency=2, max_queue_depth=20, result_ttl_seconds=3600, on_expire=None, poll_interval=1.0,
+                 lease_seconds=300, max_attempts=2):
+        self.store = store
+        self.handler = handler
+        self.concurrency = concurrency
+        self.max_queue_depth = max_queue_depth
+        self.result_ttl_seconds = result_ttl_seconds
+        self.on_expire = on_expire
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._wakeup = threading.Semaphore(0)
+        self._threads = []
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._last_purge = 0.0
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        logging.debug("started %d job workers", self.concurrency)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        for _ in self._threads:
+            self._wakeup.release()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def is_full(self):
+        return self.store.count_queued() >= self.max_queue_depth
+
+    def submit(self, input_file, output_file, download_name, options=None):
+        """
+        queues a job and returns its id; raises QueueFullError if the queue is at max_queue_depth.
+        options is a json-serialisable dict handed to the handler with the job.
+        """
+        if self.is_full():
+            raise QueueFullError(f"job queue is full ({self.max_queue_depth} jobs waiting)")
+        job_id = uuid.uuid4().hex
+        self.store.add({
+            "id": job_id,
+            "status": "queued",
+            "stage": None,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "error": None,
+            "input_file": input_file,
+            "output_file": output_file,
+            "download_name": download_name,
+            "options": options or {},
+            "result": None,
+            "heartbeat": None,
+            "attempts": 0,
+        })
+        logging.debug("queued job: %s", job_id)
+        self._wakeup.release()
+        return job_id
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def _work(self):
+        while not self._stopping.is_set():
+            self._purge_expired()
+            job = self.store.claim_next()
+            if job is None:
+                # wait for a submit from this process, or poll for jobs queued by other processes
+                self._wakeup.acquire(timeout=self.poll_interval)
+                continue
+            self._run(job)
+
+    def _heartbeat(self):
+        """
+        keeps the leases of this process's running jobs fresh, and recovers jobs whose lease ran out
+        """
+        while not self._stopping.wait(self.lease_seconds / 5):
+            with self._running_lock:
+                job_ids = list(self._running)
+            for job_id in job_ids:
+                try:
+                    self.store.update(job_id, heartbeat=time.time())
+                except Exception as e:
+                    logging.error("error refreshing the lease of job %s: %s", job_id, str(e))
+            try:
+                recovered = self.store.recover_stale(time.time() - self.lease_seconds, self.max_attempts)
+            except Exception as e:
+                logging.error("error recovering stale jobs: %s", str(e))
+                continue
+            for job in recovered:
+                logging.warning("job %s was left running by a stopped worker, now %s", job["id"], job["status"])
+                if job["status"] == "queued":
+                    self._wakeup.release()
+
+    def _run(self, job):
+        job_id = job["id"]
+        logging.debug("running job: %s (attempt %d)", job_id, job.get("attempts") or 1)
+        with self._running_lock:
+            self._running.add(job_id)
+        try:
+            result = self.handler(job, lambda stage: self.store.update(job_id, stage=stage))
+        except Exception as e:
+            logging.error("job %s failed: %s", job_id, str(e))
+            self.store.update(job_id, status="failed", error=str(e), finished=time.time())
+            return
+        finally:
+            with self._running_lock:
+                self._running.discard(job_id)
+        self.store.update(job_id, status="done", stage=None, result=result, finished=time.time())
+        logging.debug("job finished: %s", job_id)
+
+    def _purge_expired(self):
+        now = time.time()
+        if now - self._last_purge < self.poll_interval:
+            return
+        self._last_purge = now
+        for job in self.store.finished_before(now - self.result_ttl_seconds):
+            if self.on_expire is not None:
+                try:
+                    self.on_expire(job)
+                except Exception as e:
+                    logging.error("error expiring job %s: %s", job["id"], str(e))
+            self.store.delete(job["id"])
+            logging.debug("expired job: %s", job["id"])
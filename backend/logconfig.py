@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from metrics import RequestIdFilter
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+_listener = None
+_queue_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    formats each record as one json object per line, for log collectors
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry)
+
+
+def configure_logging(level="INFO", log_format="text", stream=None):
+    """
+    sets up the root logger: records are tagged with the request id and put on an in-memory queue by the calling
+    thread, and a background listener formats and writes them to stream (stderr by default), so request threads
+    never block on log i/o. log_format is "text" or "json". calling it again replaces the previous setup.
+    """
+    global _listener, _queue_handler
+    stop_logging()
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # the request id lives in a context variable, so it has to be read on the thread that logged the record
+    queue_handler.addFilter(RequestIdFilter())
+    listener = logging.handlers.QueueListener(log_queue, handler)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    listener.start()
+    _listener = listener
+    _queue_handler = queue_handler
+
+
+def stop_logging():
+    """
+    writes out any queued records and stops the background listener
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_after_fork():
+    # a forked child (e.g. a gunicorn worker) inherits the queue but not the listener thread, so it gets a fresh
+    # queue and listener writing to the same handlers
+    global _listener
+    if _listener is None:
+        return
+    log_queue = queue.SimpleQueue()
+    _queue_handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers)
+    _listener.start()
+
+
+atexit.register(stop_logging)
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def trace_words(source, timeline, every):
+    """
+    debug-logs one word in every `every` of a transcribed WordTimeline (every word with every=1, none with every=0).
+    per-word logging is opt-in because a long episode has tens of thousands of words.
+    """
+    if every <= 0 or not logging.getLogger().isEnabledFor(logging.DEBUG):
+        return
+    for index in range(0, len(timeline), every):
+        word, start, end = timeline[index]
+        logging.debug("%s word %d: %s (%.2f-%.2f)", source, index, word, start, end)
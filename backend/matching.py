@@ -0,0 +1,326 @@
+import logging
+from array import array
+from collections import deque
+
+TRAILING_PUNCTUATION = ".,:;!?"
+
+
+def normalize_token(word):
+    """
+    normalises a word for matching: trimmed, lowercased and without trailing punctuation
+    """
+    return word.strip().lower().rstrip(TRAILING_PUNCTUATION)
+
+
+class Transcript:
+    """
+    word-level transcript stored as compact parallel arrays: interned token ids, start times and end times.
+    vocabulary maps each normalised token to its id.
+    """
+
+    __slots__ = ("tokens", "starts", "ends", "vocabulary", "_positions", "_token_strings")
+
+    def __init__(self, tokens, starts, ends, vocabulary):
+        self.tokens = tokens
+        self.starts = starts
+        self.ends = ends
+        self.vocabulary = vocabulary
+        self._positions = None
+        self._token_strings = None
+
+    @classmethod
+    def from_words(cls, words):
+        """
+        builds a transcript from a list of {"word", "start", "end"} dicts, as returned by the transcribers
+        """
+        vocabulary = {}
+        tokens = array("i")
+        starts = array("d")
+        ends = array("d")
+        for item in words:
+            token = normalize_token(item["word"])
+            token_id = vocabulary.get(token)
+            if token_id is None:
+                token_id = vocabulary[token] = len(vocabulary)
+            tokens.append(token_id)
+            starts.append(item["start"])
+            ends.append(item["end"])
+        return cls(tokens, starts, ends, vocabulary)
+
+    @classmethod
+    def from_timeline(cls, timeline):
+        """
+        builds a transcript from a transcribers.WordTimeline, sharing its time arrays
+        """
+        vocabulary = {}
+        tokens = array("i")
+        for word in timeline.words:
+            token = normalize_token(word)
+            token_id = vocabulary.get(token)
+            if token_id is None:
+                token_id = vocabulary[token] = len(vocabulary)
+            tokens.append(token_id)
+        return cls(tokens, timeline.starts, timeline.ends, vocabulary)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def positions(self, token_id):
+        """
+        returns the positions where token_id occurs; the token -> positions index is built on first use
+        """
+        if self._positions is None:
+            index = [array("i") for _ in range(len(self.vocabulary))]
+            for position, tid in enumerate(self.tokens):
+                index[tid].append(position)
+            self._positions = index
+        return self._positions[token_id]
+
+    def token_string(self, token_id):
+        if self._token_strings is None:
+            strings = [""] * len(self.vocabulary)
+            for token, tid in self.vocabulary.items():
+                strings[tid] = token
+            self._token_strings = strings
+        return self._token_strings[token_id]
+
+    def encode(self, text):
+        """
+        returns the token ids of a phrase, or None if any of its words never occur in the transcript
+        """
+        ids = []
+        for word in text.split():
+            token_id = self.vocabulary.get(normalize_token(word))
+            if token_id is None:
+                return None
+            ids.append(token_id)
+        return ids
+
+
+class PhraseAutomaton:
+    """
+    aho-corasick automaton over token id sequences, so every phrase can be matched in one pass over a transcript
+    """
+
+    def __init__(self, patterns):
+        # node 0 is the root; each node has transitions, a failure link and the indices of the patterns ending there
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        self.lengths = [len(pattern) for pattern in patterns]
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for token_id in pattern:
+                next_node = self.goto[node].get(token_id)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][token_id] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                node = next_node
+            self.outputs[node].append(index)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token_id, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and token_id not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(token_id, 0)
+                if self.fail[child] == child:
+                    self.fail[child] = 0
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def search(self, tokens):
+        """
+        yields (pattern_index, start_position) for every occurrence of every pattern in tokens
+        """
+        goto = self.goto
+        fail = self.fail
+        outputs = self.outputs
+        lengths = self.lengths
+        node = 0
+        for position, token_id in enumerate(tokens):
+            while node and token_id not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(token_id, 0)
+            for index in outputs[node]:
+                yield index, position - lengths[index] + 1
+
+
+def match_exact(transcript, phrases):
+    """
+    returns (phrase_index, first_position, last_position) for every exact occurrence of every phrase,
+    ordered by phrase and then by position. phrases containing words absent from the transcript can't match
+    and are skipped without a scan.
+    """
+    patterns = []
+    pattern_phrases = []
+    for phrase_index, phrase in enumerate(phrases):
+        if not isinstance(phrase, str):
+            logging.debug("skipping non-string phrase: %r", phrase)
+            continue
+        ids = transcript.encode(phrase)
+        if ids:
+            patterns.append(ids)
+            pattern_phrases.append(phrase_index)
+    if not patterns:
+        return []
+
+    automaton = PhraseAutomaton(patterns)
+    found = sorted(automaton.search(transcript.tokens))
+    return [(pattern_phrases[index], position, position + automaton.lengths[index] - 1) for index, position in found]
+
+
+def find_phrases(transcript, phrases):
+    """
+    returns a (start_time, end_time) tuple for every exact occurrence of every phrase in the transcript,
+    ordered by phrase and then by position
+    """
+    return [(transcript.starts[first], transcript.ends[last]) for _, first, last in match_exact(transcript, phrases)]
+
+
+def merge_intervals(intervals):
+    """
+    sorts (start, end) intervals and merges the ones that overlap or touch, returning a list of tuples
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def similarity(a, b):
+    """
+    returns 1 - (levenshtein distance / length of the longer string), so 1.0 means identical
+    """
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return 1 - previous[-1] / max(len(a), len(b))
+
+
+def align(phrase_tokens, window_tokens, substitution_cost, band, offset):
+    """
+    banded semi-global token alignment of the whole phrase against a stretch of the window, where the window is
+    expected to hold the phrase starting at position offset. only cells within band of that diagonal are computed,
+    and the phrase may start anywhere from offset - band to offset + band (but not before the window).
+    returns (cost, start, end) of the cheapest stretch, with end exclusive, in window positions.
+    insertions and deletions cost 1, substitutions cost substitution_cost(phrase_token, window_token).
+    """
+    width = len(window_tokens)
+    infinity = float("inf")
+    # row 0: the phrase may start anywhere in the band for free; starts tracks where each cell's alignment began
+    costs = [0.0 if offset - band <= j <= offset + band else infinity for j in range(width + 1)]
+    starts = list(range(width + 1))
+    for i, phrase_token in enumerate(phrase_tokens, 1):
+        low = max(1, i + offset - band)
+        high = min(width, i + offset + band)
+        if low > high:
+            return infinity, 0, 0
+        current_costs = [infinity] * (width + 1)
+        current_starts = [0] * (width + 1)
+        # leftmost cell: phrase token i has no window token to pair with, so it is deleted
+        current_costs[low - 1] = costs[low - 1] + 1 if low > 1 else float(i)
+        current_starts[low - 1] = starts[low - 1]
+        for j in range(low, high + 1):
+            best = costs[j - 1] + substitution_cost(phrase_token, window_tokens[j - 1])
+            best_start = starts[j - 1]
+            if costs[j] + 1 < best:
+                best = costs[j] + 1
+                best_start = starts[j]
+            if current_costs[j - 1] + 1 < best:
+                best = current_costs[j - 1] + 1
+                best_start = current_starts[j - 1]
+            current_costs[j] = best
+            current_starts[j] = best_start
+        costs = current_costs
+        starts = current_starts
+    end = min(range(1, width + 1), key=lambda j: costs[j]) if width else 0
+    return costs[end], starts[end], end
+
+
+def find_phrases_fuzzy(transcript, phrases, max_edit_ratio=0.2, token_similarity=0.8, anchor_count=3, min_phrase_words=3):
+    """
+    like find_phrases, but tolerates paraphrased or misheard words. phrases with an exact occurrence are matched exactly;
+    for the rest, candidate positions are seeded from the phrase's rarest words that occur in the transcript
+    (anchor_count of them), and each candidate is verified with a banded alignment whose cost may be at most
+    max_edit_ratio * phrase length. words whose similarity is at least token_similarity count as half a substitution.
+    the work per phrase depends on how often its anchors occur, not on the transcript length.
+    """
+    exact = match_exact(transcript, phrases)
+    results = [(transcript.starts[first], transcript.ends[last]) for _, first, last in exact]
+    matched_exactly = {phrase_index for phrase_index, _, _ in exact}
+
+    similarity_cache = {}
+
+    def substitution_cost(phrase_token, token_id):
+        window_token = transcript.token_string(token_id)
+        if phrase_token == window_token:
+            return 0.0
+        longest = max(len(phrase_token), len(window_token))
+        if abs(len(phrase_token) - len(window_token)) > (1 - token_similarity) * longest:
+            # too different in length to reach the threshold, skip the edit distance
+            return 1.0
+        key = (phrase_token, token_id)
+        score = similarity_cache.get(key)
+        if score is None:
+            score = similarity_cache[key] = similarity(phrase_token, window_token)
+        return 0.5 if score >= token_similarity else 1.0
+
+    total = len(transcript)
+    for phrase_index, phrase in enumerate(phrases):
+        if not isinstance(phrase, str) or phrase_index in matched_exactly:
+            continue
+        phrase_tokens = [normalize_token(word) for word in phrase.split()]
+        length = len(phrase_tokens)
+        if length < min_phrase_words:
+            continue
+        max_cost = max_edit_ratio * length
+        band = max(1, int(max_cost) + 1)
+
+        # rarest known words of the phrase seed the candidate start positions
+        anchors = []
+        for offset, token in enumerate(phrase_tokens):
+            token_id = transcript.vocabulary.get(token)
+            if token_id is not None:
+                anchors.append((len(transcript.positions(token_id)), offset, token_id))
+        anchors.sort()
+        candidates = set()
+        for _, offset, token_id in anchors[:anchor_count]:
+            for position in transcript.positions(token_id):
+                candidates.add(position - offset)
+
+        found = []
+        covered_until = -1
+        for candidate in sorted(candidates):
+            if candidate < covered_until:
+                continue
+            # near the start of the transcript the window is clamped, so the expected start moves left within it
+            # (or before it, when the phrase's first words were not transcribed)
+            window_start = max(0, candidate - band)
+            window_end = min(total, candidate + length + band)
+            if window_end <= window_start:
+                continue
+            window = transcript.tokens[window_start:window_end]
+            cost, start, end = align(phrase_tokens, window, substitution_cost, band, candidate - window_start)
+            if cost <= max_cost and end > start:
+                found.append((window_start + start, window_start + end - 1))
+                covered_until = window_start + end
+        for start, end in found:
+            results.append((transcript.starts[start], transcript.ends[end]))
+        logging.debug("fuzzy matching phrase with %d words: %d candidates, %d matches", length, len(candidates), len(found))
+    return results
@@ -0,0 +1,105 @@
+import os
+import time
+import uuid
+import logging
+import contextvars
+from contextlib import contextmanager
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+STAGE_SECONDS = Histogram(
+    "adtrimmer_stage_seconds",
+    "time spent in each pipeline stage",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+TRANSCRIBE_REALTIME_FACTOR = Histogram(
+    "adtrimmer_transcribe_realtime_factor",
+    "transcription seconds per second of audio, by provider",
+    ["provider"],
+    buckets=(0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5),
+)
+REQUESTS = Counter(
+    "adtrimmer_requests_total",
+    "processing requests by endpoint and response status",
+    ["endpoint", "status"],
+)
+BYTES_PROCESSED = Counter(
+    "adtrimmer_bytes_processed_total",
+    "bytes of uploaded media that went through the pipeline",
+)
+AUDIO_SECONDS_PROCESSED = Counter(
+    "adtrimmer_audio_seconds_processed_total",
+    "seconds of audio that went through the pipeline",
+)
+AD_SECONDS_REMOVED = Counter(
+    "adtrimmer_ad_seconds_removed_total",
+    "seconds of ads cut out of processed files",
+)
+UPSTREAM_RETRIES = Counter(
+    "adtrimmer_upstream_retries_total",
+    "upstream calls retried after a throttled or transient failure, by upstream",
+    ["upstream"],
+)
+UPSTREAM_THROTTLED = Counter(
+    "adtrimmer_upstream_throttled_total",
+    "upstream calls answered with a 429, by upstream",
+    ["upstream"],
+)
+
+# id of the request (or job) being handled, attached to every log record so one job can be traced across its stages
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+
+def new_request_id(incoming=None):
+    """
+    returns incoming (e.g. an X-Request-ID header from a proxy) if it looks sane, otherwise a fresh id
+    """
+    if incoming and len(incoming) <= 128 and incoming.isprintable():
+        return incoming
+    return uuid.uuid4().hex
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    logging filter that adds the current request id to each record as record.request_id
+    """
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    times the wrapped block into the stage histogram and logs the duration
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage=stage).observe(elapsed)
+        logging.debug("stage %s took %.3fs", stage, elapsed)
+
+
+def observe_stage(stage, elapsed):
+    """
+    records a stage duration measured elsewhere (e.g. across the lifetime of a streamed response)
+    """
+    STAGE_SECONDS.labels(stage=stage).observe(elapsed)
+    logging.debug("stage %s took %.3fs", stage, elapsed)
+
+
+def latest_metrics():
+    """
+    returns every metric in the prometheus text format. under a multi-process server (PROMETHEUS_MULTIPROC_DIR set,
+    see gunicorn.conf.py) each worker writes its values to that directory, and they are summed across workers here.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
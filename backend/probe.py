@@ -0,0 +1,78 @@
+import json
+import math
+import subprocess
+
+
+def probe_media(input_file):
+    """
+    runs ffprobe once and returns its parsed json output ("format" and "streams")
+    """
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", input_file],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {result.stderr.strip()}")
+    return json.loads(result.stdout)
+
+
+def media_duration(media_info):
+    """
+    returns the duration in seconds from probe_media output, or None if ffprobe doesn't know it
+    (some streamed or raw inputs have no duration, or "N/A")
+    """
+    try:
+        duration = float(media_info["format"]["duration"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return duration if math.isfinite(duration) else None
+
+
+def first_stream(media_info, codec_type):
+    """
+    returns the first stream of the given codec_type ("audio" or "video") from probe_media output, or None
+    """
+    for stream in media_info.get("streams", []):
+        if stream.get("codec_type") == codec_type:
+            return stream
+    return None
+
+
+def video_stream(media_info):
+    """
+    returns the first video stream from probe_media output, or None. cover art embedded in an audio file shows up as a
+    video stream too (an attached picture), and doesn't count.
+    """
+    for stream in media_info.get("streams", []):
+        if stream.get("codec_type") == "video" and not stream.get("disposition", {}).get("attached_pic"):
+            return stream
+    return None
+
+
+def probe_keyframes(input_file):
+    """
+    returns the sorted presentation times in seconds of the keyframes of the first video stream.
+    only packet headers are read, nothing is decoded.
+    """
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", input_file],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {result.stderr.strip()}")
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time))
+    keyframes.sort()
+    return keyframes
+
+
+def probe_duration(input_file):
+    """
+    returns the duration of a media file in seconds, using ffprobe, or None if it doesn't report one
+    """
+    return media_duration(probe_media(input_file))
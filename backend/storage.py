@@ -0,0 +1,97 @@
+import time
+import sqlite3
+import logging
+from contextlib import closing
+from limits.storage import Storage
+
+
+def redis_client(url):
+    """
+    returns a redis client for url, e.g. redis://localhost:6379/0. redis is only needed when a redis backend is configured.
+    """
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("a redis backend is configured but the redis package isn't installed (pip install redis)")
+    return redis.Redis.from_url(url)
+
+
+class SQLiteStorage(Storage):
+    """
+    limits storage for the fixed window strategy (flask-limiter's default), keeping one counter row per key in a
+    sqlite database, so every process on a node that opens the same file shares the counters.
+    defining the class registers the "sqlite" scheme with the limits library: flask-limiter then accepts
+    storage_uri="sqlite:///limits.db" (a relative path; sqlite:////abs/limits.db for an absolute one).
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri, wrap_exceptions=False, **options):
+        # sqlite:///relative.db or sqlite:////absolute.db
+        self.db_path = uri.split("://", 1)[1][1:]
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS limits (key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS limits_expires ON limits (expires)")
+        logging.debug("initialized sqlite rate limit storage at %s", self.db_path)
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    def _connect(self):
+        # a short-lived connection per call keeps the storage safe to use from any thread
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key, expiry, amount=1):
+        """
+        adds amount to the counter for key and returns the new count. a counter that doesn't exist or has expired
+        starts again from zero and expires expiry seconds from now.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # expired counters (this key's and any other's) are dropped as they're passed
+            conn.execute("DELETE FROM limits WHERE expires <= ?", (now,))
+            conn.execute(
+                "INSERT INTO limits (key, count, expires) VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE SET count = count + excluded.count",
+                (key, amount, now + expiry),
+            )
+            count = conn.execute("SELECT count FROM limits WHERE key = ?", (key,)).fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return count
+
+    def get(self, key):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT count FROM limits WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        return row[0] if row is not None else 0
+
+    def get_expiry(self, key):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT expires FROM limits WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        return row[0] if row is not None else time.time()
+
+    def check(self):
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        with closing(self._connect()) as conn:
+            count = conn.execute("SELECT COUNT(*) FROM limits").fetchone()[0]
+            conn.execute("DELETE FROM limits")
+        return count
+
+    def clear(self, key):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM limits WHERE key = ?", (key,))
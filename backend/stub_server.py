@@ -0,0 +1,169 @@
+"""
+local stand-in for the azure speech fast transcription and azure openai chat completions apis,
+for exercising the pipeline without azure.
+
+    python stub_server.py --port 7071 --seconds-per-audio-minute 0.5 --throttle-first 2
+
+then point the backend at it:
+
+    AI_SPEECH_RESOURCE_ENDPOINT=http://localhost:7071/speechtotext/transcriptions:transcribe
+    AZURE_API_ENDPOINT=http://localhost:7071
+
+the speech stub emits one word every --word-seconds of audio, named after its position in the uploaded file
+(w0, w1, ...), so a merged chunked transcript can be checked for gaps and duplicates by its timestamps.
+the chat stub answers every request with --phrases (a json array of strings).
+
+to check throttling and retries, --throttle-first answers the first n requests to each endpoint with a 429
+and --throttle-rate answers that fraction of requests with a 429, both with a Retry-After of --retry-after
+seconds. GET /stats returns how many requests each endpoint received and how many of them were throttled.
+"""
+import io
+import json
+import time
+import uuid
+import wave
+import random
+import argparse
+import threading
+import subprocess
+import tempfile
+from flask import Flask, request, jsonify
+
+app = Flask(__name__)
+settings = {
+    "word_seconds": 0.5,
+    "seconds_per_audio_minute": 0.0,
+    "phrases": "[]",
+    "throttle_first": 0,
+    "throttle_rate": 0.0,
+    "retry_after": 1.0,
+}
+counters_lock = threading.Lock()
+counters = {}
+
+
+def throttled(endpoint):
+    """
+    counts a request to endpoint and returns a 429 response if it should be throttled, otherwise None
+    """
+    with counters_lock:
+        counter = counters.setdefault(endpoint, {"requests": 0, "throttled": 0})
+        counter["requests"] += 1
+        throttle = counter["requests"] <= settings["throttle_first"] or random.random() < settings["throttle_rate"]
+        if throttle:
+            counter["throttled"] += 1
+    if not throttle:
+        return None
+    response = jsonify({"error": {"code": "429", "message": "Rate limit exceeded (stub)"}})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(settings["retry_after"])
+    return response
+
+
+def audio_duration(data):
+    """
+    returns the duration of uploaded audio bytes; wav is read directly, anything else goes through ffprobe
+    """
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            return wav.getnframes() / wav.getframerate()
+    except (wave.Error, EOFError):
+        pass
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", f.name],
+            capture_output=True,
+            text=True,
+        )
+    return float(result.stdout.strip())
+
+
+def fake_phrases(duration, word_seconds):
+    """
+    builds azure-style phrases (one per 10 words) with word-level offsets covering the whole duration
+    """
+    phrases = []
+    words = []
+    count = int(duration / word_seconds)
+    for i in range(count):
+        words.append({
+            "text": f"w{i}",
+            "offsetMilliseconds": int(i * word_seconds * 1000),
+            "durationMilliseconds": int(word_seconds * 800),
+        })
+    for i in range(0, len(words), 10):
+        phrase_words = words[i:i + 10]
+        offset = phrase_words[0]["offsetMilliseconds"]
+        phrases.append({
+            "offsetMilliseconds": offset,
+            "durationMilliseconds": phrase_words[-1]["offsetMilliseconds"] + phrase_words[-1]["durationMilliseconds"] - offset,
+            "text": " ".join(w["text"] for w in phrase_words),
+            "words": phrase_words,
+        })
+    return phrases
+
+
+@app.route("/speechtotext/transcriptions:transcribe", methods=["POST"])
+def transcribe():
+    throttle_response = throttled("speech")
+    if throttle_response is not None:
+        return throttle_response
+    if "audio" not in request.files:
+        return jsonify({"error": "no audio"}), 400
+    data = request.files["audio"].read()
+    duration = audio_duration(data)
+    # simulate upstream latency proportional to the audio length
+    time.sleep(settings["seconds_per_audio_minute"] * duration / 60)
+    phrases = fake_phrases(duration, settings["word_seconds"])
+    return jsonify({
+        "durationMilliseconds": int(duration * 1000),
+        "combinedPhrases": [{"text": " ".join(p["text"] for p in phrases)}],
+        "phrases": phrases,
+    })
+
+
+@app.route("/openai/deployments/<deployment>/chat/completions", methods=["POST"])
+def chat_completions(deployment):
+    throttle_response = throttled("openai")
+    if throttle_response is not None:
+        return throttle_response
+    return jsonify({
+        "id": "chatcmpl-" + uuid.uuid4().hex,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": deployment,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": settings["phrases"]},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    })
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    with counters_lock:
+        return jsonify(counters)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="local stand-in for the azure speech and openai apis")
+    parser.add_argument("--port", type=int, default=7071)
+    parser.add_argument("--word-seconds", type=float, default=0.5)
+    parser.add_argument("--seconds-per-audio-minute", type=float, default=0.0)
+    parser.add_argument("--phrases", default="[]", help="json array of ad phrases the chat stub returns")
+    parser.add_argument("--throttle-first", type=int, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    args = parser.parse_args()
+    json.loads(args.phrases)
+    settings["word_seconds"] = args.word_seconds
+    settings["seconds_per_audio_minute"] = args.seconds_per_audio_minute
+    settings["phrases"] = args.phrases
+    settings["throttle_first"] = args.throttle_first
+    settings["throttle_rate"] = args.throttle_rate
+    settings["retry_after"] = args.retry_after
+    app.run(host="127.0.0.1", port=args.port, threaded=True)
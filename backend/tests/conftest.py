@@ -0,0 +1,63 @@
+import os
+import sys
+import threading
+import http.server
+import pytest
+from werkzeug.serving import make_server
+
+# the backend modules import each other as top-level modules, as they do when run from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stub_server
+
+
+@pytest.fixture
+def stub():
+    """
+    runs stub_server.app on a free port with its default settings and fresh counters; yields its base url.
+    tests change stub_server.settings to simulate throttling.
+    """
+    defaults = dict(stub_server.settings)
+    stub_server.counters.clear()
+    server = make_server("127.0.0.1", 0, stub_server.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    thread.join()
+    stub_server.settings.update(defaults)
+
+
+@pytest.fixture
+def file_server():
+    """
+    serves canned responses: set server.routes[path] = (status, headers, body). yields the server, whose url is
+    server.url, and which records the path and Host header of every request in server.requests.
+    """
+    routes = {}
+    requests_seen = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append((self.path, self.headers["Host"]))
+            status, headers, body = routes.get(self.path, (404, {}, b"not found"))
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.routes = routes
+    server.requests = requests_seen
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
@@ -0,0 +1,135 @@
+import os
+import hashlib
+import pytest
+import batches
+from batches import (
+    BatchError, check_url, create_download_session, download, fetch_feed, parse_manifest, resolve_local_path, run_items,
+)
+
+LOCAL = {"127.0.0.1"}
+
+
+def test_parse_manifest_accepts_urls_paths_and_feeds():
+    items, feeds = parse_manifest({
+        "items": ["https://example.com/a/ep1.mp3", "shows/ep2.wav", {"url": "http://example.com/x?id=3", "name": "ep3.mp3"}],
+        "feeds": ["https://example.com/feed.xml", {"url": "https://example.com/other.xml", "limit": 2}],
+    })
+    assert items == [
+        {"source": "url", "url": "https://example.com/a/ep1.mp3", "name": "ep1.mp3"},
+        {"source": "path", "path": "shows/ep2.wav", "name": "ep2.wav"},
+        {"source": "url", "url": "http://example.com/x?id=3", "name": "ep3.mp3"},
+    ]
+    assert feeds == [{"url": "https://example.com/feed.xml", "limit": None}, {"url": "https://example.com/other.xml", "limit": 2}]
+
+
+@pytest.mark.parametrize("manifest", ["ep1.mp3", [{"url": "ftp://example.com/ep1.mp3"}], {"feeds": ["file:///etc/passwd"]}, [42]])
+def test_parse_manifest_rejects_invalid_entries(manifest):
+    with pytest.raises(BatchError):
+        parse_manifest(manifest)
+
+
+def test_resolve_local_path_stays_inside_the_root(tmp_path):
+    root = tmp_path / "media"
+    (root / "shows").mkdir(parents=True)
+    (root / "shows" / "ep1.wav").write_bytes(b"audio")
+    (tmp_path / "secret.wav").write_bytes(b"secret")
+
+    assert resolve_local_path("shows/ep1.wav", str(root)) == os.path.realpath(root / "shows" / "ep1.wav")
+    for path in ["../secret.wav", str(tmp_path / "secret.wav"), "shows/missing.wav"]:
+        with pytest.raises(BatchError):
+            resolve_local_path(path, str(root))
+    with pytest.raises(BatchError, match="disabled"):
+        resolve_local_path("shows/ep1.wav", None)
+
+
+def test_check_url_refuses_internal_addresses():
+    for url in ["http://localhost/ep.mp3", "http://10.0.0.5/ep.mp3", "http://169.254.169.254/latest/meta-data", "http://[::1]/ep.mp3"]:
+        with pytest.raises(BatchError, match="non-public"):
+            check_url(url)
+    with pytest.raises(BatchError):
+        check_url("file:///etc/passwd")
+    # a public address is returned, to be connected to instead of resolving the name again
+    assert check_url("http://93.184.216.34/ep.mp3") == "93.184.216.34"
+
+
+def test_check_url_with_allowed_hosts():
+    assert check_url("http://127.0.0.1:8000/ep.mp3", LOCAL) is None
+    with pytest.raises(BatchError, match="BATCH_ALLOWED_HOSTS"):
+        check_url("http://example.com/ep.mp3", LOCAL)
+
+
+def test_download_streams_the_file(file_server, tmp_path):
+    body = os.urandom(3000)
+    file_server.routes["/ep1"] = (200, {"Content-Type": "audio/mpeg"}, body)
+
+    path, digest = download(create_download_session(2), f"{file_server.url}/ep1", str(tmp_path), "Episode 1", 5, 10000, LOCAL)
+
+    assert path.endswith("_Episode_1.mp3")
+    assert open(path, "rb").read() == body
+    assert digest == hashlib.sha256(body).hexdigest()
+
+
+def test_download_refuses_oversized_files(file_server, tmp_path):
+    file_server.routes["/big.wav"] = (200, {}, b"x" * 2000)
+
+    with pytest.raises(BatchError, match="larger"):
+        download(create_download_session(2), f"{file_server.url}/big.wav", str(tmp_path), "big.wav", 5, 1000, LOCAL)
+    assert os.listdir(tmp_path) == []
+
+
+def test_redirects_are_checked(file_server, tmp_path):
+    file_server.routes["/moved.wav"] = (302, {"Location": "/ep.wav"}, b"")
+    file_server.routes["/ep.wav"] = (200, {}, b"audio")
+    file_server.routes["/away.wav"] = (302, {"Location": f"http://localhost:{file_server.server_port}/ep.wav"}, b"")
+    session = create_download_session(2)
+
+    path, _ = download(session, f"{file_server.url}/moved.wav", str(tmp_path), "moved.wav", 5, 1000, LOCAL)
+    assert open(path, "rb").read() == b"audio"
+    with pytest.raises(BatchError, match="BATCH_ALLOWED_HOSTS"):
+        download(session, f"{file_server.url}/away.wav", str(tmp_path), "away.wav", 5, 1000, LOCAL)
+
+
+def test_download_connects_to_the_checked_address(file_server, tmp_path, monkeypatch):
+    # media.example.com "resolved" to 127.0.0.1 when checked; the request must go there rather than be resolved again
+    monkeypatch.setattr(batches, "check_url", lambda url, allowed_hosts=None: "127.0.0.1")
+    file_server.routes["/ep.wav"] = (200, {}, b"audio")
+
+    path, _ = download(create_download_session(2), f"http://media.example.com:{file_server.server_port}/ep.wav", str(tmp_path), "ep.wav", 5, 1000)
+
+    assert open(path, "rb").read() == b"audio"
+    assert file_server.requests == [("/ep.wav", f"media.example.com:{file_server.server_port}")]
+
+
+def test_fetch_feed_returns_http_enclosures(file_server):
+    feed = b"""<rss><channel>
+        <item><title>Episode 2</title><enclosure url="https://cdn.example.com/ep2.mp3" type="audio/mpeg"/></item>
+        <item><title>Episode 1</title><enclosure url="https://cdn.example.com/ep1.mp3" type="audio/mpeg"/></item>
+        <item><title>Local</title><enclosure url="file:///etc/passwd"/></item>
+    </channel></rss>"""
+    file_server.routes["/feed.xml"] = (200, {"Content-Type": "application/rss+xml"}, feed)
+
+    items = fetch_feed(create_download_session(2), f"{file_server.url}/feed.xml", 5, allowed_hosts=LOCAL)
+    assert items == [
+        {"source": "url", "url": "https://cdn.example.com/ep2.mp3", "name": "Episode 2"},
+        {"source": "url", "url": "https://cdn.example.com/ep1.mp3", "name": "Episode 1"},
+    ]
+    assert fetch_feed(create_download_session(2), f"{file_server.url}/feed.xml", 5, limit=1, allowed_hosts=LOCAL) == items[:1]
+
+
+def test_run_items_isolates_failures():
+    items = [{"name": f"ep{i}", "source": "url"} for i in range(4)]
+    snapshots = []
+
+    def process(index, item, set_stage):
+        set_stage("transcribing")
+        if index == 2:
+            raise BatchError("404 for ep2")
+        return {"index": index}
+
+    statuses = run_items(items, process, 2, snapshots.append)
+
+    assert [status["status"] for status in statuses] == ["done", "done", "failed", "done"]
+    assert statuses[2]["error"] == "404 for ep2"
+    assert statuses[3]["result"] == {"index": 3}
+    assert all(status["stage"] is None for status in statuses)
+    assert snapshots[-1] == statuses
@@ -0,0 +1,63 @@
+import shutil
+import subprocess
+import pytest
+import requests
+import chunking
+from chunking import merge_chunk_timelines, plan_chunks, transcribe_chunked
+from transcribers import AzureSpeechTranscriber, WordTimeline
+from upstream import Upstream
+
+
+def timeline(*words):
+    result = WordTimeline()
+    for word, start, end in words:
+        result.append(word, start, end)
+    return result
+
+
+def test_plan_chunks_overlap_and_own_ranges():
+    chunks = plan_chunks(25.0, 10.0, 2.0)
+    assert [(c["own_start"], c["own_end"]) for c in chunks] == [(0.0, 10.0), (10.0, 20.0), (20.0, 25.0)]
+    assert [(c["start"], c["end"]) for c in chunks] == [(0.0, 12.0), (8.0, 22.0), (18.0, 25.0)]
+
+
+def test_plan_chunks_cuts_in_silences():
+    # each cut moves to the middle of the nearest silence within a tenth of a chunk of where it would fall;
+    # the second cut is looked for 10s after the first one
+    chunks = plan_chunks(25.0, 10.0, 2.0, silences=[(10.6, 11.0), (18.0, 18.4), (20.2, 20.6)])
+    assert [c["own_end"] for c in chunks] == [10.8, 20.4, 25.0]
+
+
+def test_merge_keeps_each_word_once():
+    chunks = plan_chunks(20.0, 10.0, 2.0)
+    first = timeline(("a", 7.0, 7.4), ("b", 9.0, 9.4), ("c", 10.5, 10.9), ("d", 11.5, 11.9))
+    second = timeline(("b", 9.0, 9.4), ("c", 10.5, 10.9), ("d", 11.5, 11.9), ("e", 15.0, 15.4))
+    merged = merge_chunk_timelines([(chunks[0], first), (chunks[1], second)])
+    assert merged.words == ["a", "b", "c", "d", "e"]
+    assert list(merged.starts) == [7.0, 9.0, 10.5, 11.5, 15.0]
+
+
+def test_merge_drops_a_word_transcribed_on_both_sides_of_the_cut():
+    chunks = plan_chunks(20.0, 10.0, 2.0)
+    # "cut" straddles 10s; each side heard it with slightly different timing
+    first = timeline(("before", 9.0, 9.5), ("cut", 9.7, 10.2))
+    second = timeline(("Cut", 9.8, 10.3), ("after", 10.6, 11.0))
+    merged = merge_chunk_timelines([(chunks[0], first), (chunks[1], second)])
+    assert merged.words == ["before", "cut", "after"]
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+def test_transcribe_chunked_against_stub(stub, tmp_path, monkeypatch):
+    audio = str(tmp_path / "speech.wav")
+    subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "sine=frequency=440:duration=25",
+                    "-ac", "1", "-ar", "16000", audio], check=True)
+    # the duration normally comes from ffprobe
+    monkeypatch.setattr(chunking, "probe_duration", lambda input_file: 25.0)
+    transcriber = AzureSpeechTranscriber(f"{stub}/speechtotext/transcriptions:transcribe", "key", requests.Session(), Upstream("test-chunks"), 10)
+
+    merged = transcribe_chunked(audio, transcriber.transcribe, chunk_seconds=10, overlap_seconds=2, max_workers=3, mode="fixed", work_dir=str(tmp_path))
+
+    # the stub emits a word every 0.5s of each chunk, so the merged timeline has one word per 0.5s of the file,
+    # none missing or repeated around the cuts at 10s and 20s
+    assert len(merged) == 50
+    assert [round(start, 2) for start in merged.starts] == [i * 0.5 for i in range(50)]
@@ -0,0 +1,135 @@
+import types
+import email.utils
+import pytest
+import requests
+from prometheus_client import REGISTRY
+import stub_server
+import upstream
+from upstream import Upstream, UpstreamError, parse_retry_after
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """
+    records the delays Upstream.call sleeps for instead of sleeping
+    """
+    slept = []
+    monkeypatch.setattr(upstream, "time", types.SimpleNamespace(sleep=slept.append, time=upstream.time.time))
+    return slept
+
+
+def metric(name, upstream_name):
+    return REGISTRY.get_sample_value(name, {"upstream": upstream_name}) or 0.0
+
+
+def chat(session, url):
+    return lambda: session.post(f"{url}/openai/deployments/d/chat/completions", json={"messages": []}, timeout=5)
+
+
+def test_throttled_calls_are_retried_after_retry_after(stub, delays):
+    stub_server.settings.update(throttle_first=2, retry_after=0.25)
+    retries = metric("adtrimmer_upstream_retries_total", "test-retry")
+    throttled = metric("adtrimmer_upstream_throttled_total", "test-retry")
+
+    response = Upstream("test-retry", max_attempts=5).call(chat(requests.Session(), stub))
+
+    assert response.status_code == 200
+    assert stub_server.counters["openai"] == {"requests": 3, "throttled": 2}
+    assert delays == [0.25, 0.25]
+    assert metric("adtrimmer_upstream_retries_total", "test-retry") - retries == 2
+    assert metric("adtrimmer_upstream_throttled_total", "test-retry") - throttled == 2
+
+
+def test_gives_up_with_upstream_error_after_max_attempts(stub, delays):
+    stub_server.settings.update(throttle_first=10, retry_after=0.1)
+
+    with pytest.raises(UpstreamError) as raised:
+        Upstream("test-give-up", max_attempts=3).call(chat(requests.Session(), stub))
+
+    assert raised.value.status_code == 429
+    assert stub_server.counters["openai"] == {"requests": 3, "throttled": 3}
+    # no wait after the last attempt
+    assert delays == [0.1, 0.1]
+
+
+def test_retry_after_is_capped(stub, delays):
+    stub_server.settings.update(throttle_first=1, retry_after=600)
+
+    response = Upstream("test-cap", max_retry_after=2.0).call(chat(requests.Session(), stub))
+
+    assert response.status_code == 200
+    assert delays == [2.0]
+
+
+def test_non_retryable_status_is_returned_as_is(stub, delays):
+    # the speech stub answers 400 to an upload without audio
+    response = Upstream("test-400").call(lambda: requests.post(f"{stub}/speechtotext/transcriptions:transcribe", timeout=5))
+
+    assert response.status_code == 400
+    assert stub_server.counters["speech"] == {"requests": 1, "throttled": 0}
+    assert delays == []
+
+
+def test_connection_errors_are_retried_with_backoff(delays):
+    # nothing listens on port 9 (discard) here, so every attempt fails to connect
+    call = Upstream("test-connect", max_attempts=4, backoff_base=0.5, backoff_max=1.0)
+
+    with pytest.raises(requests.ConnectionError):
+        call.call(lambda: requests.get("http://127.0.0.1:9/", timeout=1))
+
+    assert len(delays) == 3
+    for attempt, delay in enumerate(delays, 1):
+        assert 0 <= delay <= min(1.0, 0.5 * 2 ** (attempt - 1))
+
+
+class StatusError(Exception):
+    """
+    stands in for the openai sdk's errors, which carry the response's status_code
+    """
+
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = types.SimpleNamespace(headers={"Retry-After": "3"})
+
+
+def test_exceptions_with_a_retryable_status_are_retried(delays):
+    outcomes = [StatusError(503), StatusError(429), "ok"]
+
+    def attempt():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert Upstream("test-sdk").call(attempt) == "ok"
+    assert delays == [3.0, 3.0]
+
+
+def test_exceptions_with_other_statuses_are_raised_at_once(delays):
+    attempts = []
+
+    def attempt():
+        attempts.append(1)
+        raise StatusError(401)
+
+    with pytest.raises(StatusError):
+        Upstream("test-sdk-401").call(attempt)
+    assert len(attempts) == 1
+    assert delays == []
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2.5") == 2.5
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    in_a_minute = email.utils.formatdate(upstream.time.time() + 60, usegmt=True)
+    assert 55 <= parse_retry_after(in_a_minute) <= 60
+
+
+def test_backoff_is_jittered_below_the_exponential_cap():
+    call = Upstream("test-backoff", backoff_base=1.0, backoff_max=4.0)
+    for attempt, cap in [(1, 1.0), (2, 2.0), (3, 4.0), (6, 4.0)]:
+        delays = [call.backoff(attempt) for _ in range(50)]
+        assert all(0 <= delay <= cap for delay in delays)
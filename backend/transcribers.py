@@ -0,0 +1,250 @@
+import json
+import logging
+import threading
+import importlib.util
+from array import array
+from logconfig import trace_words
+
+
+class TranscriptionError(Exception):
+    """
+    raised when a provider can't produce a transcript (api error, missing model or dependency)
+    """
+
+
+class WordTimeline:
+    """
+    word-level transcript shared by every provider: the words and parallel arrays of their start and end times
+    in seconds. stored as json as {"words", "starts", "ends"} lists.
+    """
+
+    __slots__ = ("words", "starts", "ends")
+
+    def __init__(self, words=None, starts=None, ends=None):
+        self.words = words if words is not None else []
+        self.starts = starts if starts is not None else array("d")
+        self.ends = ends if ends is not None else array("d")
+
+    def append(self, word, start, end):
+        self.words.append(word)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, index):
+        return self.words[index], self.starts[index], self.ends[index]
+
+    def text(self):
+        return " ".join(self.words)
+
+    def end_time(self):
+        """
+        returns the end of the last word, or 0.0 for an empty timeline
+        """
+        return self.ends[-1] if self.ends else 0.0
+
+    def shifted(self, offset):
+        """
+        returns a copy with every timestamp moved by offset seconds (e.g. from chunk time to file time)
+        """
+        return WordTimeline(
+            list(self.words),
+            array("d", (start + offset for start in self.starts)),
+            array("d", (end + offset for end in self.ends)),
+        )
+
+    def to_json(self):
+        return {"words": self.words, "starts": self.starts.tolist(), "ends": self.ends.tolist()}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(list(data["words"]), array("d", data["starts"]), array("d", data["ends"]))
+
+
+class Transcriber:
+    """
+    a transcription provider. transcribe(file_path) returns a WordTimeline for the whole file.
+    """
+
+    name = None
+
+    def transcribe(self, file_path):
+        raise NotImplementedError
+
+
+class HttpTranscriber(Transcriber):
+    """
+    base for providers behind an http api: requests go through a shared session and an Upstream retry policy,
+    and subclasses turn the json response into a timeline in parse()
+    """
+
+    def __init__(self, session, upstream, timeout, trace_every=0):
+        self.session = session
+        self.upstream = upstream
+        self.timeout = timeout
+        self.trace_every = trace_every
+
+    def request(self, file_path):
+        """
+        performs one upload of file_path and returns the requests.Response
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def parse(response_json):
+        raise NotImplementedError
+
+    def transcribe(self, file_path):
+        logging.debug("starting %s transcription on file: %s", self.name, file_path)
+        try:
+            # request() reopens the file, so a retry uploads it from the start
+            response = self.upstream.call(lambda: self.request(file_path))
+            logging.debug("%s transcription response received with status code: %s", self.name, response.status_code)
+        except Exception as e:
+            logging.error("exception occurred while sending %s transcription request: %s", self.name, str(e))
+            raise
+        if response.status_code != 200:
+            error_msg = f"{self.name} transcription api error: {response.status_code}, {response.text}"
+            logging.error(error_msg)
+            raise TranscriptionError(error_msg)
+        timeline = self.parse(response.json())
+        logging.debug("%s transcription parsed: %d words", self.name, len(timeline))
+        trace_words(self.name, timeline, self.trace_every)
+        return timeline
+
+
+class AzureSpeechTranscriber(HttpTranscriber):
+    """
+    azure ai speech fast transcription api
+    """
+
+    name = "azure"
+
+    def __init__(self, endpoint, key, session, upstream, timeout, trace_every=0):
+        super().__init__(session, upstream, timeout, trace_every)
+        self.endpoint = endpoint
+        self.key = key
+
+    def request(self, file_path):
+        with open(file_path, "rb") as file:
+            return self.session.post(
+                self.endpoint,
+                # no content-type header - requests sets it with the multipart boundary
+                headers={"Ocp-Apim-Subscription-Key": self.key},
+                files={"audio": file},
+                data={"definition": json.dumps({"locales": ["en-US"]})},
+                timeout=self.timeout,
+            )
+
+    @staticmethod
+    def parse(response_json):
+        timeline = WordTimeline()
+        for phrase in response_json["phrases"]:
+            for word in phrase["words"]:
+                # offsets are in milliseconds
+                start = word["offsetMilliseconds"] / 1000
+                timeline.append(word["text"], start, start + word["durationMilliseconds"] / 1000)
+        return timeline
+
+
+class FireworksTranscriber(HttpTranscriber):
+    """
+    fireworks whisper transcription api
+    """
+
+    name = "fireworks"
+    endpoint = "https://audio-prod.us-virginia-1.direct.fireworks.ai/v1/audio/transcriptions"
+
+    def __init__(self, api_key, session, upstream, timeout, trace_every=0):
+        super().__init__(session, upstream, timeout, trace_every)
+        self.api_key = api_key
+
+    def request(self, file_path):
+        with open(file_path, "rb") as file:
+            return self.session.post(
+                self.endpoint,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                files={"file": file},
+                data={
+                    "vad_model": "silero",
+                    "alignment_model": "tdnn_ffn",
+                    "preprocessing": "none",
+                    "temperature": "0",
+                    "timestamp_granularities": "word,segment",
+                    "audio_window_seconds": "5",
+                    "speculation_window_words": "4",
+                    "response_format": "verbose_json"
+                },
+                timeout=self.timeout,
+            )
+
+    @staticmethod
+    def parse(response_json):
+        timeline = WordTimeline()
+        for word in response_json["words"]:
+            timeline.append(word["word"], word["start"], word["end"])
+        return timeline
+
+
+class LocalWhisperTranscriber(Transcriber):
+    """
+    offline transcription on the cpu with faster-whisper (ctranslate2), int8-quantised by default.
+    the model is loaded on first use and shared; num_workers transcriptions can run on it at once.
+    """
+
+    name = "local"
+
+    def __init__(self, model="small.en", compute_type="int8", cpu_threads=0, num_workers=1, beam_size=1, language="en", trace_every=0):
+        self.model_name = model
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.num_workers = num_workers
+        self.beam_size = beam_size
+        self.language = language
+        self.trace_every = trace_every
+        self._model = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        """
+        returns whether faster-whisper is installed
+        """
+        return importlib.util.find_spec("faster_whisper") is not None
+
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                try:
+                    from faster_whisper import WhisperModel
+                except ImportError:
+                    raise TranscriptionError("the local transcriber needs faster-whisper (pip install -r requirements-local.txt)")
+                logging.info("loading whisper model %s (%s)", self.model_name, self.compute_type)
+                self._model = WhisperModel(
+                    self.model_name,
+                    device="cpu",
+                    compute_type=self.compute_type,
+                    cpu_threads=self.cpu_threads,
+                    num_workers=self.num_workers,
+                )
+            return self._model
+
+    def transcribe(self, file_path):
+        logging.debug("starting local transcription on file: %s", file_path)
+        segments, _ = self.model().transcribe(
+            file_path,
+            language=self.language,
+            beam_size=self.beam_size,
+            word_timestamps=True,
+            vad_filter=True,
+        )
+        timeline = WordTimeline()
+        # segments is a generator; decoding happens while it's consumed
+        for segment in segments:
+            for word in segment.words or ():
+                timeline.append(word.word.strip(), word.start, word.end)
+        logging.debug("local transcription finished: %d words", len(timeline))
+        trace_words(self.name, timeline, self.trace_every)
+        return timeline
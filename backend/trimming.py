@@ -0,0 +1,189 @@
+import os
+import math
+import bisect
+import logging
+import subprocess
+from probe import first_stream, media_duration
+
+# samples per frame for codecs whose packets are fixed-size frames, so cuts can be snapped to frame boundaries
+CODEC_FRAME_SIZES = {
+    "mp3": 1152,
+    "mp2": 1152,
+    "aac": 1024,
+    "ac3": 1536,
+    "eac3": 1536,
+    "opus": 960,
+}
+
+# ffprobe format names of containers the concat demuxer can stream-copy audio in and out of
+STREAM_COPY_FORMATS = {
+    "mp3",
+    "mov,mp4,m4a,3gp,3g2,mj2",
+    "matroska,webm",
+    "ogg",
+    "wav",
+    "aac",
+}
+
+# ffprobe format names of containers the concat demuxer can stream-copy video in and out of
+VIDEO_STREAM_COPY_FORMATS = {
+    "mov,mp4,m4a,3gp,3g2,mj2",
+    "matroska,webm",
+}
+
+# encoder arguments for re-encoding video, by output extension: cpu-only encoders at their fastest reasonable
+# settings, since only inputs that can't be stream-copied get here. anything not listed is encoded as h.264
+VIDEO_ENCODER_ARGS = {
+    ".webm": ["-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8", "-row-mt", "1", "-crf", "32", "-b:v", "0"],
+}
+
+
+def frame_seconds(media_info):
+    """
+    returns the duration of one audio frame in seconds if the input can be cut cleanly with stream copy, otherwise None
+    """
+    if media_info["format"].get("format_name") not in STREAM_COPY_FORMATS:
+        return None
+    stream = first_stream(media_info, "audio")
+    if stream is None:
+        return None
+    codec = stream.get("codec_name", "")
+    sample_rate = int(stream.get("sample_rate") or 0)
+    if not sample_rate:
+        return None
+    if codec.startswith("pcm_"):
+        # uncompressed audio can be cut at any sample
+        return 1 / sample_rate
+    frame_size = CODEC_FRAME_SIZES.get(codec)
+    if frame_size is None:
+        return None
+    return frame_size / sample_rate
+
+
+def keep_ranges(segments_to_remove, duration, frame_duration):
+    """
+    returns the (start, end) ranges left after removing segments_to_remove from [0, duration).
+    overlapping segments are merged, and every boundary is moved outwards to a frame boundary so the
+    kept audio is never clipped; ranges shorter than one frame are dropped.
+    """
+    merged = []
+    for start, end in sorted(segments_to_remove):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    ranges = []
+    position = 0.0
+    for start, end in merged + [[duration, duration]]:
+        range_start = math.floor(position / frame_duration) * frame_duration
+        range_end = min(duration, math.ceil(start / frame_duration) * frame_duration)
+        if range_end - range_start >= frame_duration:
+            ranges.append((range_start, range_end))
+        position = end
+    return ranges
+
+
+def write_concat_list(input_file, ranges, list_file):
+    """
+    writes an ffconcat script that plays each kept range of input_file in order
+    """
+    escaped_path = os.path.abspath(input_file).replace("'", "'\\''")
+    with open(list_file, "w") as f:
+        f.write("ffconcat version 1.0\n")
+        for start, end in ranges:
+            f.write(f"file '{escaped_path}'\n")
+            f.write(f"inpoint {start:.6f}\n")
+            f.write(f"outpoint {end:.6f}\n")
+
+
+def generate_stream_copy_trim_command(input_file, output_file, segments_to_remove, media_info, list_file):
+    """
+    builds an ffmpeg command that removes segments_to_remove by concatenating the kept ranges with stream copy
+    (no decode or re-encode). returns the command as an argument list, or None if the input's codec or container
+    can't be cut cleanly this way and the re-encode path has to be used instead.
+    """
+    frame_duration = frame_seconds(media_info)
+    if frame_duration is None:
+        logging.debug("input can't be stream-copied; codec/container not supported")
+        return None
+    duration = media_duration(media_info)
+    if duration is None:
+        logging.debug("input can't be stream-copied; duration unknown")
+        return None
+    ranges = keep_ranges(segments_to_remove, duration, frame_duration)
+    if not ranges:
+        logging.debug("nothing left to keep after removing segments")
+        return None
+    write_concat_list(input_file, ranges, list_file)
+    logging.debug("wrote concat list with %d kept ranges: %s", len(ranges), list_file)
+    return ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "concat", "-safe", "0", "-i", list_file,
+            "-map", "0:a", "-c", "copy", output_file]
+
+
+def snap_to_keyframes(ranges, keyframes, tolerance):
+    """
+    moves the start of each kept range to the nearest video keyframe, since stream-copied video can only start on one.
+    returns the new ranges, or None if a range has no keyframe within tolerance seconds of its start (or the
+    nearest one would overlap the previous range).
+    """
+    snapped = []
+    for start, end in ranges:
+        if start > 0:
+            index = bisect.bisect_left(keyframes, start)
+            candidates = keyframes[max(0, index - 1):index + 1]
+            if not candidates:
+                return None
+            keyframe = min(candidates, key=lambda candidate: abs(candidate - start))
+            if abs(keyframe - start) > tolerance or (snapped and keyframe < snapped[-1][1]):
+                return None
+            start = keyframe
+        if end > start:
+            snapped.append((start, end))
+    return snapped
+
+
+def generate_video_stream_copy_trim_command(input_file, output_file, segments_to_remove, media_info, keyframes, list_file, keyframe_tolerance=1.0):
+    """
+    builds an ffmpeg command that removes segments_to_remove from a video file by concatenating the kept ranges of
+    video and audio together with stream copy. each kept range starts on the video keyframe nearest its start.
+    returns the command as an argument list, or None if the container isn't supported or some range has no keyframe
+    within keyframe_tolerance seconds, in which case the re-encode path has to be used instead.
+    """
+    if media_info["format"].get("format_name") not in VIDEO_STREAM_COPY_FORMATS:
+        logging.debug("video can't be stream-copied; container not supported")
+        return None
+    duration = media_duration(media_info)
+    if duration is None:
+        logging.debug("video can't be stream-copied; duration unknown")
+        return None
+    # audio frame boundaries where the audio codec has fixed-size frames, otherwise milliseconds
+    frame_duration = frame_seconds(media_info) or 0.001
+    ranges = snap_to_keyframes(keep_ranges(segments_to_remove, duration, frame_duration), keyframes, keyframe_tolerance)
+    if ranges is None:
+        logging.debug("video can't be stream-copied; no keyframe within %ss of a kept range's start", keyframe_tolerance)
+        return None
+    if not ranges:
+        logging.debug("nothing left to keep after removing segments")
+        return None
+    write_concat_list(input_file, ranges, list_file)
+    logging.debug("wrote concat list with %d kept ranges starting on keyframes: %s", len(ranges), list_file)
+    return ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "concat", "-safe", "0", "-i", list_file,
+            "-map", "0:v:0", "-map", "0:a?", "-c", "copy", output_file]
+
+
+def video_encoder_args(output_file, preset="veryfast", crf=20):
+    """
+    returns the ffmpeg arguments for re-encoding the video of output_file, chosen by its extension
+    """
+    _, ext = os.path.splitext(output_file)
+    return VIDEO_ENCODER_ARGS.get(ext.lower(), ["-c:v", "libx264", "-preset", preset, "-crf", str(crf)])
+
+
+def run_ffmpeg(command):
+    """
+    runs an ffmpeg argument list, raising RuntimeError with ffmpeg's stderr if it fails
+    """
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode(errors="replace"))
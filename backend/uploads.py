@@ -0,0 +1,69 @@
+import os
+import hashlib
+import logging
+import tempfile
+from flask import Request
+from cache import hash_file
+
+
+class HashingFile:
+    """
+    wraps a file opened for writing and keeps a sha256 of everything written to it,
+    so an upload is hashed while it streams to disk instead of being read back afterwards
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self._digest = hashlib.sha256()
+
+    def write(self, data):
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class UploadRequest(Request):
+    """
+    request class that streams uploaded files straight into upload_dir in chunks, rather than spooling them in memory
+    and copying them afterwards. move_upload() renames the streamed file into place; any upload that wasn't moved
+    is deleted when the request closes.
+    """
+
+    upload_dir = "uploads"
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        os.makedirs(self.upload_dir, exist_ok=True)
+        stream = HashingFile(tempfile.NamedTemporaryFile(dir=self.upload_dir, prefix="upload_", suffix=".part", delete=False))
+        if not hasattr(self, "_upload_streams"):
+            self._upload_streams = []
+        self._upload_streams.append(stream)
+        return stream
+
+    def close(self):
+        super().close()
+        for stream in getattr(self, "_upload_streams", []):
+            if os.path.exists(stream.name):
+                os.remove(stream.name)
+                logging.debug("removed unused upload: %s", stream.name)
+
+
+def move_upload(file, destination):
+    """
+    moves an uploaded werkzeug file to destination and returns the sha256 of its bytes.
+    files streamed by UploadRequest are renamed without copying; anything else is saved and hashed in chunks.
+    """
+    stream = file.stream
+    if isinstance(stream, HashingFile):
+        stream.close()
+        os.replace(stream.name, destination)
+        return stream.hexdigest()
+    file.save(destination)
+    return hash_file(destination)
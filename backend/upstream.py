@@ -0,0 +1,114 @@
+import time
+import random
+import logging
+import threading
+import email.utils
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import UPSTREAM_RETRIES, UPSTREAM_THROTTLED
+
+# status codes worth retrying: throttling and transient server/gateway errors
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """
+    raised when an upstream call still fails after every retry
+    """
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_retry_after(value):
+    """
+    returns the wait in seconds from a Retry-After header (delta-seconds or an http date), or None
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def create_session(pool_size):
+    """
+    returns a requests session whose connection pool keeps up to pool_size connections alive per host
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class Upstream:
+    """
+    call policy for one upstream endpoint: at most max_concurrency calls in flight at once, and up to max_attempts
+    attempts per call with full-jitter exponential backoff. a Retry-After header on a throttled response is honoured
+    (up to max_retry_after seconds) instead of the computed backoff.
+    """
+
+    def __init__(self, name, max_concurrency=4, max_attempts=5, backoff_base=1.0, backoff_max=30.0, max_retry_after=120.0, retry_exceptions=(requests.ConnectionError, requests.Timeout)):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.retry_exceptions = retry_exceptions
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def backoff(self, attempt):
+        """
+        returns the full-jitter delay before retry number attempt (1-based)
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def call(self, attempt_func):
+        """
+        runs attempt_func() until it succeeds or attempts run out. attempt_func performs one request and either
+        returns a requests.Response or raises; responses with a retryable status and exceptions that are in
+        retry_exceptions, or carry a retryable status_code (like the openai sdk's errors), are retried.
+        returns the successful result, or raises UpstreamError / the last exception once attempts run out.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            status_code = None
+            retry_after = None
+            error = None
+            with self._slots:
+                try:
+                    result = attempt_func()
+                except self.retry_exceptions as e:
+                    error = e
+                except Exception as e:
+                    status_code = getattr(e, "status_code", None)
+                    if status_code not in RETRY_STATUSES:
+                        raise
+                    error = e
+                    response = getattr(e, "response", None)
+                    if response is not None:
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                else:
+                    if not isinstance(result, requests.Response) or result.status_code not in RETRY_STATUSES:
+                        return result
+                    status_code = result.status_code
+                    retry_after = parse_retry_after(result.headers.get("Retry-After"))
+                    error = UpstreamError(f"{self.name} returned {result.status_code}: {result.text[:500]}", status_code=status_code)
+
+            if status_code == 429:
+                UPSTREAM_THROTTLED.labels(upstream=self.name).inc()
+            if attempt == self.max_attempts:
+                logging.error("%s failed after %d attempts: %s", self.name, attempt, str(error))
+                raise error
+
+            delay = min(retry_after, self.max_retry_after) if retry_after is not None else self.backoff(attempt)
+            logging.warning("%s attempt %d failed (%s), retrying in %.2fs", self.name, attempt, status_code or type(error).__name__, delay)
+            UPSTREAM_RETRIES.labels(upstream=self.name).inc()
+            time.sleep(delay)